@@ -108,14 +108,8 @@ export async function searchRegulations(query: string) {
             return { error: 'Daily limit reached.' }
         }
 
-        const { getEmbedding } = await import("@/lib/embeddings")
-        const embedding = await getEmbedding(query)
-
-        const { data: documents, error } = await supabase.rpc('match_documents', {
-            query_embedding: embedding,
-            match_threshold: 0.1,
-            match_count: 10
-        })
+        const { cachedHybridSearch } = await import("@/lib/search")
+        const { data: documents, error } = await cachedHybridSearch(supabase, query, 10, 0.1)
 
         if (error) throw error
 
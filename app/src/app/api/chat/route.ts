@@ -29,14 +29,15 @@ export async function POST(req: Request) {
         }
 
         // 2. Vector Search (Real RAG Implementation)
-        const { getEmbedding } = await import("@/lib/embeddings")
-        const embedding = await getEmbedding(latestMessage)
-
-        const { data: documents, error: searchError } = await supabase.rpc('match_documents', {
-            query_embedding: embedding,
-            match_threshold: 0.1, // Adjusted for broader matching during initial build
-            match_count: 5
-        })
+        // Hybrid search: exact citation lookup ("FAR 52.212-4"), else full-text + vector rank fusion.
+        // Repeated questions are served from the query cache without a new embedding.
+        const { cachedHybridSearch } = await import("@/lib/search")
+        const { data: documents, error: searchError } = await cachedHybridSearch(
+            supabase,
+            latestMessage,
+            5,
+            0.1 // Adjusted for broader matching during initial build
+        )
 
         if (searchError) {
             console.error('Vector Search Error:', searchError)
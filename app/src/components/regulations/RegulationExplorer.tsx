@@ -1,10 +1,9 @@
 'use client'
 
-import React, { useState } from 'react'
+import React, { useEffect, useState } from 'react'
 import { motion, AnimatePresence } from 'framer-motion'
-import { ChevronRight, ChevronDown, FileText, Folder } from 'lucide-react'
+import { ChevronRight, ChevronDown, FileText, Folder, Loader2 } from 'lucide-react'
 import { cn } from '@/lib/utils'
-import structureData from '@/data/regulations.json'
 
 // Types for our regulation tree
 export type RegulationNode = {
@@ -14,29 +13,65 @@ export type RegulationNode = {
     children?: RegulationNode[]
 }
 
-const DATA = structureData as RegulationNode[]
+// One entry per regulation in public/data/regulations/index.json (see scripts/generate_structure.py)
+type RegulationIndexEntry = {
+    id: string
+    title: string
+    type: string
+    shard: string
+    hash: string
+    nodes: number
+}
+
+const STRUCTURE_BASE = '/data/regulations'
 
 interface TreeNodeProps {
     node: RegulationNode
     level?: number
+    // Regulation roots load their tree on first expand
+    shard?: RegulationIndexEntry
 }
 
-function TreeNode({ node, level = 0 }: TreeNodeProps) {
+function TreeNode({ node, level = 0, shard }: TreeNodeProps) {
     const [isOpen, setIsOpen] = useState(false)
-    const hasChildren = node.children && node.children.length > 0
+    const [loaded, setLoaded] = useState<RegulationNode | null>(null)
+    const [isLoading, setIsLoading] = useState(false)
+    const current = loaded ?? node
+    const hasChildren = !!shard || (current.children && current.children.length > 0)
     const isSection = node.type === 'topic' || node.type === 'section'
 
+    const toggle = async () => {
+        if (!hasChildren) return
+        if (shard && !loaded && !isLoading) {
+            setIsLoading(true)
+            try {
+                // The hash changes whenever the tree does, so the shard can be cached indefinitely
+                const res = await fetch(`${STRUCTURE_BASE}/${shard.shard}?v=${shard.hash}`)
+                if (!res.ok) throw new Error(`HTTP ${res.status}`)
+                setLoaded(await res.json())
+            } catch (error) {
+                console.error(`Failed to load ${shard.id} structure:`, error)
+                setIsLoading(false)
+                return
+            }
+            setIsLoading(false)
+        }
+        setIsOpen(!isOpen)
+    }
+
     return (
         <div className="w-full select-none">
             <div
-                onClick={() => hasChildren && setIsOpen(!isOpen)}
+                onClick={toggle}
                 className={cn(
                     "flex items-center py-1.5 px-2 cursor-pointer hover:bg-accent hover:text-accent-foreground rounded-sm transition-colors text-sm",
                     level > 0 && "ml-4"
                 )}
             >
                 <span className="mr-1.5 text-muted-foreground">
-                    {hasChildren ? (
+                    {isLoading ? (
+                        <Loader2 className="h-4 w-4 animate-spin" />
+                    ) : hasChildren ? (
                         isOpen ? <ChevronDown className="h-4 w-4" /> : <ChevronRight className="h-4 w-4" />
                     ) : (
                         <div className="w-4" /> /* Spacer */
@@ -55,7 +90,7 @@ function TreeNode({ node, level = 0 }: TreeNodeProps) {
             </div>
 
             <AnimatePresence initial={false}>
-                {isOpen && hasChildren && (
+                {isOpen && current.children && current.children.length > 0 && (
                     <motion.div
                         initial={{ height: 0, opacity: 0 }}
                         animate={{ height: 'auto', opacity: 1 }}
@@ -63,7 +98,7 @@ function TreeNode({ node, level = 0 }: TreeNodeProps) {
                         transition={{ duration: 0.2, ease: "easeInOut" }}
                         className="overflow-hidden"
                     >
-                        {node.children!.map((child) => (
+                        {current.children.map((child) => (
                             <TreeNode key={child.id} node={child} level={level + 1} />
                         ))}
                     </motion.div>
@@ -74,14 +109,27 @@ function TreeNode({ node, level = 0 }: TreeNodeProps) {
 }
 
 export function RegulationExplorer() {
+    const [regulations, setRegulations] = useState<RegulationIndexEntry[]>([])
+
+    useEffect(() => {
+        fetch(`${STRUCTURE_BASE}/index.json`)
+            .then((res) => (res.ok ? res.json() : []))
+            .then(setRegulations)
+            .catch((error) => console.error('Failed to load regulation index:', error))
+    }, [])
+
     return (
         <div className="h-full flex flex-col bg-sidebar border-r border-sidebar-border w-80 text-sidebar-foreground">
             <div className="p-4 border-b border-sidebar-border">
                 <h2 className="font-semibold tracking-tight text-sm uppercase text-muted-foreground">Regulation Explorer</h2>
             </div>
             <div className="flex-1 overflow-y-auto p-2 scrollbar-thin scrollbar-thumb-muted scrollbar-track-transparent">
-                {DATA.map((node) => (
-                    <TreeNode key={node.id} node={node} />
+                {regulations.map((entry) => (
+                    <TreeNode
+                        key={entry.id}
+                        node={{ id: entry.id, title: entry.title, type: entry.type }}
+                        shard={entry}
+                    />
                 ))}
             </div>
         </div>
@@ -1,5 +1,14 @@
 import OpenAI from 'openai'
 
+/**
+ * Identifies the embedding space ("model:dimensions"), as the ingestion
+ * scripts and the query cache record it.
+ */
+export function embeddingModelKey(): string {
+    const model = process.env.EMBEDDING_MODEL || 'openai/text-embedding-3-small'
+    return `${model}:${parseInt(process.env.EMBEDDING_DIM || '1536')}`
+}
+
 /**
  * Generates an embedding for a given text using OpenRouter (OpenAI-compatible).
  */
@@ -0,0 +1,64 @@
+import type { SupabaseClient } from '@supabase/supabase-js'
+import { embeddingModelKey, getEmbedding } from '@/lib/embeddings'
+import { createSupabaseAdminClient } from '@/lib/supabase-server'
+
+export interface SearchResult {
+    id: number
+    content: string
+    metadata: any
+    similarity: number
+    score: number
+    match_type: string
+}
+
+/**
+ * hybrid_search through the query cache (supabase/migrations/20261018050000_query_cache.sql).
+ *
+ * A cached question is answered without an embeddings call or a search.
+ * On a miss the question is embedded here and query_cache_fill runs the
+ * search and caches it. Fill is granted to the service role only (a
+ * client-supplied vector must never populate a shared entry), so it goes
+ * through the admin client and is skipped when no service role key is
+ * configured. If the cache functions are not deployed (or fail), this is a
+ * plain hybrid_search call.
+ */
+export async function cachedHybridSearch(
+    supabase: SupabaseClient,
+    query: string,
+    matchCount: number,
+    matchThreshold = 0.1,
+): Promise<{ data: SearchResult[], error: any, cached: boolean }> {
+    const model = embeddingModelKey()
+    const { data: cached, error: lookupError } = await supabase.rpc('query_cache_lookup', {
+        query_text: query,
+        embedding_model: model,
+        match_threshold: matchThreshold,
+        match_count: matchCount
+    })
+
+    if (lookupError) {
+        console.warn('Query cache lookup failed, searching directly:', lookupError.message)
+    } else if (cached?.length) {
+        return { data: cached, error: null, cached: true }
+    }
+
+    const embedding = await getEmbedding(query)
+    const params = {
+        query_text: query,
+        query_embedding: embedding,
+        match_threshold: matchThreshold,
+        match_count: matchCount
+    }
+
+    if (!lookupError && process.env.SUPABASE_SERVICE_ROLE_KEY) {
+        const admin = createSupabaseAdminClient()
+        const { data, error } = await admin.rpc('query_cache_fill', { ...params, embedding_model: model })
+        if (!error) {
+            return { data: data || [], error: null, cached: false }
+        }
+        console.warn('Query cache fill failed, searching directly:', error.message)
+    }
+
+    const { data, error } = await supabase.rpc('hybrid_search', params)
+    return { data: data || [], error, cached: false }
+}
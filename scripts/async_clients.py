@@ -0,0 +1,273 @@
+"""
+Pooled, keep-alive HTTP sessions for OpenRouter embeddings and the Supabase REST API.
+
+One asyncio event loop runs on a background thread for the whole process,
+and each endpoint gets a single httpx.AsyncClient on it. Every request in
+a run, from any thread, goes over that endpoint's connection pool, so
+connections and TLS sessions are set up once rather than per client or
+per topic, and many requests can be in flight without a thread each.
+
+The scripts stay synchronous:
+  - PooledEmbeddingClient is a drop-in for `OpenAI` as the ingestion code
+    uses it (`embeddings.create`, `with_options`), so RateLimitedClient
+    and EmbeddingBatcher work unchanged on top of it.
+  - PooledRestClient inserts rows through PostgREST. `insert` blocks;
+    `submit` returns a concurrent.futures.Future, which AsyncChunkWriter
+    uses to keep several batches in flight while callers keep buffering.
+
+`report()` lists each session's HTTP requests, the connections it had to
+open (every other request reused a pooled one) and its peak in flight.
+
+Environment:
+  ASYNC_HTTP              set to 0 to use the SDKs' own synchronous clients
+  HTTP_MAX_CONNECTIONS    pooled connections per endpoint (default 32)
+  HTTP_KEEPALIVE_SECONDS  idle time before a pooled connection is closed (default 60)
+  HTTP_TIMEOUT_SECONDS    per-request timeout (default 120)
+"""
+
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+ASYNC_HTTP = os.environ.get("ASYNC_HTTP", "1") != "0"
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", "60"))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", "120"))
+
+
+class RestError(Exception):
+    """A PostgREST error response."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+
+
+class SessionStats:
+    """Requests, new connections and concurrency for one pooled session."""
+
+    def __init__(self, name: str, host: str):
+        self.name = name
+        self.host = host
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    async def on_request(self, request):
+        with self._lock:
+            self.requests += 1
+        # httpcore reports connection events to a per-request trace callback
+        request.extensions["trace"] = self._trace
+
+    async def on_response(self, response):
+        if response.status_code >= 400:
+            with self._lock:
+                self.errors += 1
+
+    async def _trace(self, event: str, info: Dict):
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections += 1
+
+    async def track(self, awaitable: Awaitable) -> Any:
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await awaitable
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @property
+    def reused(self) -> int:
+        return max(0, self.requests - self.connections)
+
+    def report(self) -> str:
+        share = 100.0 * self.reused / self.requests if self.requests else 0.0
+        return (
+            f"HTTP {self.name} ({self.host}): {self.requests} requests over {self.connections} connections "
+            f"({share:.0f}% reused), peak {self.peak_in_flight} in flight, {self.errors} error responses"
+        )
+
+
+class EventLoopThread:
+    """An asyncio loop on a daemon thread, driven from synchronous code."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="async-http", daemon=True)
+        self._thread.start()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro) -> Any:
+        return self.submit(coro).result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def _http_client(stats: SessionStats, **kwargs):
+    import httpx
+
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        ),
+        timeout=HTTP_TIMEOUT_SECONDS,
+        event_hooks={"request": [stats.on_request], "response": [stats.on_response]},
+        **kwargs,
+    )
+
+
+class _PooledEmbeddings:
+    def __init__(self, owner: "PooledEmbeddingClient"):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner.run(self._owner.client.embeddings.create(**kwargs))
+
+
+class PooledEmbeddingClient:
+    """Drop-in for `OpenAI` as the ingestion scripts use it, over one pooled AsyncOpenAI session."""
+
+    def __init__(self, client, stats: SessionStats, loop: EventLoopThread):
+        self.client = client
+        self.stats = stats
+        self._loop = loop
+        self.embeddings = _PooledEmbeddings(self)
+
+    def with_options(self, **kwargs) -> "PooledEmbeddingClient":
+        # AsyncOpenAI.with_options copies the client but keeps its http_client, and so the pool
+        return PooledEmbeddingClient(self.client.with_options(**kwargs), self.stats, self._loop)
+
+    def run(self, coro) -> Any:
+        return self._loop.run(self.stats.track(coro))
+
+
+class PooledRestClient:
+    """Just the PostgREST calls the chunk writers make, over one pooled session."""
+
+    def __init__(self, http, stats: SessionStats, loop: EventLoopThread):
+        self.http = http
+        self.stats = stats
+        self._loop = loop
+
+    async def insert_async(self, table: str, rows: List[Dict], returning: str = "id") -> List[Dict]:
+        response = await self.http.post(
+            f"/{table}",
+            params={"select": returning},
+            content=json.dumps(rows),
+            headers={"Prefer": "return=representation"},
+        )
+        if response.status_code >= 400:
+            raise RestError(response.status_code, response.text[:500])
+        return response.json()
+
+    def insert(self, table: str, rows: List[Dict], returning: str = "id") -> List[Dict]:
+        return self.run(self.insert_async(table, rows, returning))
+
+    def run(self, coro) -> Any:
+        return self._loop.run(self.stats.track(coro))
+
+    def submit(self, coro) -> Future:
+        return self._loop.submit(self.stats.track(coro))
+
+
+_loop: Optional[EventLoopThread] = None
+_sessions: Dict[Tuple[str, str, str], Any] = {}
+_lock = threading.RLock()
+
+
+def shared_loop() -> EventLoopThread:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = EventLoopThread()
+        return _loop
+
+
+async def _create(factory):
+    # Build clients on the loop they will run on
+    return factory()
+
+
+def pooled_embedding_client(base_url: str, api_key: str) -> PooledEmbeddingClient:
+    """The process's embeddings session for this endpoint, created on first use."""
+    key = ("embeddings", base_url, api_key)
+    with _lock:
+        if key not in _sessions:
+            from openai import AsyncOpenAI
+
+            loop = shared_loop()
+            stats = SessionStats("embeddings", urlsplit(base_url).netloc)
+            client = loop.run(_create(lambda: AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                http_client=_http_client(stats),
+                max_retries=0,
+            )))
+            _sessions[key] = PooledEmbeddingClient(client, stats, loop)
+        return _sessions[key]
+
+
+def pooled_rest_client(supabase_url: str, supabase_key: str) -> PooledRestClient:
+    """The process's Supabase REST session for this project, created on first use."""
+    key = ("rest", supabase_url, supabase_key)
+    with _lock:
+        if key not in _sessions:
+            loop = shared_loop()
+            stats = SessionStats("rest", urlsplit(supabase_url).netloc)
+            http = loop.run(_create(lambda: _http_client(
+                stats,
+                base_url=f"{supabase_url.rstrip('/')}/rest/v1",
+                headers={
+                    "apikey": supabase_key,
+                    "Authorization": f"Bearer {supabase_key}",
+                    "Content-Type": "application/json",
+                },
+            )))
+            _sessions[key] = PooledRestClient(http, stats, loop)
+        return _sessions[key]
+
+
+def session_stats() -> List[SessionStats]:
+    with _lock:
+        return [session.stats for session in _sessions.values()]
+
+
+def report() -> str:
+    return "\n".join(stats.report() for stats in session_stats())
+
+
+async def _close_sessions(sessions: List[Any]):
+    for session in sessions:
+        if isinstance(session, PooledEmbeddingClient):
+            await session.client.close()
+        else:
+            await session.http.aclose()
+
+
+def close_sessions():
+    """Closes every pooled session and stops the loop; the next use starts fresh."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            return
+        _loop.run(_close_sessions(list(_sessions.values())))
+        _loop.close()
+        _loop = None
+        _sessions.clear()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Parity check and micro-benchmark for the HTML content extractors.
+
+Compares the lxml extractor (html_extract.HtmlContentExtractor) against the
+original BeautifulSoup implementation on a corpus of HTML topics and
+reports any text mismatches plus files/sec for both.
+
+Usage:
+    python bench_extract.py ../source_content/FAR_dita_html
+    python bench_extract.py --synthetic 500     # generated FAR-like fixtures
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from bs4 import BeautifulSoup
+
+from html_extract import HtmlContentExtractor
+
+
+def soup_extract_text(html_path: Path) -> str:
+    """Reference implementation: the BeautifulSoup extractor the ingest scripts used to ship."""
+    with open(html_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f, 'lxml')
+        for nav in soup.find_all('nav'):
+            nav.decompose()
+        main = soup.find('main') or soup.find('article') or soup.body
+        if not main:
+            return ""
+        return main.get_text(separator=' ', strip=True)
+
+
+def write_synthetic_corpus(directory: Path, count: int, seed: int = 0) -> List[Path]:
+    """FAR-like topics: nav, headings, nested lists, tables, inline markup and entities."""
+    rng = random.Random(seed)
+    words = ("contracting officer shall agency head offeror proposal price "
+             "certified cost data acquisition small business clause solicitation").split()
+    paths = []
+    for i in range(count):
+        part = rng.randint(1, 53)
+        section = f"{part}.{rng.randint(100, 999)}-{rng.randint(1, 9)}"
+        paras = []
+        for p in range(rng.randint(2, 12)):
+            body = " ".join(rng.choice(words) for _ in range(rng.randint(20, 120)))
+            paras.append(f"<p>({chr(97 + p % 26)}) {body} <i>see</i> [FAR {section}]&nbsp;&amp; more.</p>")
+        items = "".join(
+            f"<li>({n}) {rng.choice(words)} <p>{' '.join(rng.choice(words) for _ in range(15))}</p></li>"
+            for n in range(rng.randint(0, 5))
+        )
+        html = (
+            "<!DOCTYPE html><html><head><title>t</title><script>var x = 1;</script></head><body>"
+            "<nav><ul><li><a href='#'>Home</a></li><li>Parts</li></ul></nav>"
+            f"<main><h1>{section} Topic {i}.</h1>{''.join(paras)}<ul>{items}</ul>"
+            "<table><tr><th>Threshold</th><td>$10,000</td></tr></table>"
+            "<!-- generated --></main></body></html>"
+        )
+        path = directory / f"{section}_{i}.html"
+        path.write_text(html, encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+def time_extractor(fn: Callable[[Path], str], paths: List[Path]) -> float:
+    start = time.perf_counter()
+    for path in paths:
+        fn(path)
+    elapsed = time.perf_counter() - start
+    return len(paths) / elapsed if elapsed else float("inf")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("html_dir", nargs="?", type=Path, help="Directory of HTML topics (searched recursively)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate N synthetic topics instead")
+    parser.add_argument("--limit", type=int, default=0, help="Only use the first N files")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.synthetic:
+        tmp = tempfile.TemporaryDirectory()
+        paths = write_synthetic_corpus(Path(tmp.name), args.synthetic)
+    elif args.html_dir:
+        paths = sorted(args.html_dir.rglob("*.html"))
+    else:
+        parser.error("pass an HTML directory or --synthetic N")
+    if args.limit:
+        paths = paths[:args.limit]
+    if not paths:
+        print("No HTML files found.")
+        return 1
+
+    mismatches = 0
+    for path in paths:
+        expected = soup_extract_text(path)
+        actual = HtmlContentExtractor.extract_text(path)
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 5:
+                at = next((i for i, (a, b) in enumerate(zip(expected, actual)) if a != b), min(len(expected), len(actual)))
+                print(f"MISMATCH {path.name} at char {at}:")
+                print(f"  soup: {expected[max(0, at - 40):at + 40]!r}")
+                print(f"  lxml: {actual[max(0, at - 40):at + 40]!r}")
+
+    soup_rate = time_extractor(soup_extract_text, paths)
+    lxml_rate = time_extractor(HtmlContentExtractor.extract_text, paths)
+    blocks_rate = time_extractor(HtmlContentExtractor.extract_blocks, paths)
+
+    print(f"\nFiles: {len(paths)}  parity mismatches: {mismatches}")
+    print(f"  BeautifulSoup extract_text : {soup_rate:>9.1f} files/sec")
+    print(f"  lxml extract_text          : {lxml_rate:>9.1f} files/sec ({lxml_rate / soup_rate:.1f}x)")
+    print(f"  lxml extract_blocks        : {blocks_rate:>9.1f} files/sec")
+
+    if tmp:
+        tmp.cleanup()
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,663 @@
+#!/usr/bin/env python3
+"""
+Reproducible ingestion benchmark.
+
+Generates a synthetic regulation (a DITA map with Part/Subpart/section
+topicrefs, one HTML topic per section and VAAR-style PDFs) from a fixed
+seed, then runs each ingestion stage against local stand-ins for
+OpenRouter (an in-process HTTP server speaking the embeddings API) and
+Supabase (an in-memory table that JSON-encodes each insert):
+
+    walk      DitaMapParser.walk over the map             per topic
+    extract   extract_item (HTML -> blocks -> chunks)     per topic
+    pdf       parse_va_pdf over the sample PDFs           per section
+    embed     EmbeddingBatcher against the local server   per batch request
+    insert    ChunkWriter against the in-memory table     per insert request
+    pipeline  IngestPipeline end to end                   (throughput only)
+    startup   `farchat.py <command> --help` cold start    per run
+
+Each stage runs in a fresh process so its peak RSS is its own. The report
+is JSON (throughput, p50/p99 latency, peak RSS per stage, plus run
+metadata) so runs can be diffed over time.
+
+Usage:
+    python bench_ingest.py --topics 1000 --output bench-1k.json
+    python bench_ingest.py --topics 50000 --corpus-dir /tmp/farbench --stages walk,extract
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ("walk", "extract", "pdf", "embed", "insert", "pipeline", "startup")
+# SDKs the CLI must not import before a subcommand actually needs the network
+HEAVY_MODULES = ("openai", "supabase", "tqdm", "bs4", "psycopg")
+STARTUP_RUNS = 5
+CORPUS_VERSION = 1
+REGULATION = "BENCH"
+
+WORDS = (
+    "contracting officer shall agency head offeror proposal price certified cost "
+    "pricing data acquisition small business clause solicitation contractor award "
+    "government requirement subcontract evaluation factor schedule delivery"
+).split()
+
+
+def _sentence(rng: random.Random, low: int = 12, high: int = 40) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(low, high))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def topic_html(rng: random.Random, section: str, title: str) -> str:
+    """A FAR-like topic: nav, numbered heading, lettered paragraphs, a list and a table."""
+    paras = []
+    for p in range(rng.randint(2, 10)):
+        body = " ".join(_sentence(rng) for _ in range(rng.randint(1, 4)))
+        cite = f"{section.split('.')[0]}.{rng.randint(100, 999)}"
+        paras.append(f"<p>({chr(97 + p % 26)}) {body} See <a href='#'>[FAR {cite}]</a>&nbsp;&amp; <i>related</i>.</p>")
+    items = "".join(f"<li>({n + 1}) {_sentence(rng, 6, 20)}</li>" for n in range(rng.randint(0, 6)))
+    table = (
+        "<table><tr><th>Threshold</th><td>$250,000</td></tr><tr><th>Authority</th><td>HCA</td></tr></table>"
+        if rng.random() < 0.2 else ""
+    )
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>{0}</title>"
+        "<script>var nav = 1;</script></head><body>"
+        "<nav><ul><li><a href='#'>Home</a></li><li><a href='#'>Parts</a></li></ul></nav>"
+        "<main><h1>{1} {0}</h1>{2}<ul>{3}</ul>{4}</main></body></html>"
+    ).format(title, section, "".join(paras), items, table)
+
+
+def write_pdf(path: Path, pages: List[List[str]]):
+    """Minimal text-only PDF (Helvetica, one text object per page) without a PDF library."""
+    objects: List[Optional[bytes]] = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", None]
+    kids = []
+    for lines in pages:
+        ops = ["BT /F1 9 Tf 11 TL 40 760 Td"]
+        for line in lines:
+            ops.append("(%s) Tj T*" % line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)"))
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 1 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref)
+    path.write_bytes(bytes(out))
+
+
+def pdf_pages(rng: random.Random, part: int, page_count: int) -> List[List[str]]:
+    pages = [[f"PART {part} - SYNTHETIC ACQUISITION PART", "Table of contents"]]
+    section = 0
+    for _ in range(page_count - 1):
+        lines = []
+        while len(lines) < 60:
+            if rng.random() < 0.15:
+                section += 1
+                lines.append(f"{part}.{100 + section:03d} {_sentence(rng, 3, 6)[:-1]}")
+            sentence = _sentence(rng, 10, 30)
+            lines.extend(sentence[i:i + 110] for i in range(0, len(sentence), 110))
+        pages.append(lines[:60])
+    return pages
+
+
+def write_corpus(root: Path, topics: int, pdfs: int, pages_per_pdf: int, seed: int) -> Dict:
+    """Writes the corpus under `root` (reusing it when the parameters match) and returns its description."""
+    params = {"version": CORPUS_VERSION, "topics": topics, "pdfs": pdfs, "pages_per_pdf": pages_per_pdf, "seed": seed}
+    stamp = root / "corpus.json"
+    map_dir, html_dir, pdf_dir = root / f"{REGULATION}_dita", root / f"{REGULATION}_dita_html", root / "pdf"
+    corpus = {
+        "root": str(root),
+        "map_path": str(map_dir / f"{REGULATION}.ditamap"),
+        "html_dir": str(html_dir),
+        "pdf_dir": str(pdf_dir),
+        "params": params,
+    }
+    if stamp.exists() and json.loads(stamp.read_text()) == params:
+        return corpus
+
+    for directory in (map_dir, html_dir, pdf_dir):
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True)
+
+    rng = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<map title="{REGULATION}">']
+    written = 0
+    part = 0
+    while written < topics:
+        part += 1
+        lines.append(f'<topicref navtitle="PART {part} - {rng.choice(WORDS).title()}" href="Part_{part}.dita" outputclass="part">')
+        for subpart in range(1, rng.randint(2, 6)):
+            if written >= topics:
+                break
+            lines.append(f'<topicref navtitle="Subpart {part}.{subpart}" href="Subpart_{part}.{subpart}.dita" outputclass="subpart">')
+            for n in range(rng.randint(5, 40)):
+                if written >= topics:
+                    break
+                section = f"{part}.{subpart}{n:02d}" + (f"-{rng.randint(1, 9)}" if rng.random() < 0.3 else "")
+                title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).title()
+                href = f"{section}.dita"
+                lines.append(f'<topicref navtitle="{section} {title}" href="{href}" outputclass="section"/>')
+                (html_dir / f"{section}.html").write_text(topic_html(rng, section, title), encoding="utf-8")
+                written += 1
+            lines.append("</topicref>")
+        lines.append("</topicref>")
+    lines.append("</map>")
+    Path(corpus["map_path"]).write_text("\n".join(lines), encoding="utf-8")
+
+    for i in range(pdfs):
+        part = 801 + i
+        write_pdf(pdf_dir / f"vaar-{part}.pdf", pdf_pages(rng, part, pages_per_pdf))
+
+    stamp.write_text(json.dumps(params))
+    return corpus
+
+
+def synthetic_chunks(count: int, seed: int) -> List[str]:
+    """Chunk-sized texts (~900 characters) for the embed and insert stages."""
+    rng = random.Random(seed)
+    texts = []
+    for i in range(count):
+        text = f"{i // 50 + 1}.{100 + i % 50:03d} "
+        while len(text) < 900:
+            text += _sentence(rng) + " "
+        texts.append(text.strip())
+    return texts
+
+
+class _EmbeddingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    dimensions = 1536
+    max_inputs = 0            # larger requests get a 413, as a provider's size limit would
+    requests: Optional[List[List[str]]] = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        if self.requests is not None:
+            self.requests.append(inputs)
+        if self.max_inputs and len(inputs) > self.max_inputs:
+            self._reply(413, {"error": {"message": f"Too many inputs: at most {self.max_inputs} per request"}})
+            return
+        dims = body.get("dimensions") or self.dimensions
+        if self.latency:
+            time.sleep(self.latency)
+        vector = array("f", [1.0 / dims] * dims)
+        if body.get("encoding_format") == "base64":
+            encoded = [base64.b64encode(self._tag(vector, text).tobytes()).decode() for text in inputs]
+        else:
+            encoded = [self._tag(vector, text).tolist() for text in inputs]
+        data = [{"object": "embedding", "index": i, "embedding": e} for i, e in enumerate(encoded)]
+        self._reply(200, {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", ""),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    @staticmethod
+    def _tag(vector: array, text: str) -> array:
+        """The shared vector with its first component derived from the text, so results can be matched up."""
+        tagged = array("f", vector)
+        tagged[0] = zlib.crc32(text.encode("utf-8")) % 65536
+        return tagged
+
+    def _reply(self, status: int, body: Dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class LocalEmbeddingServer:
+    """OpenAI-compatible /v1/embeddings endpoint with a fixed per-request latency."""
+
+    def __init__(self, latency_ms: float, dimensions: int, max_inputs: int = 0, record: bool = False):
+        # Every request's inputs, in arrival order (kept only when asked: the benchmark measures RSS)
+        self.requests: Optional[List[List[str]]] = [] if record else None
+        handler = type("Handler", (_EmbeddingHandler,), {
+            "latency": latency_ms / 1000,
+            "dimensions": dimensions,
+            "max_inputs": max_inputs,
+            "requests": self.requests,
+        })
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _InsertQuery:
+    def __init__(self, table: "LocalTable", rows: List[Dict]):
+        self.table = table
+        self.rows = rows
+
+    def execute(self):
+        t0 = time.perf_counter()
+        # PostgREST clients serialize the whole batch; do the same so the cost is counted
+        payload = json.dumps(self.rows)
+        if self.table.latency:
+            time.sleep(self.table.latency)
+        with self.table.lock:
+            start = self.table.next_id
+            self.table.next_id += len(self.rows)
+            self.table.bytes += len(payload)
+            self.table.requests.append(time.perf_counter() - t0)
+        return _Result([{"id": start + i} for i in range(len(self.rows))])
+
+
+class LocalTable:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.bytes = 0
+        self.requests: List[float] = []
+
+    def insert(self, rows: List[Dict]) -> _InsertQuery:
+        return _InsertQuery(self, rows)
+
+
+class LocalSupabase:
+    """Just enough of the supabase-py client for ChunkWriter."""
+
+    def __init__(self, latency_ms: float):
+        self.tables: Dict[str, LocalTable] = {}
+        self.latency = latency_ms / 1000
+
+    def table(self, name: str) -> LocalTable:
+        return self.tables.setdefault(name, LocalTable(self.latency))
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak RSS of this process or any of its (finished) worker processes."""
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(items: int, seconds: float, latencies: List[float], unit: str, **extra) -> Dict:
+    result = {
+        "items": items,
+        "seconds": round(seconds, 4),
+        "throughput_per_s": round(items / seconds, 2) if seconds else None,
+        "latency_unit": unit,
+        "p50_ms": None,
+        "p99_ms": None,
+    }
+    if latencies:
+        result["p50_ms"] = round(percentile(latencies, 50) * 1000, 4)
+        result["p99_ms"] = round(percentile(latencies, 99) * 1000, 4)
+    result.update(extra)
+    return result
+
+
+def _walk_items(corpus: Dict) -> List[Dict]:
+    from ingest_common import DitaMapParser
+    return list(DitaMapParser(Path(corpus["map_path"]), Path(corpus["html_dir"])).walk())
+
+
+def stage_walk(corpus: Dict, opts: Dict) -> Dict:
+    from ingest_common import DitaMapParser
+
+    latencies = []
+    start = last = time.perf_counter()
+    parser = DitaMapParser(Path(corpus["map_path"]), Path(corpus["html_dir"]))
+    count = 0
+    for _ in parser.walk():
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+        count += 1
+    return summarize(count, time.perf_counter() - start, latencies, "topic")
+
+
+def stage_extract(corpus: Dict, opts: Dict) -> Dict:
+    from ingest_all import extract_item
+
+    items = _walk_items(corpus)
+    latencies = []
+    chunks = 0
+    chars = 0
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        result = extract_item(item)
+        latencies.append(time.perf_counter() - t0)
+        chunks += len(result)
+        chars += sum(len(text) for text, _ in result)
+    return summarize(len(items), time.perf_counter() - start, latencies, "topic", chunks=chunks, chars=chars)
+
+
+def stage_pdf(corpus: Dict, opts: Dict) -> Dict:
+    from ingest_va_pdf import parse_va_pdf
+
+    paths = sorted(Path(corpus["pdf_dir"]).glob("*.pdf"))
+    latencies = []
+    sections = 0
+    workers = opts["pdf_workers"]
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for path in paths:
+            last = time.perf_counter()
+            for _ in parse_va_pdf(path, executor):
+                now = time.perf_counter()
+                latencies.append(now - last)
+                last = now
+                sections += 1
+    finally:
+        if executor:
+            executor.shutdown()
+    return summarize(sections, time.perf_counter() - start, latencies, "section", pdfs=len(paths))
+
+
+def _embedding_client(server: LocalEmbeddingServer, opts: Dict):
+    from async_clients import ASYNC_HTTP, pooled_embedding_client
+    from rate_limit import AdaptiveConcurrency, RateLimitedClient
+
+    # Fixed concurrency so runs are comparable; the stand-in never throttles
+    concurrency = opts["embed_concurrency"]
+    controller = AdaptiveConcurrency(initial=concurrency, maximum=concurrency)
+    # Same client the ingest scripts get from create_embedding_client
+    if ASYNC_HTTP:
+        return RateLimitedClient(pooled_embedding_client(server.base_url, "bench"), controller)
+    from openai import OpenAI
+
+    return RateLimitedClient(OpenAI(base_url=server.base_url, api_key="bench"), controller)
+
+
+def stage_embed(corpus: Dict, opts: Dict) -> Dict:
+    from embedding_batcher import EmbeddingBatcher
+
+    texts = synthetic_chunks(opts["chunks"], opts["seed"])
+    latencies = []
+    lock = threading.Lock()
+    with LocalEmbeddingServer(opts["embed_latency_ms"], opts["dimensions"]) as server:
+        batcher = EmbeddingBatcher(_embedding_client(server, opts), opts["model"], opts["dimensions"])
+        batches = []
+        for i, text in enumerate(texts):
+            ready = batcher.collect(text, i)
+            if ready:
+                batches.append(ready)
+        batches.append(batcher.take())
+
+        def embed(batch):
+            t0 = time.perf_counter()
+            batcher.embed_batch(batch)
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=opts["embed_concurrency"]) as pool:
+            list(pool.map(embed, batches))
+        seconds = time.perf_counter() - start
+    client = batcher.client.client
+    connections = client.stats.connections if hasattr(client, "stats") else None
+    return summarize(len(texts), seconds, latencies, "request", requests=batcher.requests, connections=connections)
+
+
+def stage_insert(corpus: Dict, opts: Dict) -> Dict:
+    from chunk_writer import ChunkWriter
+
+    texts = synthetic_chunks(opts["chunks"], opts["seed"])
+    embedding = [1.0 / opts["dimensions"]] * opts["dimensions"]
+    supabase = LocalSupabase(opts["insert_latency_ms"])
+    writer = ChunkWriter(supabase, flush_rows=opts["flush_rows"])
+    start = time.perf_counter()
+    for i, text in enumerate(texts):
+        writer.write({
+            "content": text,
+            "metadata": {"regulation": REGULATION, "href": f"{i}.dita", "chunk_index": 0, "chunk_count": 1},
+            "embedding": embedding,
+        })
+    writer.close()
+    seconds = time.perf_counter() - start
+    table = supabase.table(writer.table)
+    return summarize(writer.rows_written, seconds, table.requests, "request", requests=writer.batches, bytes=table.bytes)
+
+
+def stage_pipeline(corpus: Dict, opts: Dict) -> Dict:
+    from chunk_writer import ChunkWriter
+    from embedding_batcher import EmbeddingBatcher
+    from ingest_all import extract_item
+    from ingest_pipeline import IngestPipeline
+
+    items = _walk_items(corpus)
+    supabase = LocalSupabase(opts["insert_latency_ms"])
+    writer = ChunkWriter(supabase, flush_rows=opts["flush_rows"])
+
+    def insert_chunk(meta: Dict, text: str, embedding: List[float]):
+        writer.write({"content": text, "metadata": meta, "embedding": embedding})
+
+    with LocalEmbeddingServer(opts["embed_latency_ms"], opts["dimensions"]) as server:
+        batcher = EmbeddingBatcher(_embedding_client(server, opts), opts["model"], opts["dimensions"])
+        pipeline = IngestPipeline(
+            extract_item,
+            batcher,
+            insert_chunk,
+            extract_workers=opts["extract_workers"],
+            embed_concurrency=opts["embed_concurrency"],
+            insert_concurrency=opts["insert_concurrency"],
+        )
+        stats = pipeline.run(items)
+        writer.close()
+    return summarize(
+        len(items), stats.wall_seconds, [], "topic",
+        chunks=writer.rows_written,
+        stage_items={s.name: s.items for s in (stats.extract, stats.embed, stats.insert)},
+        stage_busy_seconds={s.name: round(s.busy_seconds, 4) for s in (stats.extract, stats.embed, stats.insert)},
+    )
+
+
+def stage_startup(corpus: Dict, opts: Dict) -> Dict:
+    """Cold start of each CLI subcommand, and any heavy SDK it imports just to print --help."""
+    from farchat import COMMANDS
+
+    script = str(Path(__file__).parent / "farchat.py")
+    latencies = []
+    commands = {}
+    start = time.perf_counter()
+    for command in COMMANDS:
+        runs = []
+        for _ in range(STARTUP_RUNS):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, script, command, "--help"], capture_output=True, check=True)
+            runs.append(time.perf_counter() - t0)
+        latencies.extend(runs)
+        # -X importtime lists every module imported, one per stderr line, ending in its dotted name
+        out = subprocess.run([sys.executable, "-X", "importtime", script, command, "--help"],
+                             capture_output=True, text=True, check=True)
+        loaded = {line.rsplit("|", 1)[-1].strip().split(".")[0] for line in out.stderr.splitlines() if "|" in line}
+        commands[command] = {
+            "p50_ms": round(percentile(runs, 50) * 1000, 2),
+            "heavy_imports": sorted(loaded & set(HEAVY_MODULES)),
+        }
+    return summarize(len(latencies), time.perf_counter() - start, latencies, "run", commands=commands)
+
+
+def _run_stage(name: str, corpus: Dict, opts: Dict) -> Dict:
+    result = globals()[f"stage_{name}"](corpus, opts)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_stage(name: str, corpus: Dict, opts: Dict) -> Dict:
+    """Runs one stage in a fresh interpreter so peak RSS is attributable to it."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(_run_stage, name, corpus, opts).result()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent, capture_output=True, text=True, timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics", type=int, default=1000, help="Synthetic topics in the DITA map (default: 1000)")
+    parser.add_argument("--pdfs", type=int, default=2, help="Synthetic VAAR PDFs (default: 2)")
+    parser.add_argument("--pdf-pages", type=int, default=40, help="Pages per PDF (default: 40)")
+    parser.add_argument("--chunks", type=int, default=0, help="Texts for the embed/insert stages (default: 2 per topic)")
+    parser.add_argument("--seed", type=int, default=1, help="Corpus seed (default: 1)")
+    parser.add_argument("--corpus-dir", type=Path, help="Keep the corpus here and reuse it across runs")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Embedding dimensions (default: 1536)")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="Stand-in embeddings latency per request")
+    parser.add_argument("--insert-latency-ms", type=float, default=5.0, help="Stand-in Supabase latency per insert")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--embed-concurrency", type=int, default=4)
+    parser.add_argument("--insert-concurrency", type=int, default=2)
+    parser.add_argument("--pdf-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--flush-rows", type=int, default=200)
+    parser.add_argument("--output", type=Path, help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print(f"Unknown stages: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    tmp = None
+    root = args.corpus_dir
+    if root is None:
+        tmp = tempfile.TemporaryDirectory(prefix="farchat-bench-")
+        root = Path(tmp.name)
+    root.mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    corpus = write_corpus(root, args.topics, args.pdfs, args.pdf_pages, args.seed)
+    print(f"Corpus ready in {time.perf_counter() - t0:.1f}s at {root}", file=sys.stderr)
+
+    opts = {
+        "seed": args.seed,
+        "chunks": args.chunks or args.topics * 2,
+        "model": "openai/text-embedding-3-small",
+        "dimensions": args.dimensions,
+        "embed_latency_ms": args.embed_latency_ms,
+        "insert_latency_ms": args.insert_latency_ms,
+        "extract_workers": max(1, args.extract_workers),
+        "embed_concurrency": max(1, args.embed_concurrency),
+        "insert_concurrency": max(1, args.insert_concurrency),
+        "pdf_workers": max(1, args.pdf_workers),
+        "flush_rows": max(1, args.flush_rows),
+    }
+
+    results = {}
+    try:
+        for name in stages:
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = run_stage(name, corpus, opts)
+            r = results[name]
+            print(
+                f"  {r['items']} items in {r['seconds']:.2f}s ({r['throughput_per_s']}/s), "
+                f"p50 {r['p50_ms']} ms, p99 {r['p99_ms']} ms, peak RSS {r['peak_rss_mb']} MB",
+                file=sys.stderr,
+            )
+    finally:
+        if tmp:
+            tmp.cleanup()
+
+    report = {
+        "benchmark": "ingest",
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": corpus["params"],
+        "options": opts,
+        "stages": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Near-duplicate chunk detection with MinHash and LSH.
+
+FAR clauses are incorporated verbatim, or nearly so, into DFARS, PGI and
+the agency supplements. Embedding every copy wastes OpenRouter calls and
+table space, and the copies crowd each other out of match_documents'
+top-k.
+
+Each chunk gets a MinHash signature over its word 5-gram shingles. The
+signature is computed in the extraction worker processes (`minhash`).
+`ChunkDedupIndex.check` runs on the pipeline's extract thread and looks
+the signature up in an LSH table of canonical chunks (DEDUP_BANDS bands
+of DEDUP_ROWS rows). A candidate whose estimated Jaccard similarity
+reaches DEDUP_THRESHOLD makes the chunk a duplicate:
+
+  - it is written without an embedding, so vector search skips it,
+  - `metadata["duplicate_of"]` points at the canonical chunk
+    (regulation, href, chunk_index, citation_key, similarity).
+
+Anything else becomes a new canonical chunk. The first copy written wins,
+so ingest_all.py processes FAR first.
+
+`check` only decides; a chunk is registered once its row is in the
+table (`record_written`, from the chunk writer's on_written hook), so a
+failed write never leaves a canonical entry that later duplicates point
+at. `discard` drops the pending decisions of a topic that failed. Two
+copies checked before either is written are both kept as canonical.
+
+The index is persisted in SQLite (scripts/.cache/dedup.sqlite3, or
+CHUNK_DEDUP_PATH) so incremental runs link to chunks embedded earlier.
+When a topic is re-ingested or removed, `forget` drops its chunks and
+returns the duplicate topics that pointed at them; those have to be
+re-ingested to get embeddings of their own.
+
+Environment:
+  CHUNK_DEDUP            set to 0 to disable
+  CHUNK_DEDUP_PATH       SQLite file (default scripts/.cache/dedup.sqlite3)
+  DEDUP_THRESHOLD        estimated Jaccard similarity to count as a duplicate (default 0.9)
+"""
+
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_DEDUP_PATH = Path(__file__).parent / ".cache" / "dedup.sqlite3"
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.9"))
+SHINGLE_WORDS = 5
+# 16 bands x 8 rows: pairs above ~0.7 Jaccard share a band with high probability
+DEDUP_BANDS = 16
+DEDUP_ROWS = 8
+NUM_PERM = DEDUP_BANDS * DEDUP_ROWS
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes, with a fixed seed so
+# signatures stay comparable across runs
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20261018)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> List[int]:
+    """32-bit hashes of the word `size`-grams of lowercased text."""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return list({int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams})
+
+
+def minhash(text: str) -> bytes:
+    """NUM_PERM-value MinHash signature, packed as unsigned 64-bit ints."""
+    hashes = shingles(text)
+    if not hashes:
+        return array("Q", [_PRIME] * NUM_PERM).tobytes()
+    return array("Q", [min((a * x + b) % _PRIME for x in hashes) for a, b in _PERMUTATIONS]).tobytes()
+
+
+def similarity(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity: the share of positions where the signatures agree."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def band_hashes(signature: Sequence[int]) -> List[int]:
+    out = []
+    for band in range(DEDUP_BANDS):
+        rows = signature[band * DEDUP_ROWS:(band + 1) * DEDUP_ROWS]
+        digest = hashlib.blake2b(array("Q", rows).tobytes(), digest_size=8).digest()
+        # SQLite integers are signed 64-bit
+        out.append(int.from_bytes(digest, "little", signed=True))
+    return out
+
+
+def chunk_key(meta: Dict) -> str:
+    return f"{meta.get('regulation')}|{meta.get('href')}|{meta.get('chunk_index', 0)}"
+
+
+class ChunkDedupIndex:
+    def __init__(self, path: Path = DEFAULT_DEDUP_PATH, threshold: float = DEDUP_THRESHOLD):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.canonical = 0
+        self.duplicates = 0
+        self._pending = 0
+        # chunk key -> (signature, band hashes, canonical key or None), until the row is written
+        self._unwritten: Dict[str, Tuple[bytes, List[int], Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            create table if not exists chunks (
+                key text primary key,
+                regulation text not null,
+                href text not null,
+                chunk_index integer not null,
+                citation_key text,
+                signature blob not null,
+                canonical text
+            );
+            create index if not exists chunks_topic on chunks(regulation, href);
+            create index if not exists chunks_canonical on chunks(canonical);
+            create table if not exists bands (
+                band integer not null,
+                hash integer not null,
+                key text not null
+            );
+            create index if not exists bands_lookup on bands(band, hash);
+            create index if not exists bands_key on bands(key);
+            """
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional["ChunkDedupIndex"]:
+        if os.environ.get("CHUNK_DEDUP", "1") == "0":
+            return None
+        return cls(path=Path(os.environ.get("CHUNK_DEDUP_PATH", str(DEFAULT_DEDUP_PATH))))
+
+    def check(self, meta: Dict, signature: bytes) -> Optional[Dict]:
+        """The chunk's `duplicate_of` reference, or None if it is canonical; registered by `record_written`."""
+        sig = array("Q")
+        sig.frombytes(signature)
+        bands = band_hashes(sig)
+        key = chunk_key(meta)
+        with self._lock:
+            candidates = set()
+            for band, value in enumerate(bands):
+                rows = self._conn.execute("select key from bands where band = ? and hash = ?", (band, value))
+                candidates.update(k for (k,) in rows if k != key)
+            best, best_score = None, 0.0
+            for candidate in candidates:
+                row = self._conn.execute(
+                    "select regulation, href, chunk_index, citation_key, signature from chunks where key = ?",
+                    (candidate,),
+                ).fetchone()
+                if not row:
+                    continue
+                other = array("Q")
+                other.frombytes(row[4])
+                score = similarity(sig, other)
+                if score > best_score:
+                    best, best_score = (candidate, row), score
+
+            canonical_key, reference = None, None
+            if best and best_score >= self.threshold:
+                canonical_key, (regulation, href, chunk_index, citation_key, _) = best
+                reference = {"regulation": regulation, "href": href, "chunk_index": chunk_index,
+                             "similarity": round(best_score, 3)}
+                if citation_key:
+                    reference["citation_key"] = citation_key
+            self._unwritten[key] = (signature, bands, canonical_key)
+            return reference
+
+    def record_written(self, rows: List[Dict]):
+        """ChunkWriter `on_written` hook: registers the chunks `check` decided on, now that they are stored."""
+        with self._lock:
+            for row in rows:
+                meta = row["metadata"]
+                key = chunk_key(meta)
+                decision = self._unwritten.pop(key, None)
+                if decision is None:
+                    continue
+                signature, bands, canonical_key = decision
+                self._forget_keys([key])
+                self._insert(key, meta, signature, canonical_key)
+                if canonical_key:
+                    self.duplicates += 1
+                    continue
+                self._conn.executemany(
+                    "insert into bands (band, hash, key) values (?, ?, ?)",
+                    [(band, value, key) for band, value in enumerate(bands)],
+                )
+                self.canonical += 1
+
+    def discard(self, regulation: str, href: str):
+        """Drops the unwritten chunks of a failed topic, so none of them is registered."""
+        prefix = chunk_key({"regulation": regulation, "href": href, "chunk_index": ""})
+        with self._lock:
+            for key in [k for k in self._unwritten if k.startswith(prefix)]:
+                del self._unwritten[key]
+
+    def _insert(self, key: str, meta: Dict, signature: bytes, canonical: Optional[str]):
+        self._conn.execute(
+            "insert into chunks (key, regulation, href, chunk_index, citation_key, signature, canonical) "
+            "values (?, ?, ?, ?, ?, ?, ?)",
+            (key, meta.get("regulation"), meta.get("href"), meta.get("chunk_index", 0),
+             meta.get("citation_key"), signature, canonical),
+        )
+        self._pending += 1
+        if self._pending >= 500:
+            self._conn.commit()
+            self._pending = 0
+
+    def _forget_keys(self, keys: List[str]):
+        self._conn.executemany("delete from bands where key = ?", [(k,) for k in keys])
+        self._conn.executemany("delete from chunks where key = ?", [(k,) for k in keys])
+
+    def forget(self, regulation: str, hrefs: Iterable[str]) -> List[Tuple[str, str]]:
+        """Drops the chunks of these topics; returns (regulation, href) of other topics that duplicated them."""
+        hrefs = list(hrefs)
+        forgotten = set(hrefs)
+        orphans = set()
+        with self._lock:
+            for start in range(0, len(hrefs), 500):
+                part = hrefs[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                keys = [k for (k,) in self._conn.execute(
+                    f"select key from chunks where regulation = ? and href in ({placeholders})", [regulation, *part]
+                )]
+                for k_start in range(0, len(keys), 500):
+                    k_part = keys[k_start:k_start + 500]
+                    k_placeholders = ",".join("?" * len(k_part))
+                    for reg, href in self._conn.execute(
+                        f"select distinct regulation, href from chunks where canonical in ({k_placeholders})", k_part
+                    ):
+                        if not (reg == regulation and href in forgotten):
+                            orphans.add((reg, href))
+                self._forget_keys(keys)
+            self._conn.commit()
+        return sorted(orphans)
+
+    def report(self) -> str:
+        total = self.canonical + self.duplicates
+        rate = 100.0 * self.duplicates / total if total else 0.0
+        return f"Dedup: {self.duplicates} of {total} chunks linked to a canonical copy ({rate:.1f}%), not embedded"
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,355 @@
+"""
+Buffered multi-row writers for the document_chunks table.
+
+Rows are accumulated and flushed as one multi-row insert when the buffer
+reaches a row count, an approximate payload size or an age limit; a
+background thread enforces the age limit while no rows arrive. A failed
+batch is bisected and retried so one bad row only loses itself.
+
+Three backends:
+  - ChunkWriter: PostgREST multi-row insert through the Supabase client.
+  - AsyncChunkWriter: the same insert over the pooled async REST session
+    (async_clients), with up to INSERT_IN_FLIGHT batches sent at once.
+    Used when a pooled client is passed to create_chunk_writer.
+  - PostgresCopyWriter: `COPY ... FROM STDIN` over a direct Postgres
+    connection (psycopg 3), for initial full loads. Used when
+    SUPABASE_DB_URL is set.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from ingest_metrics import metrics
+
+CHUNK_TABLE = "document_chunks"
+FLUSH_ROWS = int(os.environ.get("INSERT_FLUSH_ROWS", "200"))
+FLUSH_BYTES = int(os.environ.get("INSERT_FLUSH_BYTES", str(8 * 1024 * 1024)))
+FLUSH_SECONDS = float(os.environ.get("INSERT_FLUSH_SECONDS", "10"))
+SUPABASE_DB_URL = os.environ.get("SUPABASE_DB_URL")
+# Batches AsyncChunkWriter lets run concurrently before write() blocks
+INSERT_IN_FLIGHT = int(os.environ.get("INSERT_IN_FLIGHT", "4"))
+
+
+# One AsyncChunkWriter insert result: (rows, ids, None) if written, ([row], None, error) if not
+Outcome = Tuple[List[Dict], Optional[List[Optional[int]]], Optional[BaseException]]
+
+
+def estimate_row_bytes(row: Dict) -> int:
+    """Approximate serialized size without paying for a second json.dumps."""
+    size = len(row.get("content") or "") + len(str(row.get("metadata") or ""))
+    embedding = row.get("embedding")
+    if embedding:
+        size += 20 * len(embedding)
+    return size
+
+
+class ChunkWriter:
+    """Thread-safe buffered writer. Call `close()` (or use as a context manager) to flush the tail.
+
+    `on_written(rows, ids)` is called after each successful batch with the
+    ids the database assigned (None where the backend cannot report them);
+    `on_failed(row, error)` for each row that could not be written on its own.
+    """
+
+    def __init__(
+        self,
+        supabase=None,
+        table: str = CHUNK_TABLE,
+        flush_rows: int = FLUSH_ROWS,
+        flush_bytes: int = FLUSH_BYTES,
+        flush_seconds: float = FLUSH_SECONDS,
+        on_written: Optional[Callable[[List[Dict], List[Optional[int]]], None]] = None,
+        on_failed: Optional[Callable[[Dict, BaseException], None]] = None,
+    ):
+        self.supabase = supabase
+        self.table = table
+        self.flush_rows = max(1, flush_rows)
+        self.flush_bytes = max(1, flush_bytes)
+        self.flush_seconds = flush_seconds
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self._buffer: List[Dict] = []
+        self._buffer_bytes = 0
+        self._buffer_started = time.monotonic()
+        self._lock = threading.Lock()
+        # Wakes the age-based flush thread when a new buffer starts or the writer closes
+        self._buffer_aging = threading.Condition(self._lock)
+        self._closed = False
+        self._flusher: Optional[threading.Thread] = None
+        self.rows_written = 0
+        self.batches = 0
+        self.failed: List[Dict] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, row: Dict):
+        with self._lock:
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+                self._start_flusher()
+                self._buffer_aging.notify()
+            self._buffer.append(row)
+            self._buffer_bytes += estimate_row_bytes(row)
+            batch = self._take_if_due()
+        if batch:
+            self._write_batch(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._write_batch(batch)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._buffer_aging.notify()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+
+    def _start_flusher(self):
+        """Starts the age-based flush thread on the first row (called with the lock held)."""
+        if self._flusher is None and 0 < self.flush_seconds < float("inf") and not self._closed:
+            self._flusher = threading.Thread(target=self._flush_stale, name="chunk-writer-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_stale(self):
+        """Flushes a partial buffer once it is flush_seconds old, even while no new rows arrive
+        (e.g. the embed stage is stalled on rate limits)."""
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if not self._buffer:
+                        self._buffer_aging.wait()
+                        continue
+                    remaining = self._buffer_started + self.flush_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._buffer_aging.wait(remaining)
+                if self._closed:
+                    return
+                batch = self._take()
+            self._write_batch(batch)
+
+    def _take_if_due(self) -> Optional[List[Dict]]:
+        if (
+            len(self._buffer) >= self.flush_rows
+            or self._buffer_bytes >= self.flush_bytes
+            or time.monotonic() - self._buffer_started >= self.flush_seconds
+        ):
+            return self._take()
+        return None
+
+    def _take(self) -> List[Dict]:
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        return batch
+
+    def _write_batch(self, rows: List[Dict]):
+        """Writes rows; on failure splits the batch in half until the bad rows are isolated."""
+        try:
+            t0 = time.perf_counter()
+            ids = self._insert(rows)
+            metrics.observe("insert_batch_seconds", time.perf_counter() - t0)
+        except Exception as e:
+            if len(rows) == 1:
+                self._row_failed(rows[0], e)
+                return
+            mid = len(rows) // 2
+            self._write_batch(rows[:mid])
+            self._write_batch(rows[mid:])
+            return
+        self._batch_written(rows, ids)
+
+    def _batch_written(self, rows: List[Dict], ids: List[Optional[int]]):
+        with self._lock:
+            self.rows_written += len(rows)
+            self.batches += 1
+        metrics.count("insert_rows", len(rows))
+        if metrics.enabled:
+            metrics.count("insert_bytes", sum(estimate_row_bytes(r) for r in rows))
+        if self.on_written:
+            self.on_written(rows, ids)
+
+    def _row_failed(self, row: Dict, error: BaseException):
+        metrics.error("insert", error)
+        print(f"Error inserting chunk {row.get('metadata', {}).get('title', '')!r}: {error}")
+        with self._lock:
+            self.failed.append(row)
+        if self.on_failed:
+            self.on_failed(row, error)
+
+    def _insert(self, rows: List[Dict]) -> List[Optional[int]]:
+        result = self.supabase.table(self.table).insert(rows).execute()
+        return returned_ids(rows, result.data)
+
+    def summary(self) -> str:
+        return f"{self.rows_written} rows written in {self.batches} batches, {len(self.failed)} failed"
+
+
+def returned_ids(rows: List[Dict], data: Optional[List[Dict]]) -> List[Optional[int]]:
+    data = data or []
+    if len(data) != len(rows):
+        return [None] * len(rows)
+    return [r.get("id") for r in data]
+
+
+class AsyncChunkWriter(ChunkWriter):
+    """Inserts over a pooled async PostgREST session (async_clients.PooledRestClient).
+
+    A full batch is handed to the event loop and `write` returns, so up to
+    `max_in_flight` inserts overlap with the callers' buffering; past that,
+    `write` blocks until one finishes. `flush` and `close` wait for every
+    batch. Only the inserts run on the event loop, which carries every
+    pooled request in the process: `on_written` and `on_failed` do blocking
+    work (checkpoint writes, SQLite, memmaps), so they run on a callback
+    thread of the writer's own, in the order the batches were sent.
+    """
+
+    def __init__(self, rest, max_in_flight: int = INSERT_IN_FLIGHT, **kwargs):
+        super().__init__(**kwargs)
+        self.rest = rest
+        self._slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._pending: Set[Future] = set()
+        self._callbacks = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chunk-writer-callbacks")
+
+    def _write_batch(self, rows: List[Dict]):
+        self._slots.acquire()
+        future = self._callbacks.submit(self._report, self.rest.submit(self._insert_async(rows)))
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._batch_done)
+
+    def _batch_done(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _report(self, insert: Future):
+        """Callback thread: waits for one batch's insert, then records what it wrote and lost."""
+        try:
+            for rows, ids, error in insert.result():
+                if error is None:
+                    self._batch_written(rows, ids)
+                else:
+                    self._row_failed(rows[0], error)
+        except Exception as e:
+            # Only a failing callback gets here; insert errors are handled per row
+            metrics.error("insert", e)
+            print(f"Error after inserting a batch: {e}")
+        finally:
+            self._slots.release()
+
+    async def _insert_async(self, rows: List[Dict], outcomes: Optional[List[Outcome]] = None) -> List[Outcome]:
+        """Inserts rows, bisecting on failure; returns (rows, ids, None) per written batch
+        and ([row], None, error) per row that failed on its own."""
+        if outcomes is None:
+            outcomes = []
+        try:
+            t0 = time.perf_counter()
+            data = await self.rest.insert_async(self.table, rows)
+            metrics.observe("insert_batch_seconds", time.perf_counter() - t0)
+        except Exception as e:
+            if len(rows) == 1:
+                outcomes.append((rows, None, e))
+                return outcomes
+            mid = len(rows) // 2
+            await self._insert_async(rows[:mid], outcomes)
+            await self._insert_async(rows[mid:], outcomes)
+            return outcomes
+        outcomes.append((rows, returned_ids(rows, data), None))
+        return outcomes
+
+    def flush(self):
+        super().flush()
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+
+    def close(self):
+        super().close()
+        self._callbacks.shutdown()
+
+
+class PostgresCopyWriter(ChunkWriter):
+    """Writes batches with COPY over a direct Postgres connection (one connection per thread)."""
+
+    COLUMNS = ("content", "metadata", "embedding")
+
+    def __init__(self, dsn: str, **kwargs):
+        super().__init__(**kwargs)
+        self.dsn = dsn
+        self._local = threading.local()
+        self._connections = []
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            import psycopg
+
+            conn = psycopg.connect(self.dsn)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _insert(self, rows: List[Dict]) -> List[Optional[int]]:
+        conn = self._connection()
+        columns = ", ".join(self.COLUMNS)
+        try:
+            with conn.cursor() as cur:
+                with cur.copy(f"COPY {self.table} ({columns}) FROM STDIN") as copy:
+                    for row in rows:
+                        embedding = row.get("embedding")
+                        copy.write_row((
+                            row.get("content"),
+                            json.dumps(row.get("metadata") or {}),
+                            "[" + ",".join(map(str, embedding)) + "]" if embedding else None,
+                        ))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        # COPY does not return the generated ids
+        return [None] * len(rows)
+
+    def close(self):
+        super().close()
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+
+
+def delete_chunks(supabase, ids: List[int], table: str = CHUNK_TABLE, batch_size: int = 500) -> int:
+    """Deletes rows by id in batches small enough for a PostgREST query string."""
+    for start in range(0, len(ids), batch_size):
+        supabase.table(table).delete().in_("id", ids[start:start + batch_size]).execute()
+    return len(ids)
+
+
+def delete_topic_chunks(supabase, regulation: str, href: str, table: str = CHUNK_TABLE):
+    """Deletes every chunk of one topic when its row ids are not known."""
+    (
+        supabase.table(table)
+        .delete()
+        .eq("metadata->>regulation", regulation)
+        .eq("metadata->>href", href)
+        .execute()
+    )
+
+
+def create_chunk_writer(supabase, dsn: Optional[str] = SUPABASE_DB_URL, rest=None, **kwargs) -> ChunkWriter:
+    """Picks the COPY backend when a Postgres DSN is configured, otherwise PostgREST
+    (over the pooled async session `rest` when one is given)."""
+    if dsn:
+        return PostgresCopyWriter(dsn, supabase=supabase, **kwargs)
+    if rest is not None:
+        return AsyncChunkWriter(rest, supabase=supabase, **kwargs)
+    return ChunkWriter(supabase, **kwargs)
@@ -0,0 +1,216 @@
+"""
+Structure-aware chunker implementing RAGreference/chunking_strategy.md.
+
+Input is a sequence of blocks (paragraphs, list items, headings) in
+document order. Blocks are packed greedily into ~CHUNK_SIZE character
+chunks; a new chunk is started before every heading or section number
+(e.g. "15.403-1") once the current chunk has reached CHUNK_MIN_SIZE, and
+only blocks longer than CHUNK_MAX_SIZE are split internally, on line,
+sentence, word and finally character boundaries, never inside a bracketed
+citation such as "[FAR 1.101]". Consecutive chunks within a section share
+CHUNK_OVERLAP characters, and continuation chunks are prefixed with their
+section heading. Every block is visited once, so chunking is linear in the
+document length.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from citations import chunk_citation_key
+
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "200"))
+CHUNK_MIN_SIZE = int(os.environ.get("CHUNK_MIN_SIZE", "100"))
+CHUNK_MAX_SIZE = int(os.environ.get("CHUNK_MAX_SIZE", "2000"))
+
+# FAR 1.101, 15.403-1, DFARS 252.234-7001, VAAR 801.104-70, optional "Subpart"/"Part" lead-ins
+SECTION_NUMBER = re.compile(r"^(?:(?:FAR|DFARS|VAAR|PGI)\s+)?(\d{1,3}\.\d{3,4}(?:-\d{1,4})?)\b")
+PART_HEADING = re.compile(r"^(?:PART|Part)\s+(\d{1,3})\b")
+SUBPART_HEADING = re.compile(r"^(?:SUBPART|Subpart)\s+(\d{1,3}\.\d{1,2})\b")
+
+SEPARATORS = ("\n", ". ", " ")
+
+
+@dataclass
+class Block:
+    text: str
+    heading: bool = False
+
+
+@dataclass
+class Chunk:
+    text: str
+    index: int
+    section: Optional[str] = None
+    part: Optional[str] = None
+    subpart: Optional[str] = None
+    heading: Optional[str] = None
+
+    def metadata(self) -> Dict:
+        meta = {"chunk_index": self.index}
+        for key in ("section", "part", "subpart"):
+            value = getattr(self, key)
+            if value:
+                meta[key] = value
+        if self.heading:
+            meta["section_title"] = self.heading
+        return meta
+
+
+def section_lineage(section: str) -> Tuple[str, Optional[str]]:
+    """'15.403-1' -> ('15', '15.4'); '252.234-7001' -> ('252', '252.2')."""
+    part, _, rest = section.partition(".")
+    digits = rest.split("-", 1)[0]
+    subpart = f"{part}.{digits[0]}" if len(digits) >= 3 else None
+    return part, subpart
+
+
+def _safe_cut(text: str, limit: int) -> int:
+    """Largest cut <= limit on the best available separator, moved before any unclosed '['."""
+    cut = limit
+    for sep in SEPARATORS:
+        pos = text.rfind(sep, 0, limit)
+        if pos > limit // 2:
+            cut = pos + len(sep)
+            break
+    open_bracket = text.rfind("[", 0, cut)
+    if open_bracket > 0 and text.find("]", open_bracket, cut) == -1:
+        cut = open_bracket
+    return max(cut, 1)
+
+
+def split_long(text: str, size: int = CHUNK_SIZE) -> List[str]:
+    """Splits a single oversized block into pieces of at most `size` characters."""
+    pieces = []
+    while len(text) > size:
+        cut = _safe_cut(text, size)
+        pieces.append(text[:cut].strip())
+        text = text[cut:].lstrip()
+    if text.strip():
+        pieces.append(text.strip())
+    return [p for p in pieces if p]
+
+
+def _overlap_tail(text: str, overlap: int) -> str:
+    if overlap <= 0 or len(text) <= overlap:
+        return ""
+    tail = text[-overlap:]
+    space = tail.find(" ")
+    return tail[space + 1:] if 0 <= space < len(tail) - 1 else tail
+
+
+class Chunker:
+    def __init__(
+        self,
+        size: int = CHUNK_SIZE,
+        overlap: int = CHUNK_OVERLAP,
+        min_size: int = CHUNK_MIN_SIZE,
+        max_size: int = CHUNK_MAX_SIZE,
+    ):
+        self.size = size
+        self.overlap = min(overlap, size // 2)
+        self.min_size = min_size
+        self.max_size = max(max_size, size)
+
+    def chunk_blocks(self, blocks: Iterable[Block], section: Optional[str] = None) -> List[Chunk]:
+        chunks: List[Chunk] = []
+        parts: List[str] = []
+        length = 0
+        part = subpart = heading = None
+        if section:
+            part, subpart = section_lineage(section)
+
+        def emit():
+            nonlocal parts, length
+            text = "\n".join(parts).strip()
+            if text:
+                chunks.append(Chunk(text, len(chunks), section, part, subpart, heading))
+            parts, length = [], 0
+
+        def start_continuation(previous: str):
+            nonlocal parts, length
+            lead = []
+            tail = _overlap_tail(previous, self.overlap)
+            # Every continuation leads with its section heading, unless the carried tail already has it
+            if heading and heading not in tail:
+                lead.append(heading)
+            if tail:
+                lead.append(tail)
+            parts = lead
+            length = sum(len(p) + 1 for p in lead)
+
+        for block in blocks:
+            text = block.text.strip()
+            if not text:
+                continue
+
+            number = SECTION_NUMBER.match(text)
+            part_match = PART_HEADING.match(text) if block.heading else None
+            subpart_match = SUBPART_HEADING.match(text) if block.heading else None
+            boundary = bool(block.heading or number)
+
+            # Split before new sections once the current chunk is big enough to stand alone
+            if boundary and parts and length >= self.min_size:
+                emit()
+            if number:
+                section = number.group(1)
+                part, subpart = section_lineage(section)
+                heading = text[:200]
+            elif part_match:
+                part, subpart, section = part_match.group(1), None, None
+                heading = text[:200]
+            elif subpart_match:
+                subpart, section = subpart_match.group(1), None
+                part = subpart.split(".")[0]
+                heading = text[:200]
+            elif block.heading:
+                heading = text[:200]
+
+            pieces = split_long(text, self.size) if len(text) > self.max_size else [text]
+            for piece in pieces:
+                if parts and length + len(piece) > self.size and length >= self.min_size:
+                    previous = "\n".join(parts)
+                    emit()
+                    start_continuation(previous)
+                    if length + len(piece) > self.max_size:
+                        # Carried context plus this piece would be too big; drop the context
+                        parts, length = [], 0
+                elif parts and length + len(piece) > self.max_size:
+                    emit()
+                parts.append(piece)
+                length += len(piece) + 1
+
+        # A tiny trailing chunk is merged into its predecessor rather than stored alone
+        tail = "\n".join(parts).strip()
+        if (
+            chunks
+            and tail
+            and len(tail) < self.min_size
+            and chunks[-1].section == section
+            and len(chunks[-1].text) + len(tail) <= self.max_size
+        ):
+            chunks[-1].text = f"{chunks[-1].text}\n{tail}"
+        else:
+            emit()
+        return chunks
+
+    def chunk_text(self, text: str, section: Optional[str] = None) -> List[Chunk]:
+        """Chunks plain text (e.g. from a PDF), treating blank lines as paragraph breaks."""
+        blocks = [Block(p) for p in re.split(r"\n\s*\n", text)]
+        if len(blocks) == 1:
+            blocks = [Block(line) for line in text.split("\n")]
+        return self.chunk_blocks(blocks, section=section)
+
+
+def chunk_metadata(base: Dict, chunk: Chunk, count: int) -> Dict:
+    """Topic metadata plus the chunk's own section lineage, citation key and position."""
+    meta = dict(base)
+    meta.update(chunk.metadata())
+    meta["chunk_count"] = count
+    key = chunk_citation_key(meta)
+    if key:
+        # Stored in the indexed citation_key column for exact-citation lookups
+        meta["citation_key"] = key
+    return meta
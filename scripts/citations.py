@@ -0,0 +1,91 @@
+"""
+Citation parsing and normalization (see RAGreference/citation_format.md).
+
+A citation key is "<REGULATION> <section>", e.g. "FAR 15.404-1",
+"DFARS 252.234-7001", "VAAR 801.603" or, for part/subpart references,
+"FAR 15" / "FAR 15.4". Keys are built the same way from user text
+("[FAR Subpart 15.4]", "far 52.212-4") and from chunk metadata
+(`regulation` + `section`), so the two can be compared directly.
+"""
+
+import re
+from typing import Dict, List, Optional
+
+# Map names used by ingest_all.py -> the name people cite them by
+REGULATION_ALIASES = {
+    "DFARSPGI": "PGI",
+    "DFARS PGI": "PGI",
+    "VA": "VAAR",
+}
+
+KNOWN_REGULATIONS = (
+    "FAR", "DFARS", "PGI", "VAAR", "AFARS", "DAFFARS", "GSAM", "DARS", "DLAD", "DOLAR", "DOSAR",
+    "EDAR", "EPAAR", "HHSAR", "HSAR", "HUDAR", "IAAR", "JAR", "LIFAR", "NFS", "NRCAR", "TAR",
+    "TRANSFAR", "AIDAR", "AGAR", "CAR", "DEAR", "DIAR", "SOFARS", "NMCARS", "DFARSPGI",
+)
+
+# Same section shapes as chunking.SECTION_NUMBER and ingest_va_pdf.SECTION_PATTERN:
+# 1.101, 15.403-1, 252.234-7001, 801.104-70; plus bare parts (15) and subparts (15.4)
+SECTION = r"\d{1,3}(?:\.\d{1,4}(?:-\d{1,4})?)?"
+
+CITATION_PATTERN = re.compile(
+    r"\b(" + "|".join(sorted(KNOWN_REGULATIONS, key=len, reverse=True)) + r"|DFARS\s+PGI)"
+    r"\s*(?:(?:Part|Subpart|Section|§)\s*)?(" + SECTION + r")(?!\d|[.-]\d)",
+    re.IGNORECASE,
+)
+
+
+def normalize_regulation(regulation: str) -> str:
+    name = " ".join(regulation.upper().split())
+    return REGULATION_ALIASES.get(name, name)
+
+
+def normalize_section(section: str) -> str:
+    return section.strip().rstrip(".")
+
+
+def citation_key(regulation: Optional[str], section: Optional[str]) -> Optional[str]:
+    if not regulation or not section:
+        return None
+    section = normalize_section(section)
+    if not re.fullmatch(SECTION, section):
+        return None
+    return f"{normalize_regulation(regulation)} {section}"
+
+
+def parse_citations(text: str) -> List[str]:
+    """All citation keys in `text`, in order of appearance, without duplicates."""
+    keys = []
+    for match in CITATION_PATTERN.finditer(text):
+        key = citation_key(match.group(1), match.group(2))
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def chunk_citation_key(metadata: Optional[Dict]) -> Optional[str]:
+    """Key for a document_chunks row, from its `regulation` and `section` metadata."""
+    if not metadata:
+        return None
+    return citation_key(metadata.get("regulation"), metadata.get("section"))
+
+
+def citation_matches(expected: str, actual: Optional[str], hierarchical: bool = False) -> bool:
+    """True when `actual` is the expected citation or, if `hierarchical`, lies inside it
+    (a chunk from FAR 15.404-1 satisfies "FAR 15.404", "FAR 15.4" and "FAR 15")."""
+    if not actual:
+        return False
+    if actual == expected:
+        return True
+    if not hierarchical:
+        return False
+    reg, _, section = expected.partition(" ")
+    actual_reg, _, actual_section = actual.partition(" ")
+    if reg != actual_reg:
+        return False
+    if actual_section.startswith(section + "-"):
+        return True
+    if "." not in section:
+        return actual_section.startswith(section + ".")
+    # Subpart "15.4" covers sections 15.4xx; section "15.404" covers 15.404-n
+    return "-" not in section and actual_section.split("-")[0].startswith(section)
@@ -0,0 +1,194 @@
+"""
+Batched embedding requests for the ingestion scripts.
+
+Collects texts into batches bounded by item count and an estimated token
+budget, sends one `embeddings.create` call per batch and hands the vectors
+back in the same order the texts were added.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from embedding_cache import EmbeddingCache
+from ingest_metrics import metrics
+from rate_limit import RateLimitedClient
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# Provider limits for text-embedding-3-*: 2048 inputs and ~300k tokens per
+# request, 8191 tokens per input. Defaults stay well under both.
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", "200000"))
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+# How providers word a 400 for an oversized request ("maximum context length is
+# 8192 tokens", "at most 2048 inputs", "Requested 320000 tokens, max 300000 ...")
+SIZE_ERROR = re.compile(r"\btokens?\b|too (?:large|long|many)|at most|\bmax(?:imum)?\b|exceed", re.I)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English prose)."""
+    return len(text) // 4 + 1
+
+
+def clean_text(text: str) -> str:
+    return text.replace("\n", " ").strip()
+
+
+def is_batch_too_large(error: Exception) -> bool:
+    """True when the provider rejected a request because of its size.
+
+    A 413 always is; a 400 only when its message names the token or input
+    limit, so a bad model or parameter fails at once instead of bisecting.
+    """
+    status = getattr(error, "status_code", None)
+    if status == 413:
+        return True
+    return status == 400 and SIZE_ERROR.search(str(error)) is not None
+
+
+class EmbeddingBatcher:
+    """Accumulates (text, payload) pairs and embeds them in batches.
+
+    When a cache is given, only texts without a cached vector are sent to
+    the provider.
+
+    `add` returns the (payload, embedding) pairs of any batch it had to flush,
+    so callers can stream results straight into the insert step:
+
+        batcher = EmbeddingBatcher(client, EMBEDDING_MODEL, EMBEDDING_DIM)
+        for text, meta in items:
+            for meta, embedding in batcher.add(text, meta):
+                insert(meta, embedding)
+        for meta, embedding in batcher.flush():
+            insert(meta, embedding)
+    """
+
+    def __init__(
+        self,
+        client: "OpenAI",
+        model: str,
+        dimensions: int,
+        max_items: int = EMBEDDING_BATCH_SIZE,
+        max_tokens: int = EMBEDDING_BATCH_TOKENS,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.max_items = max(1, max_items)
+        self.max_tokens = max(1, max_tokens)
+        self.cache = cache
+        self._pending: List[Tuple[str, Any]] = []
+        self._pending_tokens = 0
+        self.requests = 0
+        self.splits = 0
+        self._lock = threading.Lock()
+
+    def _extra_body(self) -> Dict:
+        return {"dimensions": self.dimensions} if "openai" in self.model.lower() else {}
+
+    def collect(self, text: str, payload: Any = None) -> Optional[List[Tuple[str, Any]]]:
+        """Queues a text and returns the previous batch once it is full, without embedding it."""
+        text = clean_text(text)
+        if not text:
+            return None
+        tokens = min(estimate_tokens(text), EMBEDDING_MAX_INPUT_TOKENS)
+
+        ready = None
+        if self._pending and (
+            len(self._pending) >= self.max_items
+            or self._pending_tokens + tokens > self.max_tokens
+        ):
+            ready = self.take()
+
+        self._pending.append((text, payload))
+        self._pending_tokens += tokens
+        return ready
+
+    def take(self) -> List[Tuple[str, Any]]:
+        """Returns and clears whatever is queued."""
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        return batch
+
+    def add(self, text: str, payload: Any = None) -> List[Tuple[Any, List[float]]]:
+        ready = self.collect(text, payload)
+        return self.embed_batch(ready) if ready else []
+
+    def flush(self) -> List[Tuple[Any, List[float]]]:
+        return self.embed_batch(self.take())
+
+    def embed_batch(self, batch: List[Tuple[str, Any]]) -> List[Tuple[Any, List[float]]]:
+        """Embeds a batch from `collect`/`take`. Safe to call from several threads."""
+        if not batch:
+            return []
+        texts = [text for text, _ in batch]
+        if self.cache is None:
+            embeddings = self._embed(texts)
+        else:
+            embeddings = self.cache.get_many(self.model, self.dimensions, texts)
+            missing = [i for i, emb in enumerate(embeddings) if emb is None]
+            if missing:
+                fresh = self._embed([texts[i] for i in missing])
+                self.cache.put_many(self.model, self.dimensions, [texts[i] for i in missing], fresh)
+                for i, emb in zip(missing, fresh):
+                    embeddings[i] = emb
+        return [(payload, emb) for (_, payload), emb in zip(batch, embeddings)]
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embeds a list of texts, batching as needed. Order is preserved."""
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        for i, text in enumerate(texts):
+            for idx, emb in self.add(text, i):
+                out[idx] = emb
+        for idx, emb in self.flush():
+            out[idx] = emb
+        return [emb or [] for emb in out]
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        """One request per batch; halves the batch if the provider rejects its size."""
+        try:
+            with self._lock:
+                self.requests += 1
+            t0 = time.perf_counter()
+            response = self.client.embeddings.create(
+                input=texts,
+                model=self.model,
+                extra_body=self._extra_body(),
+            )
+            metrics.observe("embed_request_seconds", time.perf_counter() - t0)
+        except Exception as e:
+            if len(texts) > 1 and is_batch_too_large(e):
+                with self._lock:
+                    self.splits += 1
+                mid = len(texts) // 2
+                return self._embed(texts[:mid]) + self._embed(texts[mid:])
+            raise
+
+        data = sorted(response.data, key=lambda d: d.index)
+        if len(data) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(data)}")
+        usage = getattr(response, "usage", None)
+        metrics.count("embed_texts", len(texts))
+        metrics.count("embed_tokens", getattr(usage, "total_tokens", 0) or sum(estimate_tokens(t) for t in texts))
+        return [d.embedding for d in data]
+
+
+def create_embedding_client(api_key: str) -> RateLimitedClient:
+    """OpenRouter client with retries and adaptive concurrency shared across the process.
+
+    Every client made for the same key shares one pooled keep-alive session
+    (async_clients) unless ASYNC_HTTP=0.
+    """
+    from async_clients import ASYNC_HTTP, pooled_embedding_client
+
+    if ASYNC_HTTP:
+        return RateLimitedClient(pooled_embedding_client(OPENROUTER_BASE_URL, api_key))
+    from openai import OpenAI
+
+    return RateLimitedClient(OpenAI(base_url=OPENROUTER_BASE_URL, api_key=api_key))
@@ -0,0 +1,182 @@
+"""
+Content-addressed on-disk embedding cache.
+
+Vectors are keyed by sha256(model, dimensions, normalized text) and stored
+as packed float32 blobs in SQLite, so a re-ingest only pays for text that
+actually changed. Least-recently-used entries are evicted once the cache
+grows past EMBEDDING_CACHE_MAX_MB.
+
+Environment:
+  EMBEDDING_CACHE          set to 0 to disable the cache
+  EMBEDDING_CACHE_PATH     SQLite file (default scripts/.cache/embeddings.sqlite3)
+  EMBEDDING_CACHE_MAX_MB   size budget before eviction (default 2048)
+  EMBEDDING_CACHE_OFFLINE  set to 1 to fail fast on a miss instead of calling the API
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+DEFAULT_CACHE_PATH = Path(__file__).parent / ".cache" / "embeddings.sqlite3"
+
+
+class EmbeddingCacheMiss(LookupError):
+    """Raised in offline mode when a text has no cached vector."""
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(model: str, dimensions: int, text: str) -> str:
+    h = hashlib.sha256()
+    h.update(f"{model}\0{dimensions}\0".encode("utf-8"))
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, max_bytes: int = 2048 * 1024 * 1024, offline: bool = False):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            create table if not exists embeddings (
+                key text primary key,
+                model text not null,
+                dimensions integer not null,
+                vector blob not null,
+                last_used real not null
+            )
+            """
+        )
+        self._conn.execute("create index if not exists embeddings_last_used on embeddings(last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("select coalesce(sum(length(vector)), 0) from embeddings").fetchone()[0]
+
+    @classmethod
+    def from_env(cls) -> Optional["EmbeddingCache"]:
+        if os.environ.get("EMBEDDING_CACHE", "1") == "0":
+            return None
+        return cls(
+            path=Path(os.environ.get("EMBEDDING_CACHE_PATH", str(DEFAULT_CACHE_PATH))),
+            max_bytes=int(float(os.environ.get("EMBEDDING_CACHE_MAX_MB", "2048")) * 1024 * 1024),
+            offline=os.environ.get("EMBEDDING_CACHE_OFFLINE", "0") == "1",
+        )
+
+    def get_many(self, model: str, dimensions: int, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Returns cached vectors (or None) aligned with `texts`. Raises on a miss in offline mode."""
+        keys = [cache_key(model, dimensions, t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"select key, vector from embeddings where key in ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "update embeddings set last_used = ? where key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+
+        results = [found.get(k) for k in keys]
+        hits = sum(1 for r in results if r is not None)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(results) - hits
+        if self.offline and hits < len(results):
+            raise EmbeddingCacheMiss(f"{len(results) - hits} texts not in embedding cache (offline mode)")
+        return results
+
+    def put_many(self, model: str, dimensions: int, texts: Sequence[str], vectors: Sequence[List[float]]):
+        now = time.time()
+        # One row per key: a batch can repeat a text
+        rows = {}
+        for text, vec in zip(texts, vectors):
+            key = cache_key(model, dimensions, text)
+            rows[key] = (key, model, dimensions, array("f", vec).tobytes(), now)
+        keys = list(rows)
+        with self._lock:
+            # Replacing an entry only changes the size by the difference in blob length
+            replaced = 0
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                replaced += self._conn.execute(
+                    f"select coalesce(sum(length(vector)), 0) from embeddings where key in ({placeholders})", part
+                ).fetchone()[0]
+            self._conn.executemany(
+                "insert or replace into embeddings (key, model, dimensions, vector, last_used) values (?, ?, ?, ?, ?)",
+                rows.values(),
+            )
+            self._conn.commit()
+            self._size += sum(len(row[3]) for row in rows.values()) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drops least-recently-used entries until the cache is back under 90% of its budget."""
+        target = int(self.max_bytes * 0.9)
+        while self._size > target:
+            rows = self._conn.execute(
+                "select key, length(vector) from embeddings order by last_used limit 1000"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            victims = []
+            for key, size in rows:
+                victims.append((key,))
+                self._size -= size
+                if self._size <= target:
+                    break
+            self._conn.executemany("delete from embeddings where key = ?", victims)
+            self.evicted += len(victims)
+        self._conn.commit()
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (
+            f"Embedding cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), "
+            f"{self.evicted} evicted, {self._size / (1024 * 1024):.1f} MiB on disk"
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared: Optional[EmbeddingCache] = None
+_shared_loaded = False
+
+
+def shared_cache() -> Optional[EmbeddingCache]:
+    """Process-wide cache configured from the environment, opened on first use."""
+    global _shared, _shared_loaded
+    if not _shared_loaded:
+        _shared = EmbeddingCache.from_env()
+        _shared_loaded = True
+    return _shared
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality and latency evaluation for match_documents.
+
+Takes a labelled set of questions with the citations that should be
+retrieved (one JSON object per line):
+
+    {"question": "When may an agency use other than full and open competition for a sole source?",
+     "expected": ["FAR 6.302-1"]}
+
+embeds every question once, runs them in parallel against a backend and
+reports recall@k, MRR and p50/p95 query latency per configuration:
+
+    supabase  the match_documents RPC (or --function) on the hosted project
+    local     a local_index.py index, exact, approximate (--probes) or
+              compact shortlist-then-rescore (--sweep compact:...)
+    pg        a local Postgres with pgvector via SUPABASE_DB_URL/--dsn,
+              sweeping index parameters
+
+Functions that also take the question text, such as hybrid_search, are
+evaluated with --text-arg query_text.
+
+A chunk counts as relevant when its `regulation` + `section` metadata
+matches an expected citation (see citations.py); --hierarchical also
+accepts chunks inside an expected part, subpart or section.
+
+Sweeps are comma-separated lists; every combination is one configuration:
+
+    python eval_retrieval.py questions.jsonl --backend local --index .cache/index --probes 0,1,4,16
+    python eval_retrieval.py questions.jsonl --backend pg --thresholds 0.1,0.3 \\
+        --sweep "exact" --sweep "ivfflat:lists=100,400;probes=1,10,40" \\
+        --sweep "hnsw:m=16,32;ef_construction=64;ef_search=40,100" --rebuild-indexes
+
+A "compact" sweep runs match_documents_compact (its shortlist_factor) on
+pg, or the same shortlist-then-rescore over a local index, where the
+prefix length can be swept as well:
+
+    python eval_retrieval.py questions.jsonl --backend pg --sweep exact --sweep "compact:shortlist_factor=2,4,8"
+    python eval_retrieval.py questions.jsonl --backend local --index .cache/index \
+        --probes 0 --sweep "compact:dims=256,512;shortlist_factor=4,8"
+
+For pg sweeps with build parameters (lists, m, ef_construction) the vector
+indexes on document_chunks are dropped and rebuilt for each combination
+and the original ones are recreated afterwards, so only use
+--rebuild-indexes against a local database.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from citations import chunk_citation_key, citation_matches, parse_citations
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "openai/text-embedding-3-small")
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "1536"))
+
+# Session settings per index type, and the parameters that need an index rebuild
+SESSION_PARAMS = {"probes": "ivfflat.probes", "ef_search": "hnsw.ef_search"}
+BUILD_PARAMS = {"ivfflat": ("lists",), "hnsw": ("m", "ef_construction")}
+# Arguments of the compact search function
+COMPACT_FUNCTION = "match_documents_compact"
+COMPACT_PARAMS = ("shortlist_factor",)
+# Vector indexes on the full-precision column (the sweeps leave embedding_compact's alone)
+VECTOR_INDEX_FILTER = (
+    "(indexdef ilike '%%using ivfflat%%' or indexdef ilike '%%using hnsw%%') and indexdef ilike '%%(embedding %%'"
+)
+
+
+def load_questions(path: Path) -> List[Dict]:
+    text = path.read_text(encoding="utf-8").strip()
+    entries = json.loads(text) if text.startswith("[") else [json.loads(l) for l in text.splitlines() if l.strip()]
+    questions = []
+    for n, entry in enumerate(entries):
+        expected = entry.get("expected") or []
+        if isinstance(expected, str):
+            expected = [expected]
+        keys = [key for citation in expected for key in parse_citations(citation)]
+        if not entry.get("question") or not keys:
+            print(f"Skipping entry {n + 1}: needs a question and at least one parseable citation", file=sys.stderr)
+            continue
+        questions.append({"id": entry.get("id", n + 1), "question": entry["question"], "expected": keys})
+    return questions
+
+
+def parse_sweep(spec: str) -> List[Dict]:
+    """'hnsw:m=16,32;ef_search=40,100' -> one config dict per combination."""
+    kind, _, params = spec.partition(":")
+    kind = kind.strip().lower()
+    if kind not in ("exact", "ivfflat", "hnsw", "compact"):
+        raise ValueError(f"Unknown index type in sweep {spec!r}")
+    names, values = [], []
+    for part in filter(None, (p.strip() for p in params.split(";"))):
+        name, _, options = part.partition("=")
+        names.append(name.strip())
+        values.append([int(v) for v in options.split(",") if v.strip()])
+    return [{"index": kind, **dict(zip(names, combo))} for combo in itertools.product(*values)]
+
+
+def split_floats(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def split_ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def score(questions: List[Dict], results: List[List[Dict]], ks: List[int], hierarchical: bool) -> Dict:
+    """recall@k (share of expected citations found in the top k, averaged) and MRR."""
+    recall = {k: 0.0 for k in ks}
+    reciprocal = 0.0
+    for question, rows in zip(questions, results):
+        keys = [chunk_citation_key(r.get("metadata")) for r in rows]
+        expected = question["expected"]
+        first = next(
+            (rank for rank, key in enumerate(keys, 1) if any(citation_matches(e, key, hierarchical) for e in expected)),
+            None,
+        )
+        if first:
+            reciprocal += 1.0 / first
+        for k in ks:
+            found = sum(1 for e in expected if any(citation_matches(e, key, hierarchical) for key in keys[:k]))
+            recall[k] += found / len(expected)
+    n = len(questions) or 1
+    return {
+        **{f"recall@{k}": round(recall[k] / n, 4) for k in ks},
+        "mrr": round(reciprocal / n, 4),
+    }
+
+
+class SupabaseBackend:
+    def __init__(self, function: str, rpc_args: Dict, text_arg: Optional[str] = None):
+        from supabase import create_client
+
+        self.client = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+        self.function = function
+        self.rpc_args = rpc_args
+        self.text_arg = text_arg
+
+    def configs(self, args) -> List[Dict]:
+        return [{"index": "deployed"}]
+
+    def prepare(self, config: Dict):
+        pass
+
+    def query(self, config: Dict, embedding: List[float], threshold: float, count: int,
+              text: Optional[str] = None) -> List[Dict]:
+        params = {"query_embedding": embedding, "match_threshold": threshold, "match_count": count}
+        if self.text_arg:
+            params[self.text_arg] = text
+        params.update(self.rpc_args)
+        return self.client.rpc(self.function, params).execute().data or []
+
+    def close(self):
+        pass
+
+
+class LocalBackend:
+    def __init__(self, index_path: Path):
+        from local_index import LocalIndex
+
+        self.index = LocalIndex(index_path)
+
+    def configs(self, args) -> List[Dict]:
+        compact = [c for spec in args.sweep or [] for c in parse_sweep(spec)]
+        if any(c["index"] != "compact" for c in compact):
+            raise SystemExit("--backend local only sweeps compact configurations; use --probes for IVF")
+        probes = split_ints(args.probes) if args.probes or not compact else []
+        if any(probes) and self.index.ivf is None:
+            lists = self.index.build_ivf()
+            print(f"Built IVF with {lists} lists for --probes", file=sys.stderr)
+        return [{"index": "ivf" if p else "exact", **({"probes": p} if p else {})} for p in probes] + compact
+
+    def prepare(self, config: Dict):
+        pass
+
+    def query(self, config: Dict, embedding: List[float], threshold: float, count: int,
+              text: Optional[str] = None) -> List[Dict]:
+        if config["index"] == "compact":
+            return self.index.search_compact(
+                embedding, threshold, count, config.get("dims", 512), config.get("shortlist_factor", 8),
+            )
+        return self.index.search(embedding, threshold, count, probes=config.get("probes"))
+
+    def close(self):
+        self.index.close()
+
+
+class PostgresBackend:
+    """Direct psycopg connections, one per worker thread, with per-config session settings."""
+
+    def __init__(self, dsn: str, function: str, table: str, rebuild: bool, text_arg: Optional[str] = None):
+        import psycopg
+
+        self.psycopg = psycopg
+        self.dsn = dsn
+        self.function = function
+        self.text_arg = text_arg
+        self.table = table
+        self.rebuild = rebuild
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._admin = psycopg.connect(dsn, autocommit=True)
+        self._built: Optional[Tuple] = None
+        self._original = self._admin.execute(
+            f"select indexname, indexdef from pg_indexes where tablename = %s and {VECTOR_INDEX_FILTER}",
+            (table,),
+        ).fetchall()
+
+    def configs(self, args) -> List[Dict]:
+        configs = []
+        for spec in args.sweep or ["exact"]:
+            configs.extend(parse_sweep(spec))
+        if not self.rebuild and any(k in c for c in configs for k in ("lists", "m", "ef_construction")):
+            raise SystemExit("Sweeping index build parameters drops and rebuilds indexes; pass --rebuild-indexes")
+        return configs
+
+    def _drop_vector_indexes(self):
+        rows = self._admin.execute(
+            f"select indexname from pg_indexes where tablename = %s and {VECTOR_INDEX_FILTER}",
+            (self.table,),
+        ).fetchall()
+        for (name,) in rows:
+            self._admin.execute(f'drop index if exists "{name}"')
+
+    def prepare(self, config: Dict):
+        kind = config["index"]
+        build = tuple((p, config[p]) for p in BUILD_PARAMS.get(kind, ()) if p in config)
+        if kind == "exact" or not build or (kind, build) == self._built:
+            return
+        self._drop_vector_indexes()
+        options = ", ".join(f"{p} = {v}" for p, v in build)
+        t0 = time.perf_counter()
+        self._admin.execute(
+            f"create index eval_embedding_idx on {self.table} using {kind} (embedding vector_cosine_ops) with ({options})"
+        )
+        print(f"  built {kind} ({options}) in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+        self._built = (kind, build)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self.psycopg.connect(self.dsn, autocommit=True)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def query(self, config: Dict, embedding: List[float], threshold: float, count: int,
+              text: Optional[str] = None) -> List[Dict]:
+        conn = self._connection()
+        # Session settings are applied per query because worker threads are shared across configs
+        exact = config["index"] == "exact"
+        conn.execute(f"set enable_indexscan = {'off' if exact else 'on'}")
+        for param, setting in SESSION_PARAMS.items():
+            if param in config:
+                conn.execute(f"set {setting} = {int(config[param])}")
+        vector = "[" + ",".join(repr(float(x)) for x in embedding) + "]"
+        call_args, params = "query_embedding => %s::vector, match_threshold => %s, match_count => %s", [vector, threshold, count]
+        function = self.function
+        if config["index"] == "compact":
+            function = COMPACT_FUNCTION
+            for param in COMPACT_PARAMS:
+                if param in config:
+                    call_args += f", {param} => %s"
+                    params.append(int(config[param]))
+        elif self.text_arg:
+            call_args += f", {self.text_arg} => %s"
+            params.append(text)
+        rows = conn.execute(
+            f"select id, content, metadata, similarity from {function}({call_args})", params,
+        ).fetchall()
+        return [{"id": r[0], "content": r[1], "metadata": r[2], "similarity": r[3]} for r in rows]
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+        if self._built:
+            self._drop_vector_indexes()
+            for name, definition in self._original:
+                print(f"Restoring {name}", file=sys.stderr)
+                self._admin.execute(definition)
+        self._admin.close()
+
+
+def embed_questions(questions: List[Dict]) -> List[List[float]]:
+    from embedding_batcher import EmbeddingBatcher, create_embedding_client
+    from embedding_cache import shared_cache
+
+    api_key = os.environ.get("OPENROUTER_API_KEY")
+    if not api_key:
+        raise SystemExit("OPENROUTER_API_KEY not set")
+    batcher = EmbeddingBatcher(create_embedding_client(api_key), EMBEDDING_MODEL, EMBEDDING_DIM, cache=shared_cache())
+    return batcher.embed_texts([q["question"] for q in questions])
+
+
+def run_config(backend, config: Dict, questions: List[Dict], embeddings: List[List[float]],
+               threshold: float, count: int, concurrency: int) -> Tuple[List[List[Dict]], List[float], float]:
+    latencies: List[Optional[float]] = [None] * len(questions)
+
+    def one(i: int) -> List[Dict]:
+        t0 = time.perf_counter()
+        rows = backend.query(config, embeddings[i], threshold, count, questions[i]["question"])
+        latencies[i] = time.perf_counter() - t0
+        return rows
+
+    # One untimed warm-up query so connection setup and page faults are not counted
+    backend.query(config, embeddings[0], threshold, count, questions[0]["question"])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(len(questions))))
+    return results, [l for l in latencies if l is not None], time.perf_counter() - start
+
+
+def config_label(config: Dict, threshold: float) -> str:
+    params = " ".join(f"{k}={v}" for k, v in config.items() if k != "index")
+    return f"{config['index']}{(' ' + params) if params else ''} t={threshold:g}"
+
+
+def print_table(rows: List[Dict], ks: List[int]):
+    headers = ["configuration"] + [f"R@{k}" for k in ks] + ["MRR", "p50 ms", "p95 ms", "qps"]
+    table = [
+        [r["label"]] + [f"{r[f'recall@{k}']:.3f}" for k in ks] + [
+            f"{r['mrr']:.3f}", f"{r['p50_ms']:.1f}", f"{r['p95_ms']:.1f}", f"{r['qps']:.1f}",
+        ]
+        for r in sorted(rows, key=lambda r: r["p50_ms"])
+    ]
+    widths = [max(len(str(row[i])) for row in [headers] + table) for i in range(len(headers))]
+    for row in [headers] + table:
+        print("  ".join(str(cell).ljust(widths[i]) if i == 0 else str(cell).rjust(widths[i]) for i, cell in enumerate(row)))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", type=Path, help="Labelled questions (JSONL or a JSON array)")
+    parser.add_argument("--backend", choices=("supabase", "local", "pg"), default="supabase")
+    parser.add_argument("--index", type=Path, help="Local index directory (--backend local)")
+    parser.add_argument("--dsn", default=os.environ.get("SUPABASE_DB_URL"), help="Postgres DSN (--backend pg)")
+    parser.add_argument("--function", default="match_documents", help="Search function (default: match_documents)")
+    parser.add_argument("--rpc-arg", action="append", default=[], metavar="KEY=JSON",
+                        help="Extra argument for the supabase RPC, e.g. filter_regulation='\"DFARS\"'")
+    parser.add_argument("--text-arg", metavar="NAME",
+                        help="Also pass the question text as this argument, e.g. query_text for hybrid_search")
+    parser.add_argument("--table", default="document_chunks")
+    parser.add_argument("--k", default="1,5,10", help="Cutoffs for recall@k (default: 1,5,10)")
+    parser.add_argument("--thresholds", default="0.1", help="match_threshold values (default: 0.1, as the chat route)")
+    parser.add_argument("--probes", help="IVF probes for --backend local, e.g. 0,1,4,16 (0 = exact)")
+    parser.add_argument("--sweep", action="append",
+                        help="Index configuration sweep for --backend pg, or compact sweeps for local (repeatable)")
+    parser.add_argument("--rebuild-indexes", action="store_true",
+                        help="Allow the pg sweep to drop and rebuild vector indexes (local databases only)")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="Count chunks inside an expected part/subpart/section as hits")
+    parser.add_argument("--concurrency", type=int, default=8, help="Queries in flight (default: 8)")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    return parser.parse_args()
+
+
+def main() -> int:
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=Path(__file__).parent / ".env")
+    except ImportError:
+        pass
+
+    args = parse_args()
+    questions = load_questions(args.questions)
+    if not questions:
+        print("No usable questions.", file=sys.stderr)
+        return 1
+    ks = sorted(set(split_ints(args.k)))
+    count = max(ks)
+
+    if args.backend == "local":
+        if not args.index:
+            raise SystemExit("--backend local needs --index")
+        backend = LocalBackend(args.index)
+    elif args.backend == "pg":
+        if not args.dsn:
+            raise SystemExit("--backend pg needs --dsn or SUPABASE_DB_URL")
+        backend = PostgresBackend(args.dsn, args.function, args.table, args.rebuild_indexes, args.text_arg)
+    else:
+        rpc_args = {}
+        for item in args.rpc_arg:
+            key, _, value = item.partition("=")
+            rpc_args[key] = json.loads(value)
+        backend = SupabaseBackend(args.function, rpc_args, args.text_arg)
+
+    print(f"Embedding {len(questions)} questions...", file=sys.stderr)
+    embeddings = embed_questions(questions)
+
+    rows = []
+    try:
+        for config in backend.configs(args):
+            backend.prepare(config)
+            for threshold in split_floats(args.thresholds):
+                label = config_label(config, threshold)
+                print(f"Running {label}", file=sys.stderr)
+                results, latencies, wall = run_config(
+                    backend, config, questions, embeddings, threshold, count, max(1, args.concurrency),
+                )
+                row = {"label": label, "config": config, "threshold": threshold}
+                row.update(score(questions, results, ks, args.hierarchical))
+                row["p50_ms"] = round(percentile(latencies, 50) * 1000, 2)
+                row["p95_ms"] = round(percentile(latencies, 95) * 1000, 2)
+                row["qps"] = round(len(questions) / wall, 1) if wall else 0.0
+                rows.append(row)
+    finally:
+        backend.close()
+
+    print(f"\n{len(questions)} questions, match_count {count}, backend {args.backend}\n")
+    print_table(rows, ks)
+    if args.output:
+        args.output.write_text(json.dumps({
+            "questions": len(questions),
+            "match_count": count,
+            "backend": args.backend,
+            "hierarchical": args.hierarchical,
+            "results": rows,
+        }, indent=2) + "\n")
+        print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
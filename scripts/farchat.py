@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the ingestion tooling.
+
+    python farchat.py ingest [--dry-run] [ingest_all.py options]
+    python farchat.py verify [--deep] [verify_ingestion.py options]
+    python farchat.py structure [generate_structure.py options]
+    python farchat.py bench [bench_ingest.py options]
+    python farchat.py warm [warm_query_cache.py options]
+
+Each subcommand's module is imported only when that subcommand runs, and
+the modules themselves defer the Supabase and OpenAI SDKs until a network
+call needs them, so `--help`, `ingest --dry-run` and `structure` start in
+a fraction of the time the old scripts took. The scripts can still be run
+directly; this only dispatches to their `main`.
+"""
+
+import argparse
+import importlib
+import sys
+from typing import List, Optional
+
+# Subcommand -> (module with a main(argv), summary)
+COMMANDS = {
+    "ingest": ("ingest_all", "Ingest every discovered regulation (--dry-run parses and chunks only)"),
+    "verify": ("verify_ingestion", "Check document_chunks against source_content (--deep for per-topic)"),
+    "structure": ("generate_structure", "Build the Regulation Explorer navigation shards"),
+    "bench": ("bench_ingest", "Benchmark the ingestion stages on a synthetic corpus"),
+    "warm": ("warm_query_cache", "Pre-populate the search result cache from a query log and section titles"),
+}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    epilog = "commands:\n" + "\n".join(f"  {name:<10} {summary}" for name, (_, summary) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog="farchat.py",
+        description="FARchat ingestion tooling. Run '<command> --help' for a command's options.",
+        epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    module_name, _ = COMMANDS[args.command]
+    # The subcommands' parsers report their own name in --help and errors
+    sys.argv[0] = f"farchat.py {args.command}"
+    result = importlib.import_module(module_name).main(args.args)
+    return result if isinstance(result, int) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,92 +1,193 @@
-import os
+"""
+Builds the regulation navigation trees for the app's Regulation Explorer.
+
+Every `<REG>_dita/*.ditamap` under source_content is read through its
+topic index (topic_index.py), the same one the ingest scripts walk: the
+map is only parsed when it changed since the index was cached. The maps
+are processed in parallel, one per worker process.
+
+Output (app/public/data/regulations/):
+  index.json   [{id, title, type, shard, hash, nodes}, ...] one entry per regulation
+  <REG>.json   that regulation's tree, compact JSON
+
+The app loads index.json and fetches a regulation's shard only when it is
+expanded (`?v=<hash>` busts caches when the tree changes). Node IDs are
+the topic's href stem, or for topics without an href a hash of the parent
+ID, title and position among same-titled siblings. The same maps
+therefore always produce byte-identical shards, and unchanged shards are
+not rewritten.
+
+    python generate_structure.py
+    python generate_structure.py --from-json ../app/src/data/regulations.json   # reshard an old combined file
+"""
+
+import argparse
+import hashlib
 import json
-import xml.etree.ElementTree as ET
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional
+
+from topic_index import TopicIndex
 
 # Configuration
 SOURCE_ROOT = Path(__file__).parent.parent / "source_content"
-OUTPUT_FILE = Path(__file__).parent.parent / "app/src/data/regulations.json"
+OUTPUT_DIR = Path(__file__).parent.parent / "app/public/data/regulations"
+INDEX_FILE = "index.json"
+
+
+def node_id(regulation: str, parent_id: str, title: str, occurrence: int) -> str:
+    digest = hashlib.sha1(f"{parent_id}\0{title}\0{occurrence}".encode("utf-8")).hexdigest()[:10]
+    return f"{regulation}-{digest}"
+
 
 class StructureBuilder:
     def __init__(self, map_path: Path):
         self.map_path = map_path
-        self.tree = ET.parse(str(map_path))
-        self.root = self.tree.getroot()
-        self.regulation_name = map_path.stem.split('.')[0] # e.g., "FAR"
-
-    def build(self):
-        """Builds a nested dictionary structure from the DITA map."""
-        
-        def _process_element(elem, level=0):
-            navtitle = elem.get("navtitle")
-            href = elem.get("href")
-            outputclass = elem.get("outputclass", "unknown")
-            
-            # Skip if no title/link (unless it has children)
-            if not navtitle and not elem.findall("topicref"):
-                return None
+        self.index = TopicIndex.load(map_path)
+        self.regulation_name = self.index.regulation_name # e.g., "FAR"
 
-            node = {
-                "id": f"{self.regulation_name}-{os.urandom(4).hex()}", # Temporary ID
-                "title": navtitle or "Untitled",
-                "type": outputclass,
-                "children": []
-            }
-
-            # Try to get a better ID from href if possible
-            if href:
-                # e.g. "FAR_Part_1.dita" -> "FAR_Part_1"
-                node["id"] = Path(href).stem
-
-            # Recurse
-            for child in elem:
-                if child.tag == "topicref":
-                    child_node = _process_element(child, level + 1)
-                    if child_node:
-                        node["children"].append(child_node)
-            
-            return node
-
-        # Start traversal
-        structure = []
-        for child in self.root:
-            if child.tag == "topicref":
-                node = _process_element(child)
-                if node:
-                    structure.append(node)
-        
-        return {
+    def build(self) -> Dict:
+        """Builds the nested structure in one pass over the map's topic index."""
+        root = {
             "id": self.regulation_name,
             "title": f"{self.regulation_name} Regulation",
             "type": "regulation",
-            "children": structure
+            "children": [],
         }
+        # A topicref with topicref children is kept even without a title
+        has_children = {topic.parent for topic in self.index}
+        # Node by ordinal (None when skipped), and seen titles per parent for ID occurrences
+        nodes: List[Optional[Dict]] = []
+        seen: Dict[int, Dict[str, int]] = {}
+        used_ids = set()
+
+        for topic in self.index:
+            parent = root if topic.parent < 0 else nodes[topic.parent]
+            title = topic.title
+            if topic.href:
+                # e.g. "FAR_Part_1.dita" -> "FAR_Part_1"
+                nid = Path(topic.href).stem
+            else:
+                siblings = seen.setdefault(topic.parent, {})
+                occurrence = siblings.get(title, 0)
+                siblings[title] = occurrence + 1
+                nid = node_id(self.regulation_name, parent["id"], title, occurrence)
+            if nid in used_ids:
+                # The same topic linked twice; keep React keys unique
+                suffix = 2
+                while f"{nid}-{suffix}" in used_ids:
+                    suffix += 1
+                nid = f"{nid}-{suffix}"
+            used_ids.add(nid)
+            node = {
+                "id": nid,
+                "title": title or "Untitled",
+                "type": "unknown" if topic.type is None else topic.type,
+                "children": [],
+            }
+            nodes.append(node)
+            # Skip if no title (unless it has children)
+            if title or topic.ordinal in has_children:
+                parent["children"].append(node)
+
+        return root
+
+
+def discover_maps(source_root: Path) -> List[Path]:
+    """Every ditamap in a *_dita directory (e.g. FAR_dita/FAR.ditamap, DFARSPGI_dita/PGI.ditamap)."""
+    if not source_root.exists():
+        return []
+    return sorted(
+        path
+        for folder in source_root.iterdir()
+        if folder.is_dir() and folder.name.endswith("_dita")
+        for path in folder.glob("*.ditamap")
+    )
+
+
+def count_nodes(node: Dict) -> int:
+    return sum(1 + count_nodes(child) for child in node.get("children", []))
+
+
+def write_shard(tree: Dict, output_dir: Path) -> Dict:
+    """Writes one regulation's compact JSON (only if it changed) and returns its index entry."""
+    payload = json.dumps(tree, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    digest = hashlib.sha256(payload).hexdigest()[:16]
+    shard = f"{tree['id']}.json"
+    _write_if_changed(output_dir / shard, payload)
+    return {
+        "id": tree["id"],
+        "title": tree["title"],
+        "type": tree.get("type", "regulation"),
+        "shard": shard,
+        "hash": digest,
+        "nodes": count_nodes(tree),
+    }
+
+
+def _write_if_changed(path: Path, payload: bytes):
+    # Leave unchanged files alone so their mtime (and any HTTP validators) stay put
+    if path.exists() and path.read_bytes() == payload:
+        return
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(payload)
+    os.replace(tmp, path)
+
+
+def build_shard(map_path: Path, output_dir: Path) -> Dict:
+    """Worker: parse one map and write its shard."""
+    builder = StructureBuilder(map_path)
+    tree = builder.build()
+    entry = write_shard(tree, output_dir)
+    print(f"Processed {builder.regulation_name}: {entry['nodes']} nodes")
+    return entry
+
+
+def regulation_order(entry: Dict):
+    # FAR, then DFARS, then the supplements alphabetically
+    return ({"FAR": 0, "DFARS": 1}.get(entry["id"], 2), entry["id"])
+
+
+def write_index(entries: List[Dict], output_dir: Path):
+    entries = sorted(entries, key=regulation_order)
+    payload = json.dumps(entries, indent=1, ensure_ascii=False).encode("utf-8") + b"\n"
+    _write_if_changed(output_dir / INDEX_FILE, payload)
+    # Shards of regulations that are no longer in the source tree
+    current = {entry["shard"] for entry in entries} | {INDEX_FILE}
+    for path in output_dir.glob("*.json"):
+        if path.name not in current:
+            path.unlink()
+            print(f"Removed stale shard {path.name}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate per-regulation navigation trees for the app.")
+    parser.add_argument("--source", type=Path, default=SOURCE_ROOT, help="source_content directory")
+    parser.add_argument("--output", type=Path, default=OUTPUT_DIR, help="Directory for index.json and the shards")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Maps parsed in parallel")
+    parser.add_argument("--from-json", type=Path, metavar="PATH",
+                        help="Split an existing combined regulations.json into shards instead of parsing maps")
+    args = parser.parse_args(argv)
+
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    if args.from_json:
+        with open(args.from_json, "r", encoding="utf-8") as f:
+            trees = json.load(f)
+        entries = [write_shard(tree, args.output) for tree in trees]
+    else:
+        maps = discover_maps(args.source)
+        if not maps:
+            print(f"No ditamaps found under {args.source}")
+            return
+        print(f"Found {len(maps)} regulation maps: {', '.join(m.stem for m in maps)}")
+        with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(maps)))) as pool:
+            entries = list(pool.map(build_shard, maps, [args.output] * len(maps)))
 
-def main():
-    regulations = [
-        {"name": "FAR", "map_dir": "FAR_dita"},
-        {"name": "DFARS", "map_dir": "DFARS_dita"},
-    ]
-    
-    full_toc = []
-    
-    for reg in regulations:
-        map_path = SOURCE_ROOT / reg["map_dir"] / f"{reg['name']}.ditamap"
-        if not map_path.exists():
-            print(f"Skipping {reg['name']}, map not found.")
-            continue
-            
-        print(f"Processing {reg['name']}...")
-        builder = StructureBuilder(map_path)
-        full_toc.append(builder.build())
-        
-    # Ensure directory exists
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(full_toc, f, indent=2)
-        
-    print(f"Structure saved to {OUTPUT_FILE}")
+    write_index(entries, args.output)
+    print(f"Structure saved to {args.output} ({len(entries)} regulations)")
 
 if __name__ == "__main__":
     main()
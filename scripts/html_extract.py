@@ -0,0 +1,121 @@
+"""
+lxml-based content extraction for the DITA HTML topics.
+
+Parses with libxml2's HTML parser and walks the content root once,
+dropping <nav> and script/style subtrees and emitting text together with
+paragraph/heading boundaries. Flat text matches what the previous
+BeautifulSoup extractor produced (`main.get_text(separator=' ', strip=True)`);
+see bench_extract.py for the parity check and benchmark.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import List, Optional
+
+import lxml.etree as ET
+import lxml.html
+
+from chunking import Block
+
+HEADING_TAGS = frozenset({"h1", "h2", "h3", "h4", "h5", "h6"})
+BLOCK_TAGS = HEADING_TAGS | frozenset({"p", "li", "dt", "dd", "td", "th", "pre", "caption"})
+# BeautifulSoup's get_text() leaves out script, style and template strings but keeps <noscript> text
+SKIP_TAGS = frozenset({"nav", "script", "style", "template"})
+
+# Comments are kept in the tree (and skipped in the walk) so the text on either
+# side of them stays two separate pieces, as it does in BeautifulSoup.
+_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+
+def _content_root(root) -> Optional[ET._Element]:
+    for path in (".//main", ".//article", ".//body"):
+        found = root.find(path)
+        if found is not None:
+            return found
+    return None
+
+
+def _walk(element, blocks: Optional[List[Block]], pieces: List[str]):
+    """Single pass over `element` collecting stripped text pieces in document order.
+
+    When `blocks` is given, text is also grouped into blocks: each block tag
+    closes the text gathered before it, so a container like <li> wrapping
+    a <p> yields its own text and the nested paragraph as separate blocks.
+    """
+    current: List[str] = []
+    open_blocks: List[str] = []
+
+    def close_block():
+        if blocks is not None and current:
+            heading = bool(open_blocks) and open_blocks[-1] in HEADING_TAGS
+            blocks.append(Block(" ".join(current), heading=heading))
+        current.clear()
+
+    def add(text: Optional[str]):
+        if text:
+            text = text.strip()
+            if text:
+                pieces.append(text)
+                current.append(text)
+
+    walker = ET.iterwalk(element, events=("start", "end", "comment", "pi"))
+    for event, el in walker:
+        if event in ("comment", "pi"):
+            # Skip the comment's own text but keep what follows it
+            add(el.tail)
+            continue
+        tag = el.tag
+        if event == "start":
+            if tag in SKIP_TAGS:
+                walker.skip_subtree()
+                continue
+            if tag in BLOCK_TAGS:
+                close_block()
+                open_blocks.append(tag)
+            add(el.text)
+        else:
+            if tag in BLOCK_TAGS:
+                close_block()
+                open_blocks.pop()
+            if el is not element:
+                add(el.tail)
+    close_block()
+
+
+def _parse(html_path: Path):
+    with open(html_path, "rb") as f:
+        data = f.read()
+    if not data.strip():
+        return None
+    return lxml.html.document_fromstring(data, parser=_PARSER)
+
+
+class HtmlContentExtractor:
+    @staticmethod
+    def extract_text(html_path: Path) -> str:
+        root = _parse(html_path)
+        main = _content_root(root) if root is not None else None
+        if main is None:
+            return ""
+        pieces: List[str] = []
+        _walk(main, None, pieces)
+        return " ".join(pieces)
+
+    @staticmethod
+    def extract_blocks(html_path: Path) -> List[Block]:
+        root = _parse(html_path)
+        main = _content_root(root) if root is not None else None
+        if main is None:
+            return []
+        blocks: List[Block] = []
+        _walk(main, blocks, [])
+        return blocks
+
+
+def blocks_text_hash(blocks: List[Block]) -> str:
+    """sha256 of a topic's extracted text with whitespace normalized; stored as metadata["text_hash"]."""
+    h = hashlib.sha256()
+    for block in blocks:
+        h.update(" ".join(block.text.split()).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
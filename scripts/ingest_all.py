@@ -1,89 +1,70 @@
+import argparse
 import os
-import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Optional, Generator
-import lxml.etree as ET
-from bs4 import BeautifulSoup
-from supabase import create_client, Client
-from openai import OpenAI
-from tqdm import tqdm
-
-try:
-    from dotenv import load_dotenv
-    # Look for .env in the same directory as this script
-    env_path = Path(__file__).parent / '.env'
-    load_dotenv(dotenv_path=env_path)
-except ImportError:
-    pass
-
-# Configuration
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
-EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "openai/text-embedding-3-small")
-EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "1536"))
-
-# Source Directories
-SOURCE_ROOT = Path(__file__).parent.parent / "source_content"
-
-class DitaMapParser:
-    def __init__(self, map_path: Path, html_dir: Path):
-        self.map_path = map_path
-        self.html_dir = html_dir
-        self.tree = ET.parse(str(map_path))
-        self.root = self.tree.getroot()
-        self.regulation_name = map_path.stem.split('.')[0] # e.g., "FAR"
-
-    def walk(self) -> Generator[Dict, None, None]:
-        """Traverses the DITA map and yields metadata + path for each relevant topic."""
-        for event, elem in ET.iterwalk(self.root, events=("start", "end")):
-            if event == "start" and elem.tag == "topicref":
-                title = elem.get("navtitle", "")
-                output_class = elem.get("outputclass", "")
-                href = elem.get("href", "")
-
-                if not title and not href:
-                    continue
-                
-                meta = {
-                    "regulation": self.regulation_name,
-                    "title": title,
-                    "type": output_class,
-                    "href": href
-                }
-
-                if href and href.endswith(".dita"):
-                    html_filename = href.replace(".dita", ".html")
-                    html_path = self.html_dir / html_filename
-                    if html_path.exists():
-                        yield {
-                            "metadata": meta,
-                            "html_path": html_path
-                        }
-
-class HtmlContentExtractor:
-    @staticmethod
-    def extract_text(html_path: Path) -> str:
-        with open(html_path, 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f, 'lxml')
-            for nav in soup.find_all('nav'):
-                nav.decompose()
-            main = soup.find('main') or soup.find('article') or soup.body
-            if not main:
-                return ""
-            return main.get_text(separator=' ', strip=True)
-
-def get_embedding(text: str, client: OpenAI) -> List[float]:
-    """Generates embeddings using OpenRouter."""
-    text = text.replace("\n", " ")
-    response = client.embeddings.create(
-        input=[text],
-        model=EMBEDDING_MODEL,
-        extra_body={"dimensions": EMBEDDING_DIM} if "openai" in EMBEDDING_MODEL.lower() else {}
-    )
-    return response.data[0].embedding
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional
+
+import async_clients
+from chunk_dedup import ChunkDedupIndex, minhash
+from chunking import Chunker, chunk_metadata
+from chunk_writer import FLUSH_ROWS, SUPABASE_DB_URL, create_chunk_writer, delete_chunks, delete_topic_chunks
+from embedding_batcher import EmbeddingBatcher, create_embedding_client, estimate_tokens
+from embedding_cache import EmbeddingCacheMiss, shared_cache
+from html_extract import HtmlContentExtractor, blocks_text_hash
+from ingest_checkpoint import IngestCheckpoint
+from ingest_common import (
+    EMBEDDING_DIM, EMBEDDING_MODEL, MIN_TOPIC_CHARS, OPENROUTER_API_KEY, SOURCE_ROOT, SUPABASE_KEY, SUPABASE_URL,
+    DitaMapParser, create_rest_client, create_supabase_client, discover_regulations, invalidate_query_cache,
+)
+from ingest_manifest import IngestManifest
+from ingest_metrics import metrics, profile_run
+from ingest_pipeline import IngestPipeline, PipelineStats, merge_stats
+from local_index import DTYPES
+from rate_limit import OPENROUTER_MAX_CONCURRENCY, shared_controller
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+    from local_index import LocalIndexWriter
+
+def extract_item(item: Dict, dedup: bool = False) -> List[tuple]:
+    """Pipeline extract stage: runs in a worker process and returns (text, metadata) per chunk.
+
+    With `dedup`, each chunk's MinHash signature rides along in `metadata["_minhash"]`
+    so the hashing is spread over the worker processes.
+    """
+    blocks = HtmlContentExtractor.extract_blocks(item["html_path"])
+    if sum(len(b.text) for b in blocks) < MIN_TOPIC_CHARS:
+        return []
+    # Chunks before the topic's first section number inherit its section from the map
+    chunks = Chunker().chunk_blocks(blocks, section=item["metadata"].get("section"))
+    # Lets verify_ingestion.py --deep tell current topics from stale ones
+    base = dict(item["metadata"], text_hash=blocks_text_hash(blocks))
+    results = []
+    for chunk in chunks:
+        meta = chunk_metadata(base, chunk, len(chunks))
+        if dedup:
+            meta["_minhash"] = minhash(chunk.text)
+        results.append((chunk.text, meta))
+    return results
 
-def process_regulation(reg_info: Dict, supabase: Client, openai_client: OpenAI):
+def invalidate_orphans(orphans: List[tuple], current: IngestManifest):
+    """Duplicates whose canonical chunk is being replaced must be re-embedded on their regulation's next run."""
+    by_regulation: Dict[str, List[str]] = {}
+    for regulation, href in orphans:
+        by_regulation.setdefault(regulation, []).append(href)
+    for regulation, hrefs in by_regulation.items():
+        manifest = current if regulation == current.name else IngestManifest(regulation, current.model)
+        manifest.invalidate(hrefs)
+        if manifest is not current:
+            manifest.save()
+    print(f"{len(orphans)} duplicate topics lost their canonical copy and will be re-ingested on their next run.")
+
+def process_regulation(reg_info: Dict, supabase: "Client", openai_client, args: argparse.Namespace,
+                       checkpoint: IngestCheckpoint, local_index: Optional["LocalIndexWriter"] = None,
+                       dedup: Optional[ChunkDedupIndex] = None, rest=None,
+                       on_changed: Optional[Callable[[str], None]] = None) -> Optional[PipelineStats]:
     map_name = reg_info["map_name"]
     map_dir = reg_info["map_dir"]
     html_dir = reg_info["html_dir"]
@@ -93,64 +74,229 @@ def process_regulation(reg_info: Dict, supabase: Client, openai_client: OpenAI):
     
     if not map_path.exists():
         print(f"Skipping {map_name}: Map not found at {map_path}")
-        return
+        return None
+
+    if checkpoint.is_regulation_done(map_name):
+        print(f"Skipping {map_name}: already completed in the run being resumed")
+        return None
 
     print(f"\n🚀 Processing {map_name} from {map_dir}...")
     parser = DitaMapParser(map_path, html_path)
-    
-    items = list(parser.walk())
+    print(f"Topic index: {len(parser.index)} topicrefs ({'parsed' if parser.index.parsed else 'cached'})")
+
+    manifest = IngestManifest(map_name, f"{EMBEDDING_MODEL}:{EMBEDDING_DIM}")
+    checkpoint.replay_into(map_name, manifest)
+    with metrics.timer("walk_seconds"):
+        topics = list(parser.walk())
+    metrics.count("topics_walked", len(topics))
+    with metrics.timer("plan_seconds"):
+        plan = manifest.plan(topics, force=args.full)
+    print(f"Manifest: {plan.summary()}")
+
+    items = checkpoint.pending(map_name, plan.changed)
     limit = int(os.environ.get("INGEST_LIMIT", "0"))
     if limit > 0:
         items = items[:limit]
         print(f"Limit applied: only first {limit} items will be processed.")
 
-    for item in tqdm(items, desc=f"Ingesting {map_name}"):
-        meta = item["metadata"]
-        html_file = item["html_path"]
-        
-        text = HtmlContentExtractor.extract_text(html_file)
-        if not text or len(text) < 50:
-            continue
-            
+    # Drop chunks of modified and removed topics before writing their replacements
+    replaced = [item["metadata"]["href"] for item in items] + plan.removed
+    stale_ids, stale_hrefs = manifest.stale(replaced)
+    if stale_ids or stale_hrefs:
+        delete_chunks(supabase, stale_ids)
+        for href in stale_hrefs:
+            delete_topic_chunks(supabase, parser.regulation_name, href)
+        print(f"Deleted {len(stale_ids)} stale chunks ({len(stale_hrefs)} topics without recorded ids).")
+    if dedup and replaced:
+        orphans = dedup.forget(parser.regulation_name, replaced)
+        if orphans:
+            invalidate_orphans(orphans, manifest)
+    if local_index and replaced:
+        local_index.remove(parser.regulation_name, replaced)
+    manifest.forget(replaced)
+    checkpoint.reset(map_name, replaced)
+    manifest.save()
+    if replaced and on_changed:
+        on_changed(map_name)
+
+    fingerprints = {item["metadata"]["href"]: item.pop("_fingerprint") for item in items}
+
+    def record_written(rows: List[Dict], ids: List[Optional[int]]):
+        for row, chunk_id in zip(rows, ids):
+            meta = row["metadata"]
+            href, expected = meta["href"], meta.get("chunk_count", 1)
+            manifest.record(href, fingerprints[href], [chunk_id], expected)
+            checkpoint.record_written(map_name, href, fingerprints[href], [chunk_id], expected)
+        if local_index:
+            local_index.add_rows(rows, ids)
+        if dedup:
+            dedup.record_written(rows)
+
+    def record_failed(stage: str, obj: Dict, error: BaseException):
+        meta = obj["metadata"] if stage == "extract" else obj
+        checkpoint.record_failed(map_name, meta["href"], stage, error)
+        if dedup:
+            dedup.discard(parser.regulation_name, meta["href"])
+
+    writer = create_chunk_writer(
+        supabase,
+        rest=rest,
+        flush_rows=args.flush_rows,
+        on_written=record_written,
+        on_failed=lambda row, error: record_failed("insert", row["metadata"], error),
+    )
+
+    def skip_embed(text: str, meta: Dict) -> bool:
+        signature = meta.pop("_minhash", None)
+        if signature is None:
+            return False
+        reference = dedup.check(meta, signature)
+        if reference is None:
+            return False
+        meta["duplicate_of"] = reference
+        metrics.count("dedup_chunks")
+        return True
+
+    def insert_chunk(meta: Dict, text: str, embedding: Optional[List[float]]):
+        data = {
+            "content": text,
+            "metadata": meta,
+            "embedding": embedding
+        }
+        writer.write(data)
+
+    from tqdm import tqdm
+
+    batcher = EmbeddingBatcher(openai_client, EMBEDDING_MODEL, EMBEDDING_DIM, cache=shared_cache())
+    with tqdm(total=len(items), desc=f"Ingesting {map_name}") as progress:
+        pipeline = IngestPipeline(
+            partial(extract_item, dedup=dedup is not None),
+            batcher,
+            insert_chunk,
+            extract_workers=args.extract_workers,
+            embed_concurrency=args.embed_concurrency,
+            insert_concurrency=args.insert_concurrency,
+            on_progress=progress.update,
+            on_skip=lambda item: checkpoint.record_skipped(map_name, item["metadata"]["href"]),
+            on_error=record_failed,
+            skip_embed=skip_embed if dedup else None,
+        )
+        failures_before = checkpoint.failed_this_run
         try:
-            embedding = get_embedding(text, openai_client)
-            data = {
-                "content": text,
-                "metadata": meta,
-                "embedding": embedding
-            }
-            supabase.table("document_chunks").insert(data).execute()
-        except Exception as e:
-            print(f"Error processing {html_file.name}: {e}")
-
-def discover_regulations() -> List[Dict]:
-    """Automatically finds pairs of _dita and _dita_html folders."""
-    regs = []
-    # Known special mappings
-    special_maps = {
-        "DFARSPGI": "PGI",
-    }
-
-    folders = [f for f in SOURCE_ROOT.iterdir() if f.is_dir()]
-    dita_folders = [f for f in folders if f.name.endswith("_dita")]
-
-    for dita_dir in dita_folders:
-        base_name = dita_dir.name.replace("_dita", "")
-        html_dir_name = f"{base_name}_dita_html"
-        html_dir = SOURCE_ROOT / html_dir_name
-        
-        if html_dir.exists():
-            map_name = special_maps.get(base_name, base_name)
-            regs.append({
-                "name": base_name,
-                "map_name": map_name,
-                "map_dir": dita_dir.name,
-                "html_dir": html_dir_name
-            })
-    
-    return regs
+            stats = pipeline.run(items)
+        finally:
+            writer.close()
+            manifest.save()
+
+    print(f"Embedded {map_name} in {batcher.requests} requests ({batcher.splits} oversized batches split).")
+    print(f"Inserted {map_name}: {writer.summary()}.")
+    if checkpoint.failed_this_run == failures_before:
+        checkpoint.mark_regulation_done(map_name)
+    print(stats.report())
+    return stats
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Ingest all discovered regulations into Supabase.")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes used for HTML extraction (default: CPU count)")
+    parser.add_argument("--embed-concurrency", type=int, default=OPENROUTER_MAX_CONCURRENCY,
+                        help="Embedding threads, and so the most requests the adaptive limit can reach "
+                             f"(default: OPENROUTER_MAX_CONCURRENCY, {OPENROUTER_MAX_CONCURRENCY})")
+    parser.add_argument("--insert-concurrency", type=int, default=2,
+                        help="Threads writing to Supabase (default: 2)")
+    parser.add_argument("--flush-rows", type=int, default=FLUSH_ROWS,
+                        help=f"Rows per multi-row insert (default: {FLUSH_ROWS})")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Walk, plan and chunk every regulation and report the totals; no network, nothing written")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the manifest and re-ingest every topic")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume the last run, retrying only failed or unfinished topics")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Attempts per topic across resumed runs before it is dead-lettered (default: 3)")
+    parser.add_argument("--local-index", type=Path, metavar="DIR",
+                        help="Also write the chunks written by this run to a local vector index (see local_index.py); "
+                             "rebuilt with --full, otherwise updated in place")
+    parser.add_argument("--local-index-dtype", choices=DTYPES, default="float32",
+                        help="Storage type for --local-index vectors (default: float32)")
+    parser.add_argument("--defer-index", action="store_true",
+                        help="Drop the vector index before loading and rebuild it afterwards (needs SUPABASE_DB_URL)")
+    parser.add_argument("--metrics-json", type=Path, metavar="PATH",
+                        help="Write a JSON run report with per-stage timings, counters and errors")
+    parser.add_argument("--metrics-prom", type=Path, metavar="PATH",
+                        help="Write the same metrics in Prometheus text format (e.g. for the node exporter textfile collector)")
+    parser.add_argument("--profile", type=Path, nargs="?", const=Path("ingest_all.prof"), metavar="PATH",
+                        help="Run under cProfile and write the stats to PATH (default: ingest_all.prof)")
+    return parser.parse_args(argv)
+
+def write_metrics(args: argparse.Namespace, runs: List[PipelineStats]):
+    """Folds end-of-run totals into the metrics and writes the requested reports."""
+    controller = shared_controller()
+    metrics.gauge("openrouter_requests_per_second", round(controller.requests_per_second(), 3))
+    metrics.gauge("openrouter_concurrency_limit", round(controller.limit, 2))
+    metrics.count("openrouter_retries", controller.retries)
+    metrics.count("openrouter_throttles", controller.throttles)
+    for session in async_clients.session_stats():
+        metrics.count(f"http_{session.name}_requests", session.requests)
+        metrics.count(f"http_{session.name}_connections", session.connections)
+        metrics.gauge(f"http_{session.name}_peak_in_flight", session.peak_in_flight)
+    cache = shared_cache()
+    if cache:
+        metrics.count("embedding_cache_hits", cache.hits)
+        metrics.count("embedding_cache_misses", cache.misses)
+
+    if args.metrics_json:
+        total = merge_stats(runs) if runs else PipelineStats()
+        stages = {
+            stage.name: {"items": stage.items, "errors": stage.errors, "busy_seconds": round(stage.busy_seconds, 3)}
+            for stage in (total.extract, total.embed, total.insert)
+        }
+        args_dict = {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()}
+        metrics.write_json(args.metrics_json, {"script": "ingest_all", "args": args_dict, "pipeline": stages})
+        print(f"Metrics report written to {args.metrics_json}")
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+        print(f"Prometheus metrics written to {args.metrics_prom}")
+
+def dry_run(args: argparse.Namespace):
+    """Walks, plans and chunks every regulation without touching Supabase, OpenRouter or the manifests."""
+    regulations = discover_regulations()
+    regulations.sort(key=lambda r: r["map_name"] != "FAR")
+    print(f"Dry run over {len(regulations)} regulations; nothing will be embedded or written.")
+
+    limit = int(os.environ.get("INGEST_LIMIT", "0"))
+    totals = {"topics": 0, "items": 0, "chunks": 0, "chars": 0, "tokens": 0}
+    with ProcessPoolExecutor(max_workers=max(1, args.extract_workers)) as pool:
+        for reg in regulations:
+            map_path = SOURCE_ROOT / reg["map_dir"] / f"{reg['map_name']}.ditamap"
+            if not map_path.exists():
+                print(f"Skipping {reg['map_name']}: Map not found at {map_path}")
+                continue
+            parser = DitaMapParser(map_path, SOURCE_ROOT / reg["html_dir"])
+            topics = list(parser.walk())
+            manifest = IngestManifest(reg["map_name"], f"{EMBEDDING_MODEL}:{EMBEDDING_DIM}")
+            plan = manifest.plan(topics, force=args.full)
+            items = plan.changed[:limit] if limit > 0 else plan.changed
+
+            chunks = chars = tokens = 0
+            for result in pool.map(extract_item, items, chunksize=16):
+                chunks += len(result)
+                chars += sum(len(text) for text, _ in result)
+                tokens += sum(estimate_tokens(text) for text, _ in result)
+            print(f" - {reg['map_name']}: {plan.summary()}; {len(items)} topics -> {chunks} chunks, "
+                  f"{chars:,} chars, ~{tokens:,} tokens")
+            for key, value in (("topics", len(topics)), ("items", len(items)), ("chunks", chunks),
+                               ("chars", chars), ("tokens", tokens)):
+                totals[key] += value
+
+    print(f"\nWould ingest {totals['items']} of {totals['topics']} topics as {totals['chunks']} chunks "
+          f"(~{totals['tokens']:,} embedding tokens).")
+
+def run(args: argparse.Namespace):
+    if args.dry_run:
+        dry_run(args)
+        return
 
-def main():
     if not SUPABASE_URL or not SUPABASE_KEY:
         print("Error: SUPABASE_URL and SUPABASE_KEY required in .env")
         return
@@ -159,22 +305,102 @@ def main():
         print("Error: OPENROUTER_API_KEY required in .env")
         return
 
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    openai_client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=OPENROUTER_API_KEY,
-    )
+    if args.defer_index and not SUPABASE_DB_URL:
+        print("Error: --defer-index needs SUPABASE_DB_URL (direct Postgres connection)")
+        return
+
+    supabase = create_supabase_client()
+    rest = create_rest_client()
+    openai_client = create_embedding_client(OPENROUTER_API_KEY)
+    # Only the embed threads ask for permits, so the adaptive limit can't usefully grow past them
+    shared_controller().cap(args.embed_concurrency)
 
     regulations = discover_regulations()
+    # FAR goes first so the supplements' verbatim copies of its text link to it, not the other way round
+    regulations.sort(key=lambda r: r["map_name"] != "FAR")
     
     print(f"Found {len(regulations)} regulations for ingestion:")
     for r in regulations:
         print(f" - {r['name']} (Map: {r['map_name']})")
 
-    for reg in regulations:
-        process_regulation(reg, supabase, openai_client)
+    checkpoint = IngestCheckpoint("ingest_all", resume=args.resume, max_attempts=args.max_attempts)
+    local_index = None
+    if args.local_index:
+        # Writing the index needs numpy; runs without --local-index never load it
+        from local_index import LocalIndexWriter
+
+        # Only a fresh --full run rebuilds it; incremental and resumed runs upsert the topics they rewrite
+        local_index = LocalIndexWriter(args.local_index, EMBEDDING_DIM, args.local_index_dtype, EMBEDDING_MODEL,
+                                       reset=args.full and not args.resume)
+    dedup = ChunkDedupIndex.from_env()
+    vector_index, dropped_indexes = None, []
+    if args.defer_index:
+        from vector_index import VectorIndex
+
+        # Index maintenance per inserted row is the main cost of a bulk load; build once at the end instead
+        vector_index = VectorIndex(SUPABASE_DB_URL)
+        dropped_indexes = vector_index.drop()
+    runs = []
+    changed: List[str] = []
+    try:
+        for reg in regulations:
+            try:
+                stats = process_regulation(reg, supabase, openai_client, args, checkpoint, local_index, dedup, rest,
+                                           on_changed=changed.append)
+            except EmbeddingCacheMiss:
+                # Offline mode: stop the whole run rather than moving on to the next regulation
+                raise
+            except Exception as e:
+                print(f"Error processing {reg['name']}: {e}")
+                metrics.error("regulation", e)
+                continue
+            if stats:
+                runs.append(stats)
+    finally:
+        checkpoint.close()
+        if dedup:
+            dedup.close()
+        if local_index:
+            local_index.close()
+            print(f"Local index: {local_index.count} chunks in {args.local_index}")
+        if vector_index:
+            with metrics.timer("index_build_seconds"):
+                vector_index.restore(dropped_indexes)
+            vector_index.close()
+
+    if checkpoint.failed_this_run:
+        print(f"\n⚠️  {checkpoint.failed_this_run} topic failures. Re-run with --resume to retry them.")
+    if changed:
+        invalidate_query_cache(supabase)
+
+    if runs:
+        print("\n📊 Per-stage throughput (all regulations):")
+        print(merge_stats(runs).report())
+
+    print(shared_controller().report())
+    http_report = async_clients.report()
+    if http_report:
+        print(http_report)
+    cache = shared_cache()
+    if cache:
+        print(cache.report())
+    if dedup:
+        print(dedup.report())
+
+    if metrics.enabled:
+        write_metrics(args, runs)
+    async_clients.close_sessions()
 
     print("\n✅ Universal Ingestion Complete!")
 
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.metrics_json or args.metrics_prom:
+        metrics.enable()
+    if args.profile:
+        profile_run(lambda: run(args), args.profile)
+    else:
+        run(args)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,156 @@
+"""
+Durable progress checkpoints for long ingestion runs.
+
+Progress is an append-only JSONL journal, one line per event:
+
+    {"event": "written",  "reg": "FAR", "href": ..., "fingerprint": {...}, "ids": [...], "expected": 3}
+    {"event": "skipped",  "reg": "FAR", "href": ...}
+    {"event": "reset",    "reg": "FAR", "href": ...}
+    {"event": "failed",   "reg": "FAR", "href": ..., "stage": "embed", "error": "..."}
+    {"event": "reg_done", "reg": "FAR"}
+
+A topic is finished once all `expected` chunks have "written" events since
+its last "reset" (emitted when a partially written topic is started over).
+`--resume` replays the journal: finished regulations and topics are skipped,
+written chunk ids are folded back into the manifest, and failed topics are
+retried until they reach the attempt limit, after which they are listed in
+the dead-letter file instead.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from ingest_manifest import IngestManifest
+
+DEFAULT_CHECKPOINT_DIR = Path(__file__).parent / ".cache" / "checkpoints"
+CHECKPOINT_DIR = Path(os.environ.get("INGEST_CHECKPOINT_DIR", str(DEFAULT_CHECKPOINT_DIR)))
+
+
+class IngestCheckpoint:
+    def __init__(self, name: str, resume: bool = False, max_attempts: int = 3, directory: Path = CHECKPOINT_DIR):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / f"{name}.jsonl"
+        self.dead_letter_path = directory / f"{name}.dead_letter.jsonl"
+        self.max_attempts = max(1, max_attempts)
+
+        self.regs_done: Set[str] = set()
+        self.done: Dict[str, Set[str]] = defaultdict(set)
+        self.written: Dict[str, Dict[str, List[Dict]]] = defaultdict(dict)
+        self.failures: Dict[tuple, List[Dict]] = defaultdict(list)
+        self.failed_this_run = 0
+        self._lock = threading.Lock()
+
+        if resume and self.path.exists():
+            self._replay()
+        elif self.dead_letter_path.exists():
+            self.dead_letter_path.unlink()
+
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        self._last_sync = time.monotonic()
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a killed run
+                    continue
+                kind, reg = event.get("event"), event.get("reg")
+                if kind == "reg_done":
+                    self.regs_done.add(reg)
+                elif kind == "written":
+                    events = self.written[reg].setdefault(event["href"], [])
+                    events.append(event)
+                    if sum(len(e.get("ids") or []) for e in events) >= event.get("expected", 1):
+                        self.done[reg].add(event["href"])
+                elif kind == "reset":
+                    self.written[reg].pop(event["href"], None)
+                    self.done[reg].discard(event["href"])
+                elif kind == "skipped":
+                    self.done[reg].add(event["href"])
+                elif kind == "failed":
+                    self.failures[(reg, event["href"])].append(event)
+
+    def _append(self, event: Dict):
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            # fsync at most once a second; a crash loses at most that much progress
+            if time.monotonic() - self._last_sync >= 1.0:
+                os.fsync(self._file.fileno())
+                self._last_sync = time.monotonic()
+
+    def is_regulation_done(self, reg: str) -> bool:
+        return reg in self.regs_done
+
+    def mark_regulation_done(self, reg: str):
+        self.regs_done.add(reg)
+        self._append({"event": "reg_done", "reg": reg})
+
+    def record_written(self, reg: str, href: str, fingerprint: Optional[Dict], ids: List[Optional[int]], expected: int = 1):
+        self._append({
+            "event": "written", "reg": reg, "href": href,
+            "fingerprint": fingerprint, "ids": ids, "expected": expected,
+        })
+
+    def reset(self, reg: str, hrefs: Iterable[str]):
+        """Forgets partial progress for topics whose chunks are about to be deleted and rewritten."""
+        for href in hrefs:
+            if self.written[reg].pop(href, None) is not None:
+                self._append({"event": "reset", "reg": reg, "href": href})
+
+    def record_skipped(self, reg: str, href: str):
+        self._append({"event": "skipped", "reg": reg, "href": href})
+
+    def record_failed(self, reg: str, href: str, stage: str, error: BaseException):
+        with self._lock:
+            self.failed_this_run += 1
+        self._append({"event": "failed", "reg": reg, "href": href, "stage": stage, "error": str(error)[:500]})
+
+    def replay_into(self, reg: str, manifest: IngestManifest):
+        """Folds chunk ids written by an interrupted run back into the manifest."""
+        for href, events in self.written.get(reg, {}).items():
+            for event in events:
+                if event.get("fingerprint"):
+                    manifest.record(href, event["fingerprint"], event.get("ids") or [], event.get("expected", 1))
+
+    def pending(self, reg: str, items: List[Dict]) -> List[Dict]:
+        """Drops finished topics and dead-letters the ones that exhausted their attempts."""
+        done = self.done.get(reg, set())
+        keep = []
+        dead = []
+        for item in items:
+            href = item["metadata"]["href"]
+            if href in done:
+                continue
+            failures = self.failures.get((reg, href), [])
+            if len(failures) >= self.max_attempts:
+                dead.append({
+                    "reg": reg,
+                    "href": href,
+                    "attempts": len(failures),
+                    "last_stage": failures[-1].get("stage"),
+                    "last_error": failures[-1].get("error"),
+                })
+                continue
+            keep.append(item)
+        if dead:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for entry in dead:
+                    f.write(json.dumps(entry) + "\n")
+            print(f"{len(dead)} {reg} topics exhausted {self.max_attempts} attempts; listed in {self.dead_letter_path}")
+        return keep
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
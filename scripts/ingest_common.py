@@ -0,0 +1,146 @@
+"""
+Configuration and DITA map walking shared by the ingestion scripts.
+
+ingest_all.py, ingest_far.py, ingest_va_pdf.py and verify_ingestion.py
+all read the same .env, walk ditamaps the same way (through the cached
+topic index in topic_index.py) and talk to the same Supabase project.
+This module only imports lxml at load time; the Supabase and OpenAI SDKs,
+which take most of a second to import, are imported by the helpers that
+need them, so parse-only work (--dry-run, --help, structure generation)
+never pays for them.
+"""
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Generator, List, Optional
+
+from topic_index import TopicIndex
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+try:
+    from dotenv import load_dotenv
+    # Look for .env in the same directory as the scripts
+    load_dotenv(dotenv_path=Path(__file__).parent / ".env")
+except ImportError:
+    pass
+
+# Configuration
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "openai/text-embedding-3-small")
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "1536"))
+
+# Topics with less extracted text than this are skipped
+MIN_TOPIC_CHARS = 50
+
+# Source Directories
+SOURCE_ROOT = Path(__file__).parent.parent / "source_content"
+
+# Map names that differ from their folder's name
+SPECIAL_MAPS = {
+    "DFARSPGI": "PGI",
+}
+
+
+class DitaMapParser:
+    """Walks a ditamap's topics through its cached TopicIndex (parsed only when the map changed)."""
+
+    def __init__(self, map_path: Path, html_dir: Path):
+        self.map_path = map_path
+        self.html_dir = html_dir
+        self.index = TopicIndex.load(map_path)
+        self.regulation_name = self.index.regulation_name # e.g., "FAR"
+
+    def walk(self) -> Generator[Dict, None, None]:
+        """Yields metadata + path for each topic with an HTML file, in map order.
+
+        The metadata carries the topic's part/subpart/section from the map, and
+        `stat` its file's (mtime, size) so the manifest need not stat it again.
+        """
+        for topic, html_path in self.index.with_html(self.html_dir):
+            meta = {
+                "regulation": self.regulation_name,
+                "title": topic.title,
+                "type": topic.type or "",
+                "href": topic.href,
+                **topic.lineage(),
+            }
+            yield {
+                "metadata": meta,
+                "html_path": html_path,
+                "stat": (topic.mtime, topic.size),
+            }
+
+
+def discover_regulations(source_root: Optional[Path] = None) -> List[Dict]:
+    """Automatically finds pairs of _dita and _dita_html folders."""
+    source_root = source_root or SOURCE_ROOT
+    regs = []
+    if not source_root.exists():
+        return regs
+
+    folders = [f for f in source_root.iterdir() if f.is_dir()]
+    dita_folders = [f for f in folders if f.name.endswith("_dita")]
+
+    for dita_dir in dita_folders:
+        base_name = dita_dir.name.replace("_dita", "")
+        html_dir_name = f"{base_name}_dita_html"
+        html_dir = source_root / html_dir_name
+
+        if html_dir.exists():
+            map_name = SPECIAL_MAPS.get(base_name, base_name)
+            regs.append({
+                "name": base_name,
+                "map_name": map_name,
+                "map_dir": dita_dir.name,
+                "html_dir": html_dir_name
+            })
+
+    return regs
+
+
+def create_supabase_client() -> "Client":
+    from supabase import create_client
+
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+def create_rest_client():
+    """The pooled async Supabase REST session for chunk inserts (async_clients), or None if ASYNC_HTTP=0."""
+    from async_clients import ASYNC_HTTP, pooled_rest_client
+
+    if not ASYNC_HTTP:
+        return None
+    return pooled_rest_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+def invalidate_query_cache(supabase: "Client"):
+    """Marks every cached search result stale after a run changed document_chunks.
+
+    Stale entries are re-searched with their stored query embedding on their
+    next lookup (supabase/migrations/20261018050000_query_cache.sql).
+    """
+    try:
+        version = supabase.rpc("invalidate_query_cache", {}).execute().data
+    except Exception as e:
+        print(f"Query cache not invalidated ({str(e)[:80]}); apply the query_cache migration if you use it.")
+        return
+    print(f"Query cache invalidated (corpus version {version}).")
+
+
+def get_embedding(text: str, client=None) -> List[float]:
+    """Generates one embedding using OpenRouter (prefer EmbeddingBatcher for anything in bulk)."""
+    from embedding_batcher import EmbeddingBatcher, clean_text, create_embedding_client
+    from embedding_cache import shared_cache
+
+    if not clean_text(text):
+        return []
+    if client is None:
+        if not OPENROUTER_API_KEY:
+            raise ValueError("OPENROUTER_API_KEY not set")
+        client = create_embedding_client(OPENROUTER_API_KEY)
+    return EmbeddingBatcher(client, EMBEDDING_MODEL, EMBEDDING_DIM, cache=shared_cache()).embed_texts([text])[0]
+
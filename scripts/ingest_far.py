@@ -1,127 +1,75 @@
 import os
-import re
-from pathlib import Path
-from typing import List, Dict, Optional, Generator
-import lxml.etree as ET
-from bs4 import BeautifulSoup
-from supabase import create_client, Client
-from openai import OpenAI
-try:
-    from dotenv import load_dotenv
-    # Look for .env in the same directory as this script
-    env_path = Path(__file__).parent / '.env'
-    load_dotenv(dotenv_path=env_path)
-except ImportError:
-    pass
-
-# Configuration
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
-EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "openai/text-embedding-3-small")
-EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "1536"))
-
-# Source Directories
-SOURCE_ROOT = Path(__file__).parent.parent / "source_content"
-
-class DitaMapParser:
-    def __init__(self, map_path: Path, html_dir: Path):
-        self.map_path = map_path
-        self.html_dir = html_dir
-        self.tree = ET.parse(str(map_path))
-        self.root = self.tree.getroot()
-        self.regulation_name = map_path.stem.split('.')[0] # e.g., "FAR"
-
-    def walk(self) -> Generator[Dict, None, None]:
-        """Traverses the DITA map and yields metadata + path for each relevant topic."""
-        # Stack for hierarchy tracking: (level, title, type)
-        hierarchy = []
-
-        for event, elem in ET.iterwalk(self.root, events=("start", "end")):
-            if event == "start" and elem.tag == "topicref":
-                title = elem.get("navtitle", "")
-                output_class = elem.get("outputclass", "")
-                href = elem.get("href", "")
-
-                # Skip non-content refs
-                if not title and not href:
-                    continue
-
-                # Update hierarchy
-                # Note: This is a simplification. A real DITA parser would be more complex.
-                # Here we assume the natural order of topicrefs defines hierarchy.
-                
-                meta = {
-                    "regulation": self.regulation_name,
-                    "title": title,
-                    "type": output_class,
-                    "href": href
-                }
-
-                if href and href.endswith(".dita"):
-                    html_filename = href.replace(".dita", ".html")
-                    html_path = self.html_dir / html_filename
-                    if html_path.exists():
-                        yield {
-                            "metadata": meta,
-                            "html_path": html_path
-                        }
-
-class HtmlContentExtractor:
-    @staticmethod
-    def extract_text(html_path: Path) -> str:
-        with open(html_path, 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f, 'lxml')
-            
-            # Remove nav and boilerplate
-            for nav in soup.find_all('nav'):
-                nav.decompose()
-            
-            # Extract main content
-            main = soup.find('main') or soup.find('article') or soup.body
-            if not main:
-                return ""
-            
-            # Preserve some structure with spaces
-            return main.get_text(separator=' ', strip=True)
-
-def get_embedding(text: str) -> List[float]:
-    """Generates embeddings using OpenRouter."""
-    if not OPENROUTER_API_KEY:
-        raise ValueError("OPENROUTER_API_KEY not set")
-        
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=OPENROUTER_API_KEY,
-    )
-    
-    # Clean text
-    text = text.replace("\n", " ")
-    
-    response = client.embeddings.create(
-        input=[text],
-        model=EMBEDDING_MODEL,
-        extra_body={"dimensions": EMBEDDING_DIM} if "openai" in EMBEDDING_MODEL.lower() else {}
-    )
-    return response.data[0].embedding
-
-def process_regulation(map_name: str, map_dir: str, html_dir: str):
+import sys
+from typing import Tuple
+
+from chunking import Chunker, chunk_metadata
+import async_clients
+from chunk_writer import create_chunk_writer
+from embedding_batcher import EmbeddingBatcher, create_embedding_client
+from embedding_cache import EmbeddingCacheMiss, shared_cache
+from html_extract import HtmlContentExtractor, blocks_text_hash
+from ingest_common import (
+    EMBEDDING_DIM, EMBEDDING_MODEL, MIN_TOPIC_CHARS, OPENROUTER_API_KEY, SOURCE_ROOT, SUPABASE_KEY, SUPABASE_URL,
+    DitaMapParser, create_rest_client, create_supabase_client, invalidate_query_cache,
+)
+from rate_limit import shared_controller
+
+def process_regulation(map_name: str, map_dir: str, html_dir: str) -> Tuple[int, int]:
+    """Ingests one regulation; returns (rows written, chunks lost to embedding or insert errors)."""
     map_path = SOURCE_ROOT / map_dir / f"{map_name}.ditamap"
     html_path = SOURCE_ROOT / html_dir
     
     if not map_path.exists():
         print(f"Skipping {map_name}: Map not found at {map_path}")
-        return
+        return 0, 0
+
+    if not OPENROUTER_API_KEY:
+        raise ValueError("OPENROUTER_API_KEY not set")
 
     print(f"--- Processing {map_name} ---")
     parser = DitaMapParser(map_path, html_path)
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase = create_supabase_client()
+    writer = create_chunk_writer(supabase, rest=create_rest_client())
+    batcher = EmbeddingBatcher(create_embedding_client(OPENROUTER_API_KEY), EMBEDDING_MODEL, EMBEDDING_DIM, cache=shared_cache())
     
+    chunker = Chunker()
     count = 0
+    queued = 0
+    failed = 0
     limit = int(os.environ.get("INGEST_LIMIT", "0"))
+
+    def insert_batch(results):
+        nonlocal count
+        for (meta, text), embedding in results:
+            data = {
+                "content": text,
+                "metadata": meta,
+                "embedding": embedding
+            }
+            
+            writer.write(data)
+            count += 1
+            if count % 10 == 0:
+                print(f"Queued {count} chunks...")
+
+    def embed(text=None, meta=None):
+        nonlocal failed
+        batch = batcher.collect(text, (meta, text)) if text is not None else batcher.take()
+        if not batch:
+            return
+        try:
+            results = batcher.embed_batch(batch)
+        except EmbeddingCacheMiss:
+            raise
+        except Exception as e:
+            # The batch's chunks are lost; count them so the run reports failure
+            failed += len(batch)
+            print(f"Error embedding batch of {len(batch)} chunks: {e}")
+            return
+        insert_batch(results)
     
     for item in parser.walk():
-        if limit > 0 and count >= limit:
+        if limit > 0 and queued >= limit:
             print(f"Limit of {limit} reached for {map_name}. Stopping.")
             break
         meta = item["metadata"]
@@ -129,30 +77,26 @@ def process_regulation(map_name: str, map_dir: str, html_dir: str):
         
         print(f"Ingesting: {meta['title']} ({html_file.name})")
         
-        text = HtmlContentExtractor.extract_text(html_file)
-        if not text or len(text) < 50:
+        blocks = HtmlContentExtractor.extract_blocks(html_file)
+        if sum(len(b.text) for b in blocks) < MIN_TOPIC_CHARS:
             continue
-            
-        try:
-            embedding = get_embedding(text)
-            
-            data = {
-                "content": text,
-                "metadata": meta,
-                "embedding": embedding
-            }
-            
-            supabase.table("document_chunks").insert(data).execute()
-            count += 1
-            if count % 10 == 0:
-                print(f"Inserted {count} chunks...")
-        except Exception as e:
-            print(f"Error processing {html_file.name}: {e}")
+
+        chunks = chunker.chunk_blocks(blocks, section=meta.get("section"))
+        # Same text_hash as ingest_all.py writes, for verify_ingestion.py --deep
+        base = dict(meta, text_hash=blocks_text_hash(blocks))
+        for chunk in chunks:
+            embed(chunk.text, chunk_metadata(base, chunk, len(chunks)))
+        queued += 1
+
+    embed()
+    writer.close()
+    print(f"{map_name}: {writer.summary()}, {failed} not embedded")
+    return writer.rows_written, failed + len(writer.failed)
 
 def main():
     if not SUPABASE_URL or not SUPABASE_KEY:
         print("Error: SUPABASE_URL and SUPABASE_KEY required in .env")
-        return
+        return 1
 
     # List of regulations to process
     regulations = [
@@ -161,8 +105,26 @@ def main():
         # Add more as needed: AFARS, DAFFARS, etc.
     ]
 
+    written = failed = 0
     for reg in regulations:
-        process_regulation(reg["name"], reg["map_dir"], reg["html_dir"])
+        reg_written, reg_failed = process_regulation(reg["name"], reg["map_dir"], reg["html_dir"])
+        written += reg_written
+        failed += reg_failed
+    if written:
+        invalidate_query_cache(create_supabase_client())
+
+    print(shared_controller().report())
+    http_report = async_clients.report()
+    if http_report:
+        print(http_report)
+    cache = shared_cache()
+    if cache:
+        print(cache.report())
+    async_clients.close_sessions()
+    if failed:
+        print(f"⚠️  {failed} chunks were not ingested; re-run to retry them.")
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
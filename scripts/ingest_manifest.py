@@ -0,0 +1,162 @@
+"""
+Per-regulation ingestion manifest for incremental re-ingestion.
+
+The manifest maps each topic href to the hash of its source HTML, the ids
+of the document_chunks rows it produced and the embedding model used. On
+the next run only topics whose HTML (or the embedding model) changed are
+re-extracted, re-embedded and rewritten; topics that disappeared from the
+ditamap have their chunks deleted.
+
+Manifests live in scripts/.cache/manifests/<MAP>.json (INGEST_MANIFEST_DIR).
+"""
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_MANIFEST_DIR = Path(__file__).parent / ".cache" / "manifests"
+MANIFEST_DIR = Path(os.environ.get("INGEST_MANIFEST_DIR", str(DEFAULT_MANIFEST_DIR)))
+
+
+def hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@dataclass
+class ManifestPlan:
+    changed: List[Dict] = field(default_factory=list)    # new or modified topics to (re)ingest
+    unchanged: List[Dict] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)     # hrefs no longer in the ditamap
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.changed)} new/changed, {len(self.unchanged)} unchanged, "
+            f"{len(self.removed)} removed"
+        )
+
+
+class IngestManifest:
+    """Topic href -> {hash, mtime, size, chunk_ids, model} for one regulation."""
+
+    def __init__(self, name: str, model: str, directory: Path = MANIFEST_DIR):
+        self.name = name
+        self.model = model
+        self.path = Path(directory) / f"{name}.json"
+        self.topics: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.topics = json.load(f).get("topics", {})
+
+    def _fingerprint(self, html_path: Path, previous: Optional[Dict],
+                     stat: Optional[Tuple[float, int]] = None) -> Dict:
+        """Reuses the stored hash when mtime and size are unchanged, so unchanged files are not re-read.
+
+        `stat` is the (mtime, size) the walk already read, if any.
+        """
+        if stat is None:
+            st = html_path.stat()
+            stat = (st.st_mtime, st.st_size)
+        mtime, size = stat
+        if previous and previous.get("mtime") == mtime and previous.get("size") == size:
+            digest = previous["hash"]
+        else:
+            digest = hash_file(html_path)
+        return {"hash": digest, "mtime": mtime, "size": size}
+
+    def plan(self, items: Iterable[Dict], force: bool = False) -> ManifestPlan:
+        """Splits walked items into changed/unchanged and finds topics that were removed.
+
+        Each changed item gets `metadata["content_hash"]` and an `_fingerprint`
+        entry that `record` uses once its chunks are written.
+        """
+        plan = ManifestPlan()
+        seen = set()
+        for item in items:
+            href = item["metadata"]["href"]
+            seen.add(href)
+            previous = self.topics.get(href)
+            fp = self._fingerprint(item["html_path"], previous, item.get("stat"))
+            item["metadata"]["content_hash"] = fp["hash"]
+            item["_fingerprint"] = fp
+            if (
+                not force
+                and previous
+                and previous.get("hash") == fp["hash"]
+                and previous.get("model") == self.model
+                and not previous.get("incomplete")
+            ):
+                plan.unchanged.append(item)
+                continue
+            plan.changed.append(item)
+
+        plan.removed = [href for href in self.topics if href not in seen]
+        return plan
+
+    def stale(self, hrefs: Iterable[str]) -> Tuple[List[int], List[str]]:
+        """Chunk ids recorded for `hrefs`, plus the hrefs that have an entry but no recorded ids."""
+        ids: List[int] = []
+        without_ids: List[str] = []
+        for href in hrefs:
+            entry = self.topics.get(href)
+            if not entry:
+                continue
+            if entry.get("chunk_ids"):
+                ids.extend(entry["chunk_ids"])
+            else:
+                without_ids.append(href)
+        return ids, without_ids
+
+    def forget(self, hrefs: Iterable[str]):
+        with self._lock:
+            for href in hrefs:
+                self.topics.pop(href, None)
+
+    def invalidate(self, hrefs: Iterable[str]) -> int:
+        """Flags topics as incomplete so the next run deletes and re-ingests them."""
+        count = 0
+        with self._lock:
+            for href in hrefs:
+                entry = self.topics.get(href)
+                if entry:
+                    entry["incomplete"] = True
+                    count += 1
+        return count
+
+    def record(self, href: str, fingerprint: Dict, chunk_ids: List[Optional[int]], expected: int = 1):
+        """Adds chunk ids written for a topic; a new hash replaces the previous entry.
+
+        The entry stays flagged `incomplete` until `expected` chunks have been
+        recorded, so a topic interrupted halfway is re-ingested next run.
+        """
+        with self._lock:
+            entry = self.topics.get(href)
+            if not entry or entry.get("hash") != fingerprint["hash"] or entry.get("model") != self.model:
+                entry = {**fingerprint, "model": self.model, "chunk_ids": [], "written": 0}
+                self.topics[href] = entry
+            entry["chunk_ids"].extend(i for i in chunk_ids if i is not None)
+            written = entry.get("written", 0) + len(chunk_ids)
+            if written >= expected:
+                entry.pop("written", None)
+                entry.pop("incomplete", None)
+            else:
+                entry["written"] = written
+                entry["incomplete"] = True
+
+    def save(self):
+        """Writes the manifest atomically so an interrupted run never leaves a torn file."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        with self._lock:
+            payload = {"name": self.name, "model": self.model, "topics": self.topics}
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
@@ -0,0 +1,260 @@
+"""
+Lightweight run metrics for the ingestion scripts.
+
+A process-wide registry of timers (histograms), counters and gauges.
+Instrumented code calls the module-level `metrics` object; until
+`metrics.enable()` is called every method returns immediately, so the
+hooks cost one attribute check when metrics are off.
+
+    with metrics.timer("walk_seconds"):
+        items = list(parser.walk())
+    metrics.count("extract_chars", len(text))
+    metrics.error("insert", exc)
+
+The registry can be written as a JSON run report (`write_json`) or in the
+Prometheus text exposition format (`write_prometheus`), e.g. for the node
+exporter's textfile collector. `profile_run` wraps a run in cProfile,
+including the pipeline's worker threads.
+"""
+
+import bisect
+import cProfile
+import json
+import math
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PROMETHEUS_PREFIX = "farchat_ingest_"
+
+# Seconds; spans a cached lookup up to a throttled embedding request
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NULL_TIMER = nullcontext()
+
+# From 3.12 one profiler sees every thread and a second one can't be enabled
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate by linear interpolation inside the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.bounds[i - 1] if i > 0 else 0.0
+                high = self.bounds[i] if i < len(self.bounds) else self.max
+                low, high = max(low, self.min), min(high, self.max)
+                return low + (high - low) * ((rank - seen) / n)
+            seen += n
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": round(self.min, 6) if self.count else None,
+            "max": round(self.max, 6) if self.count else None,
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": _round(self.quantile(0.50)),
+            "p95": _round(self.quantile(0.95)),
+            "p99": _round(self.quantile(0.99)),
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 6) if value is not None else None
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.started_at: Optional[datetime] = None
+        self._start = 0.0
+        self._lock = threading.Lock()
+        self.timers: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.errors: Dict[Tuple[str, str], int] = {}
+
+    def enable(self):
+        self.enabled = True
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self.timers.get(name)
+            if hist is None:
+                hist = self.timers[name] = Histogram()
+            hist.observe(seconds)
+
+    def timer(self, name: str):
+        """Context manager timing its block into the `name` histogram."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0)
+
+    def count(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+
+    def error(self, stage: str, error: BaseException):
+        if not self.enabled:
+            return
+        key = (stage, type(error).__name__)
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(timespec="seconds") if self.started_at else None,
+                "wall_seconds": round(time.perf_counter() - self._start, 3) if self.enabled else None,
+                "timers": {name: hist.to_dict() for name, hist in sorted(self.timers.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": dict(sorted(self.gauges.items())),
+                "errors": [
+                    {"stage": stage, "type": kind, "count": n}
+                    for (stage, kind), n in sorted(self.errors.items())
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, hist in sorted(self.timers.items()):
+                metric = PROMETHEUS_PREFIX + name
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, n in zip(hist.bounds, hist.counts):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {hist.count}')
+                lines.append(f"{metric}_sum {hist.sum}")
+                lines.append(f"{metric}_count {hist.count}")
+            for name, value in sorted(self.counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            for name, value in sorted(self.gauges.items()):
+                metric = PROMETHEUS_PREFIX + name
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+            if self.errors:
+                metric = f"{PROMETHEUS_PREFIX}errors_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (stage, kind), n in sorted(self.errors.items()):
+                    lines.append(f'{metric}{{stage="{stage}",type="{kind}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: Path, extra: Optional[Dict] = None):
+        report = self.to_dict()
+        if extra:
+            report.update(extra)
+        _write_atomic(Path(path), json.dumps(report, indent=2) + "\n")
+
+    def write_prometheus(self, path: Path):
+        _write_atomic(Path(path), self.to_prometheus())
+
+
+def _write_atomic(path: Path, text: str):
+    # The textfile collector may read at any moment; never let it see a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    tmp.replace(path)
+
+
+def profile_run(fn: Callable[[], Any], path: Path, top: int = 25) -> Any:
+    """Runs `fn` under cProfile (main thread plus any threads it starts) and writes the stats to `path`.
+
+    Before Python 3.12 a profiler only sees the thread that enabled it, so
+    each new thread gets its own profile, merged in at the end. From 3.12
+    cProfile sits on sys.monitoring, which sees every thread but allows one
+    active profiler per process, so the main profile alone is used.
+    Work done in child processes (the extraction pool) is not captured.
+    """
+    thread_profiles: List[cProfile.Profile] = []
+    lock = threading.Lock()
+    stopped = False
+
+    def start_thread_profile(*_):
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with lock:
+            if stopped:
+                return
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Another profiler is active: run the thread unprofiled rather than kill it
+                print(f"Thread {threading.current_thread().name} not profiled: {e}")
+                return
+            thread_profiles.append(profile)
+
+    main_profile = cProfile.Profile()
+    if PER_THREAD_PROFILES:
+        threading.setprofile(start_thread_profile)
+    main_profile.enable()
+    try:
+        return fn()
+    finally:
+        main_profile.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(main_profile)
+        with lock:
+            stopped = True
+            for profile in thread_profiles:
+                # Threads still running must not add entries while the stats are snapshotted
+                profile.disable()
+                stats.add(profile)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(str(path))
+        print(f"\nProfile written to {path} (view with: python -m pstats {path})")
+        stats.sort_stats("cumulative").print_stats(top)
+
+
+metrics = Metrics()
@@ -0,0 +1,239 @@
+"""
+Staged, concurrent ingestion pipeline.
+
+    items -> [extract: process pool] -> batches -> [embed: N threads]
+          -> rows -> [insert: M threads]
+
+Stages are connected by bounded queues, so a slow stage blocks the ones
+upstream of it instead of letting extracted text pile up in memory.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCacheMiss
+from ingest_metrics import metrics
+
+_DONE = object()
+
+
+def _timed_extract(extract_fn, item):
+    """Runs in the worker process so the reported time excludes queueing."""
+    t0 = time.perf_counter()
+    result = extract_fn(item)
+    return time.perf_counter() - t0, result
+
+
+@dataclass
+class StageStats:
+    name: str
+    items: int = 0
+    errors: int = 0
+    busy_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, items: int, seconds: float, errors: int = 0):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+            self.errors += errors
+
+
+@dataclass
+class PipelineStats:
+    extract: StageStats = field(default_factory=lambda: StageStats("extract"))
+    embed: StageStats = field(default_factory=lambda: StageStats("embed"))
+    insert: StageStats = field(default_factory=lambda: StageStats("insert"))
+    wall_seconds: float = 0.0
+
+    def report(self) -> str:
+        lines = [f"Pipeline finished in {self.wall_seconds:.1f}s"]
+        for stage in (self.extract, self.embed, self.insert):
+            rate = stage.items / self.wall_seconds if self.wall_seconds else 0.0
+            lines.append(
+                f"  {stage.name:<8} {stage.items:>8} items  {rate:>9.1f}/s  "
+                f"busy {stage.busy_seconds:>8.1f}s  errors {stage.errors}"
+            )
+        return "\n".join(lines)
+
+
+class IngestPipeline:
+    """Runs extract -> embed -> insert with a bounded worker pool per stage.
+
+    `extract_fn(item)` runs in a worker process and must be a picklable,
+    module-level function returning a list of `(text, payload)` chunks (empty
+    or `None` to skip the item). `insert_fn(payload, text, embedding)` runs on the writer threads.
+
+    `on_skip(item)` is called for items the extractor returned no chunks for and
+    `on_error(stage, item_or_payload, error)` for every item lost to an error.
+    `skip_embed(text, payload)` runs on the extract thread for every chunk; if it
+    returns True the chunk goes straight to insert with no embedding (e.g. a
+    near-duplicate of a chunk that was already embedded).
+    """
+
+    def __init__(
+        self,
+        extract_fn: Callable[[Any], Optional[List[Tuple[str, Any]]]],
+        batcher: EmbeddingBatcher,
+        insert_fn: Callable[[Any, str, List[float]], None],
+        extract_workers: int = os.cpu_count() or 1,
+        embed_concurrency: int = 4,
+        insert_concurrency: int = 2,
+        on_progress: Optional[Callable[[int], None]] = None,
+        on_skip: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[str, Any, BaseException], None]] = None,
+        skip_embed: Optional[Callable[[str, Any], bool]] = None,
+    ):
+        self.extract_fn = extract_fn
+        self.batcher = batcher
+        self.insert_fn = insert_fn
+        self.extract_workers = max(1, extract_workers)
+        self.embed_concurrency = max(1, embed_concurrency)
+        self.insert_concurrency = max(1, insert_concurrency)
+        self.on_progress = on_progress
+        self.on_skip = on_skip
+        self.on_error = on_error
+        self.skip_embed = skip_embed
+        self.stats = PipelineStats()
+        self._fatal: Optional[BaseException] = None
+
+        # Queue sizes bound memory: a couple of batches per embed worker and a
+        # couple of batches' worth of rows per writer.
+        self._embed_q: "queue.Queue" = queue.Queue(maxsize=self.embed_concurrency * 2)
+        self._insert_q: "queue.Queue" = queue.Queue(maxsize=self.insert_concurrency * batcher.max_items * 2)
+
+    def run(self, items: Iterable[Any]) -> PipelineStats:
+        start = time.perf_counter()
+        embedders = [threading.Thread(target=self._embed_worker, daemon=True) for _ in range(self.embed_concurrency)]
+        writers = [threading.Thread(target=self._insert_worker, daemon=True) for _ in range(self.insert_concurrency)]
+        for t in embedders + writers:
+            t.start()
+
+        try:
+            self._extract(items)
+        finally:
+            for _ in embedders:
+                self._embed_q.put(_DONE)
+            for t in embedders:
+                t.join()
+            for _ in writers:
+                self._insert_q.put(_DONE)
+            for t in writers:
+                t.join()
+
+        self.stats.wall_seconds = time.perf_counter() - start
+        if self._fatal:
+            raise self._fatal
+        return self.stats
+
+    def _extract(self, items: Iterable[Any]):
+        """Feeds the process pool with a bounded number of in-flight items and batches the results."""
+        max_in_flight = self.extract_workers * 4
+        with ProcessPoolExecutor(max_workers=self.extract_workers) as pool:
+            in_flight: deque = deque()
+            for item in items:
+                if self._fatal:
+                    break
+                in_flight.append((item, pool.submit(_timed_extract, self.extract_fn, item)))
+                if len(in_flight) >= max_in_flight:
+                    self._collect(in_flight.popleft())
+            while in_flight:
+                self._collect(in_flight.popleft())
+
+        remainder = self.batcher.take()
+        if remainder:
+            self._embed_q.put(remainder)
+
+    def _collect(self, entry):
+        item, future = entry
+        try:
+            seconds, result = future.result()
+            errors = 0
+        except Exception as e:
+            print(f"Error extracting: {e}")
+            self._report_error("extract", item, e)
+            seconds, result, errors = 0.0, None, 1
+        self.stats.extract.record(1 - errors, seconds, errors)
+        if not errors:
+            metrics.observe("extract_seconds", seconds)
+            metrics.count("extract_chunks", len(result or ()))
+            metrics.count("extract_chars", sum(len(text) for text, _ in result or ()))
+        if self.on_progress:
+            self.on_progress(1)
+        if not result:
+            if not errors and self.on_skip:
+                self.on_skip(item)
+            return
+        for text, payload in result:
+            if self.skip_embed and self.skip_embed(text, payload):
+                self._insert_q.put((payload, text, None))
+                continue
+            ready = self.batcher.collect(text, (payload, text))
+            if ready:
+                self._embed_q.put(ready)
+
+    def _embed_worker(self):
+        while True:
+            batch = self._embed_q.get()
+            if batch is _DONE:
+                return
+            if self._fatal:
+                continue
+            t0 = time.perf_counter()
+            try:
+                results = self.batcher.embed_batch(batch)
+            except EmbeddingCacheMiss as e:
+                # Offline mode: stop feeding the pipeline rather than skipping batches
+                self._fatal = e
+                continue
+            except Exception as e:
+                print(f"Error embedding batch of {len(batch)}: {e}")
+                for _, (payload, _) in batch:
+                    self._report_error("embed", payload, e)
+                self.stats.embed.record(0, time.perf_counter() - t0, len(batch))
+                continue
+            seconds = time.perf_counter() - t0
+            self.stats.embed.record(len(results), seconds)
+            metrics.observe("embed_batch_seconds", seconds)
+            for (payload, text), embedding in results:
+                self._insert_q.put((payload, text, embedding))
+
+    def _insert_worker(self):
+        while True:
+            row = self._insert_q.get()
+            if row is _DONE:
+                return
+            t0 = time.perf_counter()
+            try:
+                self.insert_fn(*row)
+                errors = 0
+            except Exception as e:
+                print(f"Error inserting: {e}")
+                self._report_error("insert", row[0], e)
+                errors = 1
+            self.stats.insert.record(1 - errors, time.perf_counter() - t0, errors)
+
+    def _report_error(self, stage: str, obj: Any, error: BaseException):
+        metrics.error(stage, error)
+        if self.on_error:
+            try:
+                self.on_error(stage, obj, error)
+            except Exception as e:
+                print(f"Error in on_error callback: {e}")
+
+
+def merge_stats(runs: List[PipelineStats]) -> PipelineStats:
+    total = PipelineStats()
+    for run in runs:
+        total.wall_seconds += run.wall_seconds
+        for name in ("extract", "embed", "insert"):
+            stage: StageStats = getattr(run, name)
+            getattr(total, name).record(stage.items, stage.busy_seconds, stage.errors)
+    return total
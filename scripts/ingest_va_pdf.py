@@ -1,118 +1,110 @@
 import os
 import re
+import sys
+from bisect import bisect_right
+from concurrent.futures import Executor, ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional, Tuple
 from pypdf import PdfReader
-from supabase import create_client, Client
-from openai import OpenAI
-from tqdm import tqdm
-
-try:
-    from dotenv import load_dotenv
-    # Look for .env in the same directory as this script
-    env_path = Path(__file__).parent / '.env'
-    load_dotenv(dotenv_path=env_path)
-except ImportError:
-    pass
-
-# Configuration
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
-EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "openai/text-embedding-3-small")
-EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", "1536"))
+
+from chunking import Chunker, chunk_metadata
+import async_clients
+from chunk_writer import create_chunk_writer
+from embedding_batcher import EmbeddingBatcher, create_embedding_client
+from embedding_cache import EmbeddingCacheMiss, shared_cache
+from ingest_common import (
+    EMBEDDING_DIM, EMBEDDING_MODEL, OPENROUTER_API_KEY, SOURCE_ROOT, SUPABASE_KEY, SUPABASE_URL,
+    create_rest_client, create_supabase_client, invalidate_query_cache,
+)
+from rate_limit import shared_controller
 
 # Source Directory
-VA_PDF_DIR = Path(__file__).parent.parent / "source_content" / "va_acq_regulations"
-
-def get_embedding(text: str, client: OpenAI) -> List[float]:
-    """Generates embeddings using OpenRouter."""
-    text = text.replace("\n", " ").strip()
-    if not text:
-        return []
-
-    response = client.embeddings.create(
-        input=[text],
-        model=EMBEDDING_MODEL,
-        extra_body={"dimensions": EMBEDDING_DIM} if "openai" in EMBEDDING_MODEL.lower() else {}
-    )
-    return response.data[0].embedding
-
-def parse_va_pdf(pdf_path: Path) -> List[Dict]:
-    """Parses a VA PDF and splits it into sections."""
-    reader = PdfReader(str(pdf_path))
-    full_text = ""
-    for page in reader.pages:
-        full_text += page.extract_text() + "\n"
-
-    # Regex to split by section numbers at the start of a line
-    # Matches patterns like 801.000, 801.101, 801.104-70
-    section_pattern = r"(?m)^(\d{3}\.\d{3}(?:-\d{1,2})?)\s+(.*)$"
-    
-    sections = []
-    current_pos = 0
-    
-    for match in re.finditer(section_pattern, full_text):
-        # Everything from the previous match to this match is the content of the PREVIOUS section
-        if current_pos == 0:
-            # Preamble / TOC
-            content = full_text[:match.start()].strip()
-            if content:
-                sections.append({
-                    "title": "Preamble / Table of Contents",
-                    "content": content,
-                    "section_num": "FRONT_MATTER",
-                    "part": pdf_path.stem.split('-')[1] if '-' in pdf_path.stem else "VAAR"
-                })
-        else:
-            # Content of the previous section
-            pass # We'll handle this by capturing the content between matches
-        
-        current_pos = match.start()
-
-    # Re-parsing with split to actually get the content accurately
-    parts = re.split(r"(?m)^(\d{3}\.\d{3}(?:-\d{1,2})?)\s+", full_text)
-    
-    # parts[0] is preamble
-    # parts[1] is section num, parts[2] is section content starting with title
-    
-    preamble = parts[0].strip()
+VA_PDF_DIR = SOURCE_ROOT / "va_acq_regulations"
+
+SECTION_PATTERN = re.compile(r"(?m)^(\d{3}\.\d{3}(?:-\d{1,2})?)\s+")
+# Pages per worker task; each task opens the PDF once and extracts a contiguous run
+PAGES_PER_TASK = int(os.environ.get("VA_PDF_PAGES_PER_TASK", "16"))
+
+def _extract_pages(args: Tuple[str, int, int]) -> List[str]:
+    """Worker: text of pages [start, stop) of one PDF."""
+    pdf_path, start, stop = args
+    reader = PdfReader(pdf_path)
+    return [(reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+def extract_page_texts(pdf_path: Path, executor: Optional[Executor] = None) -> List[str]:
+    """Extracts every page's text, spreading page runs across `executor` when given."""
+    page_count = len(PdfReader(str(pdf_path)).pages)
+    tasks = [(str(pdf_path), i, min(i + PAGES_PER_TASK, page_count)) for i in range(0, page_count, PAGES_PER_TASK)]
+    if executor is None or len(tasks) < 2:
+        runs = map(_extract_pages, tasks)
+    else:
+        runs = executor.map(_extract_pages, tasks)
+    return [text for run in runs for text in run]
+
+def parse_va_pdf(pdf_path: Path, executor: Optional[Executor] = None) -> Iterator[Dict]:
+    """Parses a VA PDF and yields its sections in order, each with its 1-based page range."""
+    pages = extract_page_texts(pdf_path, executor)
+    # Offset of each page's first character in the joined text, for offset -> page lookups
+    page_offsets = []
+    offset = 0
+    for text in pages:
+        page_offsets.append(offset)
+        offset += len(text) + 1
+    full_text = "\n".join(pages)
+    del pages
+
+    def page_range(start: int, end: int) -> Tuple[int, int]:
+        first = bisect_right(page_offsets, start)
+        last = bisect_right(page_offsets, max(start, end - 1))
+        return first, last
+
+    front_part = pdf_path.stem.split('-')[1] if '-' in pdf_path.stem else "VAAR"
+    matches = SECTION_PATTERN.finditer(full_text)
+    match = next(matches, None)
+
+    # Everything before the first section number is the preamble / table of contents
+    preamble_end = match.start() if match else len(full_text)
+    preamble = full_text[:preamble_end].strip()
     if preamble:
-         sections.append({
+        page_start, page_end = page_range(0, preamble_end)
+        yield {
             "title": "Front Matter",
             "content": preamble,
             "section_num": "FRONT_MATTER",
-            "part": pdf_path.stem.split('-')[1] if '-' in pdf_path.stem else "VAAR"
-        })
+            "part": front_part,
+            "page_start": page_start,
+            "page_end": page_end,
+        }
+
+    while match:
+        following = next(matches, None)
+        section_num = match.group(1)
+        end = following.start() if following else len(full_text)
+        raw_content = full_text[match.end():end].strip()
 
-    for i in range(1, len(parts), 2):
-        section_num = parts[i]
-        raw_content = parts[i+1].strip()
-        
         # Split title from content (usually first line is title)
         content_lines = raw_content.split('\n', 1)
         title = content_lines[0].strip()
         body = content_lines[1].strip() if len(content_lines) > 1 else ""
-        
-        sections.append({
+        page_start, page_end = page_range(match.start(), end)
+
+        yield {
             "title": title,
             "content": f"{section_num} {title}\n{body}",
             "section_num": section_num,
-            "part": section_num.split('.')[0]
-        })
-
-    return sections
+            "part": section_num.split('.')[0],
+            "page_start": page_start,
+            "page_end": page_end,
+        }
+        match = following
 
 def ingest_va_pdfs():
     if not SUPABASE_URL or not SUPABASE_KEY or not OPENROUTER_API_KEY:
         print("Error: Required environment variables not set.")
-        return
+        return 1
 
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    openai_client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=OPENROUTER_API_KEY,
-    )
+    supabase = create_supabase_client()
+    openai_client = create_embedding_client(OPENROUTER_API_KEY)
 
     pdf_files = list(VA_PDF_DIR.glob("*.pdf"))
     limit = int(os.environ.get("INGEST_LIMIT", "0"))
@@ -122,28 +114,93 @@ def ingest_va_pdfs():
     
     print(f"Found {len(pdf_files)} VA PDFs for ingestion.")
 
-    for pdf_path in tqdm(pdf_files, desc="Processing VA PDFs"):
+    batcher = EmbeddingBatcher(openai_client, EMBEDDING_MODEL, EMBEDDING_DIM, cache=shared_cache())
+
+    writer = create_chunk_writer(supabase, rest=create_rest_client())
+    chunker = Chunker()
+    failed = 0
+    unparsed = []
+
+    def insert_batch(results):
+        for data, embedding in results:
+            data["embedding"] = embedding
+            writer.write(data)
+
+    def embed(text=None, data=None):
+        nonlocal failed
+        batch = batcher.collect(text, data) if text is not None else batcher.take()
+        if not batch:
+            return
         try:
-            sections = parse_va_pdf(pdf_path)
-            for sec in sections:
-                embedding = get_embedding(sec["content"], openai_client)
-                if not embedding:
-                    continue
-                
-                data = {
-                    "content": sec["content"],
-                    "embedding": embedding,
-                    "metadata": {
+            results = batcher.embed_batch(batch)
+        except EmbeddingCacheMiss:
+            raise
+        except Exception as e:
+            # A batch can hold chunks of several PDFs; they are lost, so count them
+            failed += len(batch)
+            print(f"Error embedding batch of {len(batch)} chunks: {e}")
+            return
+        insert_batch(results)
+
+    workers = int(os.environ.get("VA_PDF_WORKERS", "0")) or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    from tqdm import tqdm
+
+    try:
+        for pdf_path in tqdm(pdf_files, desc="Processing VA PDFs"):
+            # embed() handles its own errors, so anything caught here is a parse error
+            try:
+                for sec in parse_va_pdf(pdf_path, executor):
+                    base = {
                         "regulation": "VAAR",
                         "part": sec["part"],
                         "section": sec["section_num"],
                         "title": sec["title"],
-                        "source": pdf_path.name
+                        "source": pdf_path.name,
+                        "page_start": sec["page_start"],
+                        "page_end": sec["page_end"],
                     }
-                }
-                supabase.table("document_chunks").insert(data).execute()
-        except Exception as e:
-            print(f"Error processing {pdf_path.name}: {e}")
+                    section = sec["section_num"] if sec["section_num"] != "FRONT_MATTER" else None
+                    chunks = chunker.chunk_text(sec["content"], section=section)
+                    for chunk in chunks:
+                        meta = chunk_metadata(base, chunk, len(chunks))
+                        data = {
+                            "content": chunk.text,
+                            "metadata": meta
+                        }
+                        embed(chunk.text, data)
+            except EmbeddingCacheMiss:
+                raise
+            except Exception as e:
+                unparsed.append(pdf_path.name)
+                print(f"Error parsing {pdf_path.name}: {e}")
+        embed()
+    finally:
+        # Buffered rows are written even when the run is cut short
+        if executor:
+            executor.shutdown()
+        writer.close()
+
+    print(f"VAAR: {writer.summary()}, {failed} not embedded")
+    if writer.rows_written:
+        invalidate_query_cache(supabase)
+    print(shared_controller().report())
+    http_report = async_clients.report()
+    if http_report:
+        print(http_report)
+    cache = shared_cache()
+    if cache:
+        print(cache.report())
+    async_clients.close_sessions()
+    failed += len(writer.failed)
+    if failed or unparsed:
+        if unparsed:
+            print(f"⚠️  {len(unparsed)} PDFs could not be parsed: {', '.join(unparsed)}")
+        if failed:
+            print(f"⚠️  {failed} chunks were not ingested; re-run to retry them.")
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    ingest_va_pdfs()
+    sys.exit(ingest_va_pdfs())
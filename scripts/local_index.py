@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Local, memory-mapped vector index for offline retrieval testing.
+
+An index is a directory:
+
+    index.json      header: dims, dtype, model, row count
+    vectors.bin     contiguous row-major float32 or float16 matrix, one
+                    L2-normalized row per chunk (memory-mapped for queries)
+    meta.jsonl      one {"id", "content", "metadata"} line per row
+    meta.offsets    uint64 byte offset of each meta.jsonl line
+    ivf.npz         optional coarse quantizer for approximate search
+
+`search` mirrors `match_documents` in supabase/schema.sql: similarity is
+1 - cosine distance, rows must have similarity > threshold, and at most
+`count` rows are returned, best first, as {id, content, metadata,
+similarity}. Exact search scans the matrix in blocks with NumPy dot
+products; approximate search (`build-ivf`, then `--probes`) only scans the
+rows assigned to the nearest centroids, like pgvector's ivfflat.
+`search_compact` (`--compact-dims`) mirrors `match_documents_compact`: a
+shortlist on the half-precision prefix, rescored with the full vectors.
+
+Usage:
+    python ingest_all.py --full --local-index .cache/index       # written during ingestion
+    python ingest_all.py --local-index .cache/index              # later runs upsert changed topics
+    python local_index.py export .cache/index                     # or copied from Supabase
+    python local_index.py query .cache/index "who approves a J&A" --threshold 0.1 --count 5
+    python local_index.py build-ivf .cache/index --lists 200
+    python local_index.py query .cache/index "..." --probes 10
+    python local_index.py query .cache/index "..." --compact-dims 512
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+# Imported by _require_numpy once an index is read or written, so ingest_all.py
+# can load this module for its option values without paying for numpy
+np = None
+
+DTYPES = ("float32", "float16")
+SEARCH_BLOCK_ROWS = 65536
+
+
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("The local index needs numpy: pip install numpy") from None
+        np = numpy
+
+
+def _normalized(vector: Sequence[float], dtype: str):
+    v = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    if norm:
+        v = v / norm
+    return v.astype(dtype, copy=False)
+
+
+class LocalIndexWriter:
+    """Appends chunks to an index directory. Thread-safe; `close()` writes the header.
+
+    With `reset=True` (the default) any existing index in `path` is replaced.
+    Otherwise new rows are appended, and rows already in the index for the
+    topics passed to `remove` (re-ingested or deleted) are dropped on close,
+    so an incremental run upserts its topics.
+    """
+
+    def __init__(self, path: Path, dims: int, dtype: str = "float32", model: str = "", reset: bool = True):
+        _require_numpy()
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dims = dims
+        self.dtype = dtype
+        self.model = model
+        mode = "wb" if reset else "ab"
+        if reset:
+            (self.path / "ivf.npz").unlink(missing_ok=True)
+        elif (self.path / "index.json").exists():
+            header = json.loads((self.path / "index.json").read_text())
+            if header["dims"] != dims or header["dtype"] != dtype:
+                raise ValueError(f"{self.path} holds {header['dims']}-dim {header['dtype']} vectors")
+        self._vectors = open(self.path / "vectors.bin", mode)
+        self._meta = open(self.path / "meta.jsonl", mode)
+        self._offsets = open(self.path / "meta.offsets", mode)
+        self._lock = threading.Lock()
+        self.count = self._vectors.tell() // (dims * np.dtype(dtype).itemsize)
+        # Rows present before this writer opened; only these are subject to `remove`
+        self._existing = self.count
+        self._removed: Set[Tuple[str, str]] = set()
+
+    def remove(self, regulation: str, hrefs: Sequence[str]):
+        """Drops the existing rows of these topics when the writer is closed."""
+        with self._lock:
+            self._removed.update((regulation, href) for href in hrefs)
+
+    def add(self, chunk_id: Optional[int], content: str, metadata: Dict, embedding: Sequence[float]):
+        if len(embedding) != self.dims:
+            raise ValueError(f"Expected {self.dims} dimensions, got {len(embedding)}")
+        vector = _normalized(embedding, self.dtype).tobytes()
+        line = (json.dumps({"id": chunk_id, "content": content, "metadata": metadata}) + "\n").encode("utf-8")
+        with self._lock:
+            offset = self._meta.tell()
+            self._meta.write(line)
+            self._offsets.write(np.uint64(offset).tobytes())
+            self._vectors.write(vector)
+            self.count += 1
+
+    def add_rows(self, rows: List[Dict], ids: List[Optional[int]]):
+        """ChunkWriter `on_written` hook: rows carry content, metadata and embedding."""
+        for row, chunk_id in zip(rows, ids):
+            if not row.get("embedding"):
+                # Deduplicated chunks are stored without a vector
+                continue
+            self.add(chunk_id, row["content"], row["metadata"], row["embedding"])
+
+    def close(self):
+        with self._lock:
+            for f in (self._vectors, self._meta, self._offsets):
+                f.close()
+            if self._existing and self._removed:
+                self._compact()
+            header = {"dims": self.dims, "dtype": self.dtype, "model": self.model, "count": self.count}
+            (self.path / "index.json").write_text(json.dumps(header, indent=2) + "\n")
+
+    def _compact(self):
+        """Rewrites the files without the removed topics' pre-existing rows."""
+        row_bytes = self.dims * np.dtype(self.dtype).itemsize
+        files = ("vectors.bin", "meta.jsonl", "meta.offsets")
+        kept = 0
+        with open(self.path / "vectors.bin", "rb") as vectors_in, open(self.path / "meta.jsonl", "rb") as meta_in, \
+                open(self.path / "vectors.bin.tmp", "wb") as vectors_out, \
+                open(self.path / "meta.jsonl.tmp", "wb") as meta_out, \
+                open(self.path / "meta.offsets.tmp", "wb") as offsets_out:
+            for row in range(self.count):
+                vector = vectors_in.read(row_bytes)
+                line = meta_in.readline()
+                if row < self._existing:
+                    metadata = json.loads(line).get("metadata") or {}
+                    if (metadata.get("regulation"), metadata.get("href")) in self._removed:
+                        continue
+                offsets_out.write(np.uint64(meta_out.tell()).tobytes())
+                meta_out.write(line)
+                vectors_out.write(vector)
+                kept += 1
+        for name in files:
+            os.replace(self.path / f"{name}.tmp", self.path / name)
+        # Row numbers changed, so any quantizer no longer matches
+        (self.path / "ivf.npz").unlink(missing_ok=True)
+        self.count = kept
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalIndex:
+    def __init__(self, path: Path):
+        _require_numpy()
+        self.path = Path(path)
+        header = json.loads((self.path / "index.json").read_text())
+        self.dims = header["dims"]
+        self.dtype = np.dtype(header["dtype"])
+        self.model = header.get("model", "")
+        offsets = np.fromfile(self.path / "meta.offsets", dtype=np.uint64)
+        # Trust only rows whose vector and metadata were both written
+        rows = min(len(offsets), (self.path / "vectors.bin").stat().st_size // (self.dims * self.dtype.itemsize))
+        self.count = rows
+        self.offsets = offsets[:rows]
+        self.vectors = (
+            np.memmap(self.path / "vectors.bin", dtype=self.dtype, mode="r", shape=(rows, self.dims))
+            if rows else np.zeros((0, self.dims), dtype=self.dtype)
+        )
+        self._meta = open(self.path / "meta.jsonl", "rb")
+        self._meta_lock = threading.Lock()
+        self._compact: Dict[int, "np.ndarray"] = {}
+        self._compact_lock = threading.Lock()
+        self.ivf = None
+        ivf_path = self.path / "ivf.npz"
+        if ivf_path.exists():
+            data = np.load(ivf_path)
+            if int(data["rows"]) == rows:
+                self.ivf = {"centroids": data["centroids"], "order": data["order"], "bounds": data["bounds"]}
+
+    def row(self, index: int) -> Dict:
+        with self._meta_lock:
+            self._meta.seek(int(self.offsets[index]))
+            entry = json.loads(self._meta.readline())
+        if entry.get("id") is None:
+            # Written without a database id (COPY backend); use the row number
+            entry["id"] = index
+        return entry
+
+    def _top(self, scores, rows, threshold: float, count: int):
+        keep = scores > threshold
+        scores, rows = scores[keep], rows[keep]
+        if len(scores) > count:
+            part = np.argpartition(-scores, count - 1)[:count]
+            scores, rows = scores[part], rows[part]
+        return scores, rows
+
+    def search(self, query: Sequence[float], threshold: float, count: int, probes: Optional[int] = None) -> List[Dict]:
+        """match_documents(query, threshold, count); approximate when `probes` is given and an IVF exists."""
+        if count <= 0 or not self.count:
+            return []
+        q = _normalized(query, np.float32)
+        if len(q) != self.dims:
+            raise ValueError(f"Query has {len(q)} dimensions, index has {self.dims}")
+
+        best_scores, best_rows = [], []
+        if probes and self.ivf is not None:
+            lists = np.argsort(-(self.ivf["centroids"] @ q))[:probes]
+            bounds, order = self.ivf["bounds"], self.ivf["order"]
+            rows = np.concatenate([order[bounds[i]:bounds[i + 1]] for i in lists])
+            rows.sort()  # sequential page access on the memmap
+            scores = np.asarray(self.vectors[rows], dtype=np.float32) @ q
+            s, r = self._top(scores, rows, threshold, count)
+            best_scores.append(s)
+            best_rows.append(r)
+        else:
+            for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+                block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+                scores = block @ q
+                s, r = self._top(scores, np.arange(start, start + len(block)), threshold, count)
+                best_scores.append(s)
+                best_rows.append(r)
+
+        scores = np.concatenate(best_scores)
+        rows = np.concatenate(best_rows)
+        order = np.argsort(-scores, kind="stable")[:count]
+        results = []
+        for i in order:
+            entry = self.row(int(rows[i]))
+            entry["similarity"] = float(scores[i])
+            results.append(entry)
+        return results
+
+    def search_compact(self, query: Sequence[float], threshold: float, count: int, dims: int = 512,
+                       shortlist_factor: int = 8) -> List[Dict]:
+        """match_documents_compact: shortlist on the float16 `dims`-prefix, rescore at full precision.
+
+        The shortlist scan is exact, so this measures what the compact
+        representation loses, not what the HNSW graph over it loses.
+        """
+        if count <= 0 or not self.count:
+            return []
+        q = _normalized(query, np.float32)
+        if len(q) != self.dims:
+            raise ValueError(f"Query has {len(q)} dimensions, index has {self.dims}")
+        dims = min(dims, self.dims)
+        shortlist = min(max(count * shortlist_factor, count), 1000)
+        prefix = _normalized(q[:dims].astype(np.float16), np.float32)
+
+        scores = self.compact_vectors(dims) @ prefix
+        rows = np.arange(self.count)
+        if self.count > shortlist:
+            rows = np.argpartition(-scores, shortlist - 1)[:shortlist]
+        rows.sort()
+
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ q
+        scores, rows = self._top(scores, rows, threshold, count)
+        results = []
+        for i in np.argsort(-scores, kind="stable"):
+            entry = self.row(int(rows[i]))
+            entry["similarity"] = float(scores[i])
+            results.append(entry)
+        return results
+
+    def compact_vectors(self, dims: int):
+        """The normalized `dims`-prefix of every row, rounded to float16 like a halfvec column.
+
+        Kept in memory (as float32, which NumPy multiplies much faster) after
+        the first compact search with this prefix length.
+        """
+        with self._compact_lock:
+            if dims not in self._compact:
+                compact = np.empty((self.count, dims), dtype=np.float32)
+                for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+                    block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS, :dims], dtype=np.float16)
+                    block = block.astype(np.float32)
+                    norms = np.linalg.norm(block, axis=1, keepdims=True)
+                    compact[start:start + len(block)] = block / np.where(norms > 0, norms, 1.0)
+                self._compact[dims] = compact
+            return self._compact[dims]
+
+    def build_ivf(self, lists: int = 0, iterations: int = 10, sample: int = 0, seed: int = 0):
+        """Spherical k-means coarse quantizer; `lists` defaults to rows/1000 like pgvector's guidance."""
+        lists = lists or max(1, self.count // 1000)
+        lists = min(lists, self.count)
+        rng = np.random.default_rng(seed)
+        sample = min(self.count, sample or max(lists * 256, 10000))
+        training = np.asarray(self.vectors[np.sort(rng.choice(self.count, sample, replace=False))], dtype=np.float32)
+        centroids = training[rng.choice(len(training), lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(training @ centroids.T, axis=1)
+            for c in range(lists):
+                members = training[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        assign = np.empty(self.count, dtype=np.int32)
+        for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        bounds = np.searchsorted(assign[order], np.arange(lists + 1)).astype(np.int64)
+        np.savez(self.path / "ivf.npz", centroids=centroids, order=order, bounds=bounds, rows=np.int64(self.count))
+        self.ivf = {"centroids": centroids, "order": order, "bounds": bounds}
+        return lists
+
+    def close(self):
+        self._meta.close()
+
+
+def parse_vector(value) -> List[float]:
+    """PostgREST returns pgvector columns as '[0.1,0.2,...]' strings."""
+    if isinstance(value, str):
+        return json.loads(value)
+    return list(value)
+
+
+def export_from_supabase(path: Path, dtype: str, page_size: int = 1000) -> int:
+    """Copies every document_chunks row into a fresh local index, paging by id."""
+    from supabase import create_client
+
+    from chunk_writer import CHUNK_TABLE
+
+    supabase = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+    writer = None
+    last_id = 0
+    while True:
+        page = (
+            supabase.table(CHUNK_TABLE)
+            .select("id, content, metadata, embedding")
+            .gt("id", last_id)
+            .order("id")
+            .limit(page_size)
+            .execute()
+        ).data or []
+        for row in page:
+            if not row.get("embedding"):
+                continue
+            vector = parse_vector(row["embedding"])
+            if writer is None:
+                writer = LocalIndexWriter(path, len(vector), dtype, os.environ.get("EMBEDDING_MODEL", ""))
+            writer.add(row["id"], row["content"], row["metadata"], vector)
+        if len(page) < page_size:
+            break
+        last_id = page[-1]["id"]
+    if writer is None:
+        return 0
+    writer.close()
+    return writer.count
+
+
+def embed_query(text: str, dims: int) -> List[float]:
+    from embedding_batcher import EmbeddingBatcher, create_embedding_client
+    from embedding_cache import shared_cache
+
+    api_key = os.environ.get("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY not set")
+    model = os.environ.get("EMBEDDING_MODEL", "openai/text-embedding-3-small")
+    batcher = EmbeddingBatcher(create_embedding_client(api_key), model, dims, cache=shared_cache())
+    return batcher.embed_texts([text])[0]
+
+
+def main() -> int:
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=Path(__file__).parent / ".env")
+    except ImportError:
+        pass
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    q = sub.add_parser("query", help="Top-k search, same semantics as match_documents")
+    q.add_argument("index", type=Path)
+    q.add_argument("text", nargs="?", help="Question to embed (needs OPENROUTER_API_KEY)")
+    q.add_argument("--embedding-json", type=Path, help="Read the query vector from a JSON list instead")
+    q.add_argument("--threshold", type=float, default=0.1, help="match_threshold (default: 0.1, as the chat route)")
+    q.add_argument("--count", type=int, default=5, help="match_count (default: 5)")
+    q.add_argument("--probes", type=int, default=0, help="Approximate search over this many IVF lists (0 = exact)")
+    q.add_argument("--compact-dims", type=int, default=0,
+                   help="Shortlist on this many float16 dimensions, then rescore (as match_documents_compact)")
+    q.add_argument("--shortlist-factor", type=int, default=8, help="Shortlist size per result (default: 8)")
+    q.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    e = sub.add_parser("export", help="Build an index from the document_chunks table")
+    e.add_argument("index", type=Path)
+    e.add_argument("--dtype", choices=DTYPES, default="float32")
+
+    b = sub.add_parser("build-ivf", help="Build the coarse quantizer used by --probes")
+    b.add_argument("index", type=Path)
+    b.add_argument("--lists", type=int, default=0, help="Number of lists (default: rows / 1000)")
+    b.add_argument("--iterations", type=int, default=10)
+
+    i = sub.add_parser("info", help="Show index size and settings")
+    i.add_argument("index", type=Path)
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        count = export_from_supabase(args.index, args.dtype)
+        print(f"Exported {count} chunks to {args.index}")
+        return 0
+
+    index = LocalIndex(args.index)
+    if args.command == "info":
+        size = index.count * index.dims * index.dtype.itemsize
+        ivf = f"{len(index.ivf['centroids'])} lists" if index.ivf is not None else "none"
+        print(f"{index.path}: {index.count} rows x {index.dims} {index.dtype.name} "
+              f"({size / (1024 * 1024):.1f} MiB), model {index.model or 'unknown'}, IVF {ivf}")
+    elif args.command == "build-ivf":
+        lists = index.build_ivf(args.lists, args.iterations)
+        print(f"Built IVF with {lists} lists over {index.count} rows (suggested probes: {max(1, int(math.sqrt(lists)))})")
+    elif args.command == "query":
+        if args.embedding_json:
+            vector = json.loads(args.embedding_json.read_text())
+        elif args.text:
+            vector = embed_query(args.text, index.dims)
+        else:
+            parser.error("query needs TEXT or --embedding-json")
+        if args.probes and index.ivf is None:
+            print("No IVF for this index (run build-ivf); falling back to exact search", file=sys.stderr)
+        if args.compact_dims:
+            results = index.search_compact(vector, args.threshold, args.count, args.compact_dims, args.shortlist_factor)
+        else:
+            results = index.search(vector, args.threshold, args.count, probes=args.probes or None)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            for r in results:
+                meta = r.get("metadata") or {}
+                label = f"{meta.get('regulation', '')} {meta.get('section', '')} {meta.get('title', '')}".strip()
+                snippet = " ".join(r["content"].split())[:160]
+                print(f"{r['similarity']:.4f}  #{r['id']}  {label}\n        {snippet}")
+            if not results:
+                print("No chunks above the threshold.")
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
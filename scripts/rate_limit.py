@@ -0,0 +1,235 @@
+"""
+Retry and adaptive concurrency for OpenRouter / OpenAI-compatible calls.
+
+`RateLimitedClient` wraps an `OpenAI` client and routes `embeddings.create`
+through a shared controller that:
+
+- retries 429s, 408s, 5xx responses and connection errors with exponential
+  backoff and full jitter, waiting at least as long as any `Retry-After`
+  (or `retry-after-ms`) header asks;
+- caps the number of requests in flight and adjusts that cap AIMD-style:
+  +1 for every `limit` successful requests, halved (at most once per
+  backoff window) when the provider throttles, so the run settles just
+  under the provider's limit;
+- counts requests, retries, throttles and failures and reports the
+  effective requests/sec.
+
+The limit only matters while enough threads are asking for permits: a
+run with N embedding threads never has more than N requests in flight.
+ingest_all.py therefore starts OPENROUTER_MAX_CONCURRENCY embed threads
+by default and caps the controller at the thread count when
+--embed-concurrency asks for fewer (`AdaptiveConcurrency.cap`).
+
+Other errors (including the 400/413 "batch too large" responses that
+EmbeddingBatcher bisects on) are raised immediately.
+"""
+
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+OPENROUTER_CONCURRENCY = int(os.environ.get("OPENROUTER_CONCURRENCY", "4"))
+OPENROUTER_MAX_CONCURRENCY = int(os.environ.get("OPENROUTER_MAX_CONCURRENCY", "16"))
+OPENROUTER_MAX_RETRIES = int(os.environ.get("OPENROUTER_MAX_RETRIES", "6"))
+OPENROUTER_BACKOFF_BASE = float(os.environ.get("OPENROUTER_BACKOFF_BASE", "0.5"))
+OPENROUTER_BACKOFF_MAX = float(os.environ.get("OPENROUTER_BACKOFF_MAX", "60"))
+
+RETRYABLE_STATUS = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Delay requested by the server via Retry-After / retry-after-ms, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def is_retryable(error: Exception) -> bool:
+    # Imported here so loading this module doesn't pull in the SDK
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+def is_throttle(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+class AdaptiveConcurrency:
+    """Shared in-flight limit with AIMD adjustment, retries and counters."""
+
+    def __init__(
+        self,
+        initial: int = OPENROUTER_CONCURRENCY,
+        maximum: int = OPENROUTER_MAX_CONCURRENCY,
+        max_retries: int = OPENROUTER_MAX_RETRIES,
+        backoff_base: float = OPENROUTER_BACKOFF_BASE,
+        backoff_max: float = OPENROUTER_BACKOFF_MAX,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.maximum = max(1, maximum)
+        self.limit = float(min(max(1, initial), self.maximum))
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+
+        self.requests = 0
+        self.succeeded = 0
+        self.retries = 0
+        self.throttles = 0
+        self.failures = 0
+        self.peak_in_flight = 0
+        self._started: Optional[float] = None
+        self._busy_until = 0.0
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self._in_flight < int(self.limit):
+                    break
+                self._cond.wait(timeout=pause if pause > 0 else None)
+            self._in_flight += 1
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            if self._started is None:
+                self._started = time.monotonic()
+
+    def _release(self, ok: bool, throttled: bool = False, delay: float = 0.0):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            self._busy_until = now
+            if ok:
+                self.succeeded += 1
+                # Additive increase: about +1 per window of `limit` successes
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            elif throttled:
+                self.throttles += 1
+                # Multiplicative decrease, once per burst of 429s from the same window
+                if now - self._last_decrease >= max(delay, self.backoff_base):
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+                # Hold every caller back until the server's requested delay has passed
+                self._paused_until = max(self._paused_until, now + delay)
+            self._cond.notify_all()
+
+    def cap(self, maximum: int):
+        """Lowers the ceiling to `maximum`, e.g. the number of threads that call through this controller."""
+        with self._cond:
+            self.maximum = max(1, min(self.maximum, maximum))
+            self.limit = min(self.limit, float(self.maximum))
+            self._cond.notify_all()
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Full-jitter exponential backoff, never shorter than Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        server = retry_after_seconds(error)
+        if server is not None:
+            delay = max(delay, min(server, self.backoff_max))
+        return delay
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retry = is_retryable(e) and attempt < self.max_retries
+                delay = self.backoff(attempt, e) if retry else 0.0
+                self._release(False, throttled=is_throttle(e), delay=delay if is_throttle(e) else 0.0)
+                if not retry:
+                    with self._cond:
+                        self.failures += 1
+                    raise
+                with self._cond:
+                    self.retries += 1
+                attempt += 1
+                self._sleep(delay)
+                continue
+            self._release(True)
+            return result
+
+    def requests_per_second(self) -> float:
+        with self._cond:
+            if self._started is None:
+                return 0.0
+            end = time.monotonic() if self._in_flight else self._busy_until
+            elapsed = end - self._started
+            return self.succeeded / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> str:
+        return (
+            f"OpenRouter: {self.requests} requests, {self.retries} retries, {self.throttles} throttled, "
+            f"{self.failures} failed; {self.requests_per_second():.1f} req/s, "
+            f"concurrency limit {self.limit:.1f} (peak in flight {self.peak_in_flight})"
+        )
+
+
+class _Embeddings:
+    def __init__(self, client: "RateLimitedClient"):
+        self._client = client
+
+    def create(self, **kwargs):
+        return self._client.controller.call(self._client.client.embeddings.create, **kwargs)
+
+
+class RateLimitedClient:
+    """Drop-in for `OpenAI` as used by the ingestion scripts (`client.embeddings.create`)."""
+
+    def __init__(self, client: "OpenAI", controller: Optional[AdaptiveConcurrency] = None):
+        # Retries are handled by the controller; the SDK's own retries would hide throttling
+        self.client = client.with_options(max_retries=0)
+        self.controller = controller or shared_controller()
+        self.embeddings = _Embeddings(self)
+
+    def report(self) -> str:
+        return self.controller.report()
+
+
+_shared: Optional[AdaptiveConcurrency] = None
+_shared_lock = threading.Lock()
+
+
+def shared_controller() -> AdaptiveConcurrency:
+    """Process-wide controller, so every client in a run shares one concurrency budget."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = AdaptiveConcurrency()
+        return _shared
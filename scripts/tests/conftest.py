@@ -0,0 +1,15 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+# The scripts import their siblings by module name, as when run from scripts/
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+
+@pytest.fixture
+def fixtures() -> Path:
+    return FIXTURES
@@ -0,0 +1,60 @@
+from chunk_dedup import ChunkDedupIndex, minhash
+
+TEXT = ("The contracting officer shall not require certified cost or pricing data to support "
+        "any action where the price is based on adequate price competition or prices set by law.")
+
+
+def meta(regulation, href, index=0):
+    return {"regulation": regulation, "href": href, "chunk_index": index}
+
+
+def row(m):
+    return {"content": TEXT, "metadata": m, "embedding": None}
+
+
+def test_canonical_is_registered_only_once_written(tmp_path):
+    dedup = ChunkDedupIndex(tmp_path / "dedup.sqlite3")
+    far = meta("FAR", "15.403-1.dita")
+    assert dedup.check(far, minhash(TEXT)) is None
+    # Not written yet: a copy can't link to it
+    assert dedup.check(meta("DFARS", "215.403-1.dita"), minhash(TEXT)) is None
+
+    dedup.record_written([row(far)])
+    reference = dedup.check(meta("GSAM", "515.403-1.dita"), minhash(TEXT))
+    assert reference["regulation"] == "FAR" and reference["href"] == "15.403-1.dita"
+    dedup.close()
+
+
+def test_failed_write_leaves_no_canonical(tmp_path):
+    dedup = ChunkDedupIndex(tmp_path / "dedup.sqlite3")
+    far = meta("FAR", "15.403-1.dita")
+    assert dedup.check(far, minhash(TEXT)) is None
+    dedup.discard("FAR", "15.403-1.dita")
+    # A late on_written for the failed topic registers nothing either
+    dedup.record_written([row(far)])
+    assert dedup.check(meta("DFARS", "215.403-1.dita"), minhash(TEXT)) is None
+    assert dedup.canonical == 0
+    dedup.close()
+
+
+def test_discard_only_drops_that_topic(tmp_path):
+    dedup = ChunkDedupIndex(tmp_path / "dedup.sqlite3")
+    kept, failed = meta("FAR", "1.10.dita"), meta("FAR", "1.1.dita")
+    dedup.check(kept, minhash(TEXT))
+    dedup.check(failed, minhash(TEXT + " More text."))
+    dedup.discard("FAR", "1.1.dita")
+    dedup.record_written([row(kept), row(failed)])
+    assert dedup.canonical == 1
+    dedup.close()
+
+
+def test_forget_returns_orphaned_duplicates(tmp_path):
+    dedup = ChunkDedupIndex(tmp_path / "dedup.sqlite3")
+    far, dfars = meta("FAR", "15.403-1.dita"), meta("DFARS", "215.403-1.dita")
+    dedup.check(far, minhash(TEXT))
+    dedup.record_written([row(far)])
+    assert dedup.check(dfars, minhash(TEXT)) is not None
+    dedup.record_written([row(dfars)])
+    assert dedup.duplicates == 1
+    assert dedup.forget("FAR", ["15.403-1.dita"]) == [("DFARS", "215.403-1.dita")]
+    dedup.close()
@@ -0,0 +1,140 @@
+import threading
+import time
+
+from chunk_writer import AsyncChunkWriter, ChunkWriter
+
+
+class FakeTable:
+    """Just enough of supabase.table(...).insert(rows).execute() for ChunkWriter."""
+
+    def __init__(self, reject=None):
+        self.batches = []
+        self.reject = reject
+        self.next_id = 1
+        self._rows = None
+
+    def table(self, name):
+        return self
+
+    def insert(self, rows):
+        self._rows = rows
+        return self
+
+    def execute(self):
+        rows, self._rows = self._rows, None
+        if self.reject and any(self.reject(r) for r in rows):
+            raise ValueError("rejected")
+        self.batches.append(rows)
+        data = [{"id": self.next_id + i} for i in range(len(rows))]
+        self.next_id += len(rows)
+
+        class Result:
+            pass
+
+        result = Result()
+        result.data = data
+        return result
+
+
+def row(n):
+    return {"content": f"chunk {n}", "metadata": {"n": n}, "embedding": [0.0, 1.0]}
+
+
+def test_flushes_on_row_count():
+    db = FakeTable()
+    writer = ChunkWriter(db, flush_rows=3, flush_seconds=60)
+    for n in range(7):
+        writer.write(row(n))
+    assert [len(b) for b in db.batches] == [3, 3]
+    writer.close()
+    assert [len(b) for b in db.batches] == [3, 3, 1]
+    assert writer.rows_written == 7
+
+
+def test_partial_buffer_is_flushed_by_age_without_new_rows():
+    db = FakeTable()
+    written = threading.Event()
+    writer = ChunkWriter(db, flush_rows=100, flush_seconds=0.1, on_written=lambda rows, ids: written.set())
+    start = time.monotonic()
+    writer.write(row(1))
+    writer.write(row(2))
+    # No further write() call: only the background flush can write these
+    assert written.wait(2)
+    assert time.monotonic() - start < 1.5
+    assert [len(b) for b in db.batches] == [2]
+    # A buffer started after an idle period is flushed by age too
+    written.clear()
+    time.sleep(0.15)
+    writer.write(row(3))
+    assert written.wait(2)
+    writer.close()
+    assert [len(b) for b in db.batches] == [2, 1]
+
+
+def test_close_stops_the_flush_thread():
+    writer = ChunkWriter(FakeTable(), flush_seconds=30)
+    writer.write(row(1))
+    flusher = writer._flusher
+    assert flusher.is_alive()
+    writer.close()
+    assert not flusher.is_alive()
+    assert writer.rows_written == 1
+
+
+def test_bad_row_is_isolated():
+    db = FakeTable(reject=lambda r: r["metadata"]["n"] == 3)
+    failed = []
+    writer = ChunkWriter(db, flush_rows=8, flush_seconds=60, on_failed=lambda r, e: failed.append(r))
+    for n in range(8):
+        writer.write(row(n))
+    writer.close()
+    assert writer.rows_written == 7
+    assert [r["metadata"]["n"] for r in failed] == [3]
+
+
+class FakeRest:
+    """Just enough of async_clients.PooledRestClient for AsyncChunkWriter, on a real event loop."""
+
+    def __init__(self, reject=None):
+        from async_clients import EventLoopThread
+
+        self.loop = EventLoopThread()
+        self.reject = reject
+        self.inserted = []
+
+    def submit(self, coro):
+        return self.loop.submit(coro)
+
+    async def insert_async(self, table, rows):
+        if self.reject and any(self.reject(r) for r in rows):
+            raise ValueError("rejected")
+        self.inserted.append(rows)
+        return [{"id": r["metadata"]["n"]} for r in rows]
+
+
+def test_async_callbacks_run_off_the_event_loop():
+    rest = FakeRest(reject=lambda r: r["metadata"]["n"] == 5)
+    threads, written, failed = set(), [], []
+    release = threading.Event()
+
+    def on_written(rows, ids):
+        threads.add(threading.current_thread().name)
+        # A slow callback must not hold up inserts still on the loop
+        release.wait(2)
+        written.extend(ids)
+
+    writer = AsyncChunkWriter(rest, max_in_flight=4, flush_rows=2, flush_seconds=60, on_written=on_written,
+                              on_failed=lambda r, e: failed.append(r["metadata"]["n"]))
+    for n in range(8):
+        writer.write(row(n))
+    deadline = time.monotonic() + 2
+    while sum(len(b) for b in rest.inserted) < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sum(len(b) for b in rest.inserted) == 7
+    release.set()
+    writer.close()
+    assert sorted(written) == [0, 1, 2, 3, 4, 6, 7]
+    assert failed == [5]
+    assert writer.rows_written == 7
+    assert threads and "async-http" not in threads
+    rest.loop.close()
@@ -0,0 +1,95 @@
+from chunking import Block, Chunker, chunk_metadata, section_lineage
+from html_extract import HtmlContentExtractor
+
+HEADING = "15.403-1 Prohibition on obtaining certified cost or pricing data (10 U.S.C. 3703 and 41 U.S.C. chapter 35)."
+
+
+def small_chunker() -> Chunker:
+    # Small sizes so the fixtures span several chunks
+    return Chunker(size=400, overlap=80, min_size=100, max_size=800)
+
+
+def chunk_fixture(fixtures, name, chunker=None):
+    blocks = HtmlContentExtractor.extract_blocks(fixtures / name)
+    return blocks, (chunker or small_chunker()).chunk_blocks(blocks)
+
+
+def test_section_lineage():
+    assert section_lineage("15.403-1") == ("15", "15.4")
+    assert section_lineage("252.234-7001") == ("252", "252.2")
+    assert section_lineage("1.101") == ("1", "1.1")
+
+
+def test_heading_sets_section_lineage(fixtures):
+    _, chunks = chunk_fixture(fixtures, "15.403-1.html")
+    first = chunks[0]
+    assert first.text.startswith(HEADING)
+    assert (first.section, first.part, first.subpart) == ("15.403-1", "15", "15.4")
+    assert first.heading == HEADING
+    meta = chunk_metadata({"regulation": "FAR", "href": "15.403-1.dita"}, first, len(chunks))
+    assert meta["citation_key"] == "FAR 15.403-1"
+    assert meta["section_title"] == HEADING
+    assert meta["chunk_count"] == len(chunks)
+
+
+def test_whole_topic_fits_one_chunk_at_default_size(fixtures):
+    blocks, chunks = chunk_fixture(fixtures, "Subpart_1.1.html", Chunker())
+    # A new section number still starts a new chunk once the current one can stand alone
+    assert [c.section for c in chunks] == ["1.101", "1.102"]
+    assert chunks[1].text.startswith("1.102 Statement of guiding principles")
+    assert all(b.text in "\n".join(c.text for c in chunks) for b in blocks)
+
+
+def test_paragraph_boundaries(fixtures):
+    blocks, chunks = chunk_fixture(fixtures, "15.403-1.html")
+    texts = {b.text for b in blocks}
+    for chunk in chunks:
+        assert len(chunk.text) <= 800
+        # No paragraph is cut: every line is a whole block, a carried overlap tail or the heading
+        lines = chunk.text.split("\n")
+        body = lines[2:] if chunk.index else lines
+        assert all(line in texts for line in body), chunk.text
+    # Every paragraph lands in some chunk
+    assert all(any(b.text in c.text for c in chunks) for b in blocks)
+
+
+def test_overlap_carries_previous_tail(fixtures):
+    _, chunks = chunk_fixture(fixtures, "15.403-1.html")
+    assert len(chunks) >= 4
+    for previous, chunk in zip(chunks, chunks[1:]):
+        carried = chunk.text.split("\n")[1]
+        assert 0 < len(carried) <= 80
+        assert previous.text.endswith(carried)
+
+
+def test_every_continuation_is_prefixed_with_heading(fixtures):
+    _, chunks = chunk_fixture(fixtures, "15.403-1.html")
+    assert len(chunks) >= 4
+    for chunk in chunks:
+        assert chunk.text.startswith(HEADING), chunk.index
+        assert chunk.text.count(HEADING) == 1
+        assert chunk.section == "15.403-1"
+
+
+def test_oversized_block_is_split_on_sentences():
+    sentence = "The contracting officer shall document the file. "
+    blocks = [Block("15.404-1 Proposal analysis techniques.", heading=True), Block(sentence * 40)]
+    chunks = small_chunker().chunk_blocks(blocks)
+    assert len(chunks) > 2
+    assert all(len(c.text) <= 800 for c in chunks)
+    assert all(c.text.startswith("15.404-1 Proposal analysis techniques.") for c in chunks)
+    assert all(c.text.rstrip().endswith(".") for c in chunks)
+
+
+def test_citation_brackets_are_not_split():
+    text = " ".join(f"Clause text {i} applies [FAR 52.212-{i % 5 + 1}(b)(2)]." for i in range(60))
+    chunks = small_chunker().chunk_text(text)
+    for chunk in chunks:
+        assert chunk.text.count("[") == chunk.text.count("]"), chunk.text
+
+
+def test_seeded_section_applies_until_a_new_number():
+    blocks = [Block("(a) Opening paragraph without a number of its own, long enough to stand alone " * 2),
+              Block("1.102 Statement of guiding principles.", heading=True), Block("(a) The vision.")]
+    chunks = Chunker(min_size=50).chunk_blocks(blocks, section="1.101")
+    assert [(c.section, c.subpart) for c in chunks] == [("1.101", "1.1"), ("1.102", "1.1")]
@@ -0,0 +1,69 @@
+import json
+import shutil
+import subprocess
+import sys
+import textwrap
+
+from conftest import SCRIPTS_DIR
+
+HEAVY = ("supabase", "openai", "httpx", "numpy")
+
+DITAMAP = """<?xml version="1.0" encoding="UTF-8"?>
+<map>
+  <topicref navtitle="PART 15 - Contracting by Negotiation" href="FAR_Part_15.dita">
+    <topicref navtitle="Subpart 15.4 - Contract Pricing" href="Subpart_15.4.dita">
+      <topicref navtitle="15.403-1 Prohibition on obtaining certified cost or pricing data" href="15.403-1.dita"/>
+    </topicref>
+  </topicref>
+</map>
+"""
+
+
+def run_cli(tmp_path, argv):
+    """Runs farchat.main(argv) in a fresh interpreter; returns its output and the heavy modules it loaded."""
+    script = textwrap.dedent(f"""
+        import json, sys
+        from pathlib import Path
+        sys.path.insert(0, {str(SCRIPTS_DIR)!r})
+        import ingest_common
+        ingest_common.SOURCE_ROOT = Path({str(tmp_path / "source")!r})
+        import farchat
+        try:
+            farchat.main({argv!r})
+        except SystemExit:
+            pass
+        print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))
+    """)
+    env = {
+        "PATH": "/usr/bin:/bin",
+        "TOPIC_INDEX_DIR": str(tmp_path / "topic_index"),
+        "INGEST_MANIFEST_DIR": str(tmp_path / "manifests"),
+        "INGEST_CHECKPOINT_DIR": str(tmp_path / "checkpoints"),
+    }
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env,
+                            cwd=tmp_path, timeout=120)
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.strip().splitlines()
+    return "\n".join(lines[:-1]), json.loads(lines[-1])
+
+
+def write_source(tmp_path, fixtures):
+    maps = tmp_path / "source" / "FAR_dita"
+    html = tmp_path / "source" / "FAR_dita_html"
+    maps.mkdir(parents=True)
+    html.mkdir()
+    (maps / "FAR.ditamap").write_text(DITAMAP, encoding="utf-8")
+    shutil.copy(fixtures / "15.403-1.html", html / "15.403-1.html")
+
+
+def test_ingest_dry_run_skips_network_sdks(tmp_path, fixtures):
+    write_source(tmp_path, fixtures)
+    output, loaded = run_cli(tmp_path, ["ingest", "--dry-run"])
+    assert "FAR" in output
+    assert loaded == []
+
+
+def test_verify_help_skips_network_sdks(tmp_path):
+    output, loaded = run_cli(tmp_path, ["verify", "--help"])
+    assert "--deep" in output
+    assert loaded == []
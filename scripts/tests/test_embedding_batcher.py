@@ -0,0 +1,83 @@
+import zlib
+
+import pytest
+
+from embedding_batcher import EmbeddingBatcher, is_batch_too_large
+from embedding_cache import EmbeddingCache
+
+# The stand-in endpoint answers through the real OpenAI SDK
+pytest.importorskip("openai")
+from openai import OpenAI  # noqa: E402
+
+from bench_ingest import LocalEmbeddingServer  # noqa: E402
+
+MODEL = "openai/text-embedding-3-small"
+DIMS = 8
+
+
+def tag(text):
+    """First component the local server puts in the embedding of `text`."""
+    return zlib.crc32(text.encode("utf-8")) % 65536
+
+
+def texts(n):
+    return [f"Section 52.212-{i} applies to commercial products." for i in range(n)]
+
+
+def batcher_for(server, **kwargs):
+    client = OpenAI(base_url=server.base_url, api_key="test", max_retries=0)
+    return EmbeddingBatcher(client, MODEL, DIMS, **kwargs)
+
+
+def test_order_is_preserved_across_batches():
+    items = texts(20)
+    with LocalEmbeddingServer(0, DIMS, record=True) as server:
+        batcher = batcher_for(server, max_items=8)
+        embeddings = batcher.embed_texts(items)
+    assert [len(b) for b in server.requests] == [8, 8, 4]
+    assert [e[0] for e in embeddings] == [tag(t) for t in items]
+    assert all(len(e) == DIMS for e in embeddings)
+
+
+def test_only_cache_misses_are_requested(tmp_path):
+    items = texts(10)
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite3")
+    cached = items[::3]
+    cache.put_many(MODEL, DIMS, cached, [[-1.0] * DIMS] * len(cached))
+    with LocalEmbeddingServer(0, DIMS, record=True) as server:
+        batcher = batcher_for(server, cache=cache)
+        embeddings = batcher.embed_texts(items)
+    assert server.requests == [[t for t in items if t not in cached]]
+    for text, emb in zip(items, embeddings):
+        assert emb[0] == (-1.0 if text in cached else tag(text))
+    # The fresh vectors were cached: a second pass sends nothing
+    with LocalEmbeddingServer(0, DIMS, record=True) as server:
+        assert batcher_for(server, cache=cache).embed_texts(items) == embeddings
+    assert server.requests == []
+
+
+def test_oversized_batch_is_split():
+    items = texts(16)
+    with LocalEmbeddingServer(0, DIMS, max_inputs=4, record=True) as server:
+        batcher = batcher_for(server, max_items=16)
+        embeddings = batcher.embed_texts(items)
+    # 16 is rejected, then each 8, then the four batches of 4 go through
+    assert [len(b) for b in server.requests] == [16, 8, 4, 4, 8, 4, 4]
+    assert batcher.splits == 3
+    assert [e[0] for e in embeddings] == [tag(t) for t in items]
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def test_only_size_rejections_are_bisected():
+    assert is_batch_too_large(StatusError(413, "Payload Too Large"))
+    assert is_batch_too_large(StatusError(400, "This model's maximum context length is 8192 tokens"))
+    assert is_batch_too_large(StatusError(400, "'$.input' is invalid: array must have at most 2048 items"))
+    assert not is_batch_too_large(StatusError(400, "openai/text-embeding-3-small is not a valid model ID"))
+    assert not is_batch_too_large(StatusError(400, "Invalid value for 'encoding_format'"))
+    assert not is_batch_too_large(StatusError(429, "Rate limit reached for requests"))
+    assert not is_batch_too_large(ValueError("no status"))
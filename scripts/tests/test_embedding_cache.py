@@ -0,0 +1,46 @@
+import pytest
+
+from embedding_cache import EmbeddingCache, EmbeddingCacheMiss
+
+MODEL = "test-model"
+
+
+def open_cache(tmp_path, **kwargs):
+    return EmbeddingCache(tmp_path / "embeddings.sqlite3", **kwargs)
+
+
+def stored_bytes(cache):
+    return cache._conn.execute("select coalesce(sum(length(vector)), 0) from embeddings").fetchone()[0]
+
+
+def test_overwriting_entries_does_not_grow_the_size(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_many(MODEL, 4, ["a", "b"], [[1.0] * 4, [2.0] * 4])
+    assert cache._size == stored_bytes(cache) == 32
+    for _ in range(5):
+        cache.put_many(MODEL, 4, ["a", "b", "c"], [[1.0] * 4, [2.0] * 4, [3.0] * 4])
+    assert cache._size == stored_bytes(cache) == 48
+
+
+def test_repeated_text_in_one_batch_is_counted_once(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_many(MODEL, 4, ["a", " a ", "a"], [[1.0] * 4] * 3)
+    assert cache._size == stored_bytes(cache) == 16
+
+
+def test_eviction_only_starts_past_the_budget(tmp_path):
+    cache = open_cache(tmp_path, max_bytes=100)
+    for _ in range(10):
+        cache.put_many(MODEL, 4, ["a", "b", "c"], [[1.0] * 4] * 3)
+    assert cache.evicted == 0
+    cache.put_many(MODEL, 4, [f"t{i}" for i in range(10)], [[1.0] * 4] * 10)
+    assert cache.evicted > 0
+    assert cache._size == stored_bytes(cache) <= 90
+
+
+def test_offline_miss_raises(tmp_path):
+    cache = open_cache(tmp_path, offline=True)
+    cache.put_many(MODEL, 2, ["cached"], [[0.5, 0.5]])
+    assert cache.get_many(MODEL, 2, ["cached"]) == [[0.5, 0.5]]
+    with pytest.raises(EmbeddingCacheMiss):
+        cache.get_many(MODEL, 2, ["cached", "new"])
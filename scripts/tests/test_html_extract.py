@@ -0,0 +1,59 @@
+import pytest
+
+from html_extract import HtmlContentExtractor, blocks_text_hash
+
+# The reference extractor lives in bench_extract.py and needs BeautifulSoup
+pytest.importorskip("bs4")
+from bench_extract import soup_extract_text, write_synthetic_corpus  # noqa: E402
+
+
+def fixture_paths(fixtures):
+    return sorted(fixtures.rglob("*.html"))
+
+
+def test_fixture_corpus_is_present(fixtures):
+    assert len(fixture_paths(fixtures)) >= 5
+
+
+def test_parity_with_beautifulsoup(fixtures):
+    for path in fixture_paths(fixtures):
+        assert HtmlContentExtractor.extract_text(path) == soup_extract_text(path), path.name
+
+
+def test_parity_on_synthetic_corpus(tmp_path):
+    for path in write_synthetic_corpus(tmp_path, 40, seed=7):
+        assert HtmlContentExtractor.extract_text(path) == soup_extract_text(path), path.name
+
+
+def test_blocks_join_to_flat_text(fixtures):
+    for path in fixture_paths(fixtures):
+        blocks = HtmlContentExtractor.extract_blocks(path)
+        assert " ".join(b.text for b in blocks) == HtmlContentExtractor.extract_text(path), path.name
+
+
+def test_blocks_mark_headings_and_skip_nav(fixtures):
+    blocks = HtmlContentExtractor.extract_blocks(fixtures / "extract" / "article_only.html")
+    assert blocks[0].heading and blocks[0].text == "PGI 201.104 Applicability."
+    assert not any(b.heading for b in blocks[1:])
+    assert all("Back to top" not in b.text for b in blocks)
+    assert "Defense Pricing" not in " ".join(b.text for b in blocks)
+
+
+def test_nested_list_paragraph_is_its_own_block(fixtures):
+    texts = [b.text for b in HtmlContentExtractor.extract_blocks(fixtures / "extract" / "lists_tables.html")]
+    assert "(a) Before setting aside an acquisition under this paragraph" in texts
+    assert "refer to 19.203(b)." in texts
+    assert "Breadcrumbs" not in " ".join(texts) and "Part 19" not in texts
+
+
+def test_empty_file(fixtures):
+    path = fixtures / "extract" / "empty.html"
+    assert HtmlContentExtractor.extract_text(path) == ""
+    assert HtmlContentExtractor.extract_blocks(path) == []
+
+
+def test_text_hash_ignores_whitespace_within_blocks(fixtures):
+    blocks = HtmlContentExtractor.extract_blocks(fixtures / "15.403-1.html")
+    spaced = [type(b)(b.text.replace(" ", "  \n "), b.heading) for b in blocks]
+    assert blocks_text_hash(blocks) == blocks_text_hash(spaced)
+    assert blocks_text_hash(blocks) != blocks_text_hash(blocks[:-1])
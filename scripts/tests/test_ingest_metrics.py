@@ -0,0 +1,65 @@
+import pstats
+import threading
+
+import ingest_metrics
+from ingest_metrics import profile_run
+
+
+def thread_work():
+    return sum(i * i for i in range(1000))
+
+
+def profiled_functions(path):
+    return {name for _, _, name in pstats.Stats(str(path)).stats}
+
+
+def test_profile_run_merges_worker_threads(tmp_path):
+    path = tmp_path / "run.prof"
+
+    def run():
+        workers = [threading.Thread(target=thread_work) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return "done"
+
+    assert profile_run(run, path, top=0) == "done"
+    assert "thread_work" in profiled_functions(path)
+
+
+def test_profile_run_with_a_thread_still_running(tmp_path):
+    path = tmp_path / "run.prof"
+    release = threading.Event()
+    worker = threading.Thread(target=release.wait, daemon=True)
+
+    def run():
+        worker.start()
+
+    profile_run(run, path, top=0)
+    release.set()
+    worker.join()
+    assert path.exists()
+
+
+def test_profile_run_main_thread_only(tmp_path, monkeypatch):
+    # The 3.12+ path: no per-thread profilers, so none can clash with the main one
+    monkeypatch.setattr(ingest_metrics, "PER_THREAD_PROFILES", False)
+    path = tmp_path / "run.prof"
+    errors = []
+
+    def guarded():
+        try:
+            thread_work()
+        except Exception as e:
+            errors.append(e)
+
+    def run():
+        worker = threading.Thread(target=guarded)
+        worker.start()
+        worker.join()
+        return thread_work()
+
+    assert profile_run(run, path, top=0) == thread_work()
+    assert not errors
+    assert "thread_work" in profiled_functions(path)
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("numpy")
+from local_index import LocalIndex, LocalIndexWriter  # noqa: E402
+
+
+def add(writer, regulation, href, n, vector):
+    writer.add(None, f"{href} chunk {n}", {"regulation": regulation, "href": href, "n": n}, vector)
+
+
+def contents(path):
+    index = LocalIndex(path)
+    try:
+        return [index.row(i)["content"] for i in range(index.count)]
+    finally:
+        index.close()
+
+
+def test_incremental_writer_upserts_topics(tmp_path):
+    with LocalIndexWriter(tmp_path, 2) as writer:
+        add(writer, "FAR", "1.101.dita", 0, [1.0, 0.0])
+        add(writer, "FAR", "1.102.dita", 0, [0.0, 1.0])
+        add(writer, "FAR", "1.102.dita", 1, [0.5, 0.5])
+        add(writer, "DFARS", "1.102.dita", 0, [1.0, 1.0])
+        add(writer, "FAR", "1.103.dita", 0, [1.0, 0.5])
+
+    # 1.102 was edited and 1.103 removed from the source
+    with LocalIndexWriter(tmp_path, 2, reset=False) as writer:
+        writer.remove("FAR", ["1.102.dita", "1.103.dita"])
+        add(writer, "FAR", "1.102.dita", 0, [0.0, 1.0])
+
+    assert contents(tmp_path) == ["1.101.dita chunk 0", "1.102.dita chunk 0", "1.102.dita chunk 0"]
+    index = LocalIndex(tmp_path)
+    assert index.count == 3
+    assert [index.row(i)["metadata"]["regulation"] for i in range(3)] == ["FAR", "DFARS", "FAR"]
+    assert index.search([0.0, 1.0], threshold=0.99, count=5)[0]["metadata"]["href"] == "1.102.dita"
+    index.close()
+
+
+def test_incremental_writer_without_removals_appends(tmp_path):
+    with LocalIndexWriter(tmp_path, 2) as writer:
+        add(writer, "FAR", "1.101.dita", 0, [1.0, 0.0])
+    with LocalIndexWriter(tmp_path, 2, reset=False) as writer:
+        add(writer, "FAR", "1.104.dita", 0, [0.0, 1.0])
+    assert contents(tmp_path) == ["1.101.dita chunk 0", "1.104.dita chunk 0"]
+
+
+def test_reset_replaces_the_index(tmp_path):
+    with LocalIndexWriter(tmp_path, 2) as writer:
+        add(writer, "FAR", "1.101.dita", 0, [1.0, 0.0])
+    with LocalIndexWriter(tmp_path, 2) as writer:
+        add(writer, "FAR", "1.104.dita", 0, [0.0, 1.0])
+    assert contents(tmp_path) == ["1.104.dita chunk 0"]
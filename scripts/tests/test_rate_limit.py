@@ -0,0 +1,31 @@
+import threading
+import time
+
+from rate_limit import AdaptiveConcurrency
+
+
+def test_cap_lowers_ceiling_and_limit():
+    controller = AdaptiveConcurrency(initial=8, maximum=16)
+    controller.cap(4)
+    assert controller.maximum == 4 and controller.limit == 4.0
+    # Never raises the ceiling
+    controller.cap(32)
+    assert controller.maximum == 4
+
+
+def test_limit_grows_to_thread_count_when_capped():
+    threads = 3
+    controller = AdaptiveConcurrency(initial=1, maximum=16)
+    controller.cap(threads)
+
+    def work():
+        for _ in range(20):
+            controller.call(time.sleep, 0.001)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert controller.limit == float(threads)
+    assert controller.peak_in_flight <= threads
@@ -0,0 +1,207 @@
+"""
+Persisted topic index of a ditamap, shared by ingestion and structure generation.
+
+A map is parsed once, with lxml.etree.iterparse (elements are cleared as
+their topicref closes), into a flat list of its topicrefs in document
+order. Each entry records the topic's ordinal, its parent's ordinal, its
+title, outputclass and href, the HTML file the href maps to with that
+file's mtime and size, and the part, subpart and section it belongs to:
+from its own navtitle ("15.403-1 ...") or the nearest ancestor's
+("Subpart 15.4 - ...", "PART 15 - ...").
+
+DitaMapParser (ingest_common.py) walks the index to yield the topics to
+ingest and puts their lineage in the chunk metadata; StructureBuilder
+(generate_structure.py) builds the Regulation Explorer tree from it.
+
+Indexes live in scripts/.cache/topic_index/<MAP>-<path hash>.json
+(TOPIC_INDEX_DIR) and are rebuilt when the map's mtime or size changes,
+so repeated runs never parse the XML. HTML files are still stat'ed once
+per walk, so edited topics are noticed without touching the map; the
+fresh stats are written back to the index.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import lxml.etree as ET
+
+from chunking import PART_HEADING, SECTION_NUMBER, SUBPART_HEADING, section_lineage
+
+DEFAULT_INDEX_DIR = Path(__file__).parent / ".cache" / "topic_index"
+INDEX_DIR = Path(os.environ.get("TOPIC_INDEX_DIR", str(DEFAULT_INDEX_DIR)))
+# Bump when the entry layout or the lineage rules change
+FORMAT = 1
+
+
+@dataclass
+class Topic:
+    ordinal: int
+    parent: int                      # ordinal of the enclosing topicref, -1 at the top level
+    title: str
+    type: Optional[str]              # outputclass, None when the attribute is missing
+    href: Optional[str]
+    part: Optional[str] = None
+    subpart: Optional[str] = None
+    section: Optional[str] = None
+    mtime: Optional[float] = None    # of the HTML file, as of the last walk
+    size: Optional[int] = None
+
+    @property
+    def html(self) -> Optional[str]:
+        """HTML file name for a .dita href, e.g. "1.101.dita" -> "1.101.html"."""
+        if self.href and self.href.endswith(".dita"):
+            return self.href.replace(".dita", ".html")
+        return None
+
+    def lineage(self) -> Dict[str, str]:
+        lineage = {}
+        if self.part:
+            lineage["part"] = self.part
+        if self.subpart:
+            lineage["subpart"] = self.subpart
+        if self.section:
+            lineage["section"] = self.section
+        return lineage
+
+
+FIELDS = [f.name for f in fields(Topic)]
+
+
+def title_lineage(title: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """(part, subpart, section) named by a navtitle, e.g. "Subpart 15.4 - ..." -> ("15", "15.4", None)."""
+    number = SECTION_NUMBER.match(title)
+    if number:
+        part, subpart = section_lineage(number.group(1))
+        return part, subpart, number.group(1)
+    match = SUBPART_HEADING.match(title)
+    if match:
+        return match.group(1).split(".")[0], match.group(1), None
+    match = PART_HEADING.match(title)
+    if match:
+        return match.group(1), None, None
+    return None, None, None
+
+
+def parse_map(map_path: Path) -> List[Topic]:
+    """Every topicref in document order, with its parent and lineage."""
+    topics: List[Topic] = []
+    stack: List[Topic] = []
+    for event, elem in ET.iterparse(str(map_path), events=("start", "end"), tag="topicref"):
+        if event == "end":
+            stack.pop()
+            # Free the subtree and any processed siblings still referenced by the parent
+            elem.clear(keep_tail=False)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+            continue
+
+        parent = stack[-1] if stack else None
+        title = elem.get("navtitle") or ""
+        part, subpart, section = title_lineage(title)
+        if parent and not part:
+            # Untitled or unnumbered topics belong where their parent does
+            part, subpart, section = parent.part, parent.subpart, parent.section
+        elif parent and section and parent.subpart and section.startswith(parent.subpart):
+            # The map knows "19.1501" is in Subpart 19.15, which section_lineage can't tell
+            subpart = parent.subpart
+        topic = Topic(
+            ordinal=len(topics),
+            parent=parent.ordinal if parent else -1,
+            title=title,
+            type=elem.get("outputclass"),
+            href=elem.get("href"),
+            part=part,
+            subpart=subpart,
+            section=section,
+        )
+        topics.append(topic)
+        stack.append(topic)
+    return topics
+
+
+def _map_stamp(map_path: Path) -> Dict:
+    stat = map_path.stat()
+    return {"map": str(map_path.resolve()), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+class TopicIndex:
+    """The topics of one ditamap, loaded from the cache or parsed and saved."""
+
+    def __init__(self, map_path: Path, topics: List[Topic], stamp: Dict, directory: Path = INDEX_DIR,
+                 parsed: bool = False):
+        self.map_path = Path(map_path)
+        self.regulation_name = self.map_path.stem.split('.')[0]  # e.g., "FAR"
+        self.topics = topics
+        self.stamp = stamp
+        self.parsed = parsed
+        digest = hashlib.sha1(stamp["map"].encode("utf-8")).hexdigest()[:8]
+        self.path = Path(directory) / f"{self.regulation_name}-{digest}.json"
+
+    @classmethod
+    def load(cls, map_path: Path, directory: Path = INDEX_DIR) -> "TopicIndex":
+        """The cached index if it matches the map's mtime and size, else a fresh parse (saved)."""
+        map_path = Path(map_path)
+        stamp = _map_stamp(map_path)
+        index = cls(map_path, [], stamp, directory)
+        if index.path.exists():
+            try:
+                with open(index.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("format") == FORMAT and data.get("fields") == FIELDS and \
+                        all(data.get(key) == value for key, value in stamp.items()):
+                    index.topics = [Topic(*row) for row in data["topics"]]
+                    return index
+            except (OSError, ValueError, TypeError) as e:
+                print(f"Ignoring unreadable topic index {index.path.name}: {e}")
+        index.topics = parse_map(map_path)
+        index.parsed = True
+        index.save()
+        return index
+
+    def save(self):
+        """Writes the index; a read-only cache directory only costs the next run a parse."""
+        topics = [[getattr(t, name) for name in FIELDS] for t in self.topics]
+        payload = {"format": FORMAT, **self.stamp, "fields": FIELDS, "topics": topics}
+        # Per-process temp file: ingestion and structure generation may save the same map at once
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f, separators=(",", ":"), ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Topic index for {self.map_path.name} not cached: {e}")
+
+    def __iter__(self) -> Iterator[Topic]:
+        return iter(self.topics)
+
+    def __len__(self) -> int:
+        return len(self.topics)
+
+    def with_html(self, html_dir: Path) -> Iterator[Tuple[Topic, Path]]:
+        """Topics whose HTML file exists, in map order, with fresh mtime/size.
+
+        Changed stats are saved back to the index once the walk finishes.
+        """
+        base = str(html_dir)
+        changed = False
+        for topic in self.topics:
+            name = topic.html
+            if not name:
+                continue
+            try:
+                stat = os.stat(os.path.join(base, name))
+                mtime, size = stat.st_mtime, stat.st_size
+            except OSError:
+                mtime = size = None
+            if mtime != topic.mtime or size != topic.size:
+                topic.mtime, topic.size = mtime, size
+                changed = True
+            if mtime is not None:
+                yield topic, html_dir / name
+        if changed:
+            self.save()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Create, drop and inspect the vector indexes on document_chunks.
+
+Inserting into a table with an HNSW (or ivfflat) index updates the index
+row by row, which dominates the cost of a large initial load. The faster
+path is to drop the index, bulk load, and build it once at the end;
+ingest_all.py --defer-index does exactly that through this module.
+
+    python vector_index.py status
+    python vector_index.py drop
+    python vector_index.py create                   # HNSW, m=16, ef_construction=64
+    python vector_index.py create --kind ivfflat    # lists sized to the row count
+    python vector_index.py drop --column embedding  # keep only the compact index (see the 070000 migration)
+
+--column picks the full-precision `embedding` (the default for create) or
+the half-precision `embedding_compact` prefix. status also reports the
+average stored size of each column, so the storage side of the compact
+comparison comes from the same place as the index sizes.
+
+Needs a direct Postgres connection (SUPABASE_DB_URL or --dsn) and psycopg;
+index builds take longer than PostgREST and SQL editor timeouts allow.
+"""
+
+import argparse
+import math
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=Path(__file__).parent / ".env")
+except ImportError:
+    pass
+
+SUPABASE_DB_URL = os.environ.get("SUPABASE_DB_URL")
+CHUNK_TABLE = "document_chunks"
+INDEX_NAME = "document_chunks_embedding_hnsw_idx"
+IVFFLAT_INDEX_NAME = "document_chunks_embedding_ivfflat_idx"
+# Column -> (operator class, index name per kind)
+COLUMNS = {
+    "embedding": ("vector_cosine_ops", {"hnsw": INDEX_NAME, "ivfflat": IVFFLAT_INDEX_NAME}),
+    "embedding_compact": ("halfvec_cosine_ops", {
+        "hnsw": "document_chunks_embedding_compact_hnsw_idx",
+        "ivfflat": "document_chunks_embedding_compact_ivfflat_idx",
+    }),
+}
+# Memory for the index build; HNSW builds are much faster when the graph fits
+INDEX_BUILD_MEMORY = os.environ.get("INDEX_BUILD_MEMORY", "1GB")
+INDEX_BUILD_WORKERS = int(os.environ.get("INDEX_BUILD_WORKERS", "4"))
+
+
+def ivfflat_lists(rows: int) -> int:
+    """pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond."""
+    if rows > 1_000_000:
+        return int(math.sqrt(rows))
+    return max(10, rows // 1000)
+
+
+class VectorIndex:
+    def __init__(self, dsn: str, table: str = CHUNK_TABLE):
+        import psycopg
+
+        self.table = table
+        self.conn = psycopg.connect(dsn, autocommit=True)
+
+    def indexes(self, column: Optional[str] = None) -> List[Dict]:
+        """Vector indexes on the table, or only those on `column`."""
+        rows = self.conn.execute(
+            "select indexname, indexdef, pg_relation_size(format('%%I.%%I', schemaname, indexname)::regclass) "
+            "from pg_indexes where tablename = %s "
+            "and (indexdef ilike '%%using ivfflat%%' or indexdef ilike '%%using hnsw%%')",
+            (self.table,),
+        ).fetchall()
+        return [
+            {"name": name, "definition": definition, "bytes": size}
+            for name, definition, size in rows
+            if column is None or f"({column} " in definition
+        ]
+
+    def column_sizes(self) -> Dict[str, Dict]:
+        """Rows and average/total stored bytes of each vector column present on the table."""
+        present = {name for (name,) in self.conn.execute(
+            "select column_name from information_schema.columns where table_name = %s", (self.table,),
+        )}
+        sizes = {}
+        for column in COLUMNS:
+            if column not in present:
+                continue
+            rows, avg, total = self.conn.execute(
+                f"select count({column}), avg(pg_column_size({column})), sum(pg_column_size({column})) "
+                f"from {self.table}"
+            ).fetchone()
+            sizes[column] = {"rows": rows, "avg_bytes": float(avg or 0), "bytes": int(total or 0)}
+        return sizes
+
+    def row_count(self) -> int:
+        return self.conn.execute(f"select count(*) from {self.table} where embedding is not null").fetchone()[0]
+
+    def drop(self, column: Optional[str] = None) -> List[Dict]:
+        """Drops every vector index on the table (or on `column`) and returns their definitions."""
+        dropped = self.indexes(column)
+        for index in dropped:
+            self.conn.execute(f'drop index if exists "{index["name"]}"')
+            print(f"Dropped {index['name']}")
+        return dropped
+
+    def create(self, kind: str = "hnsw", m: int = 16, ef_construction: int = 64,
+               lists: Optional[int] = None, column: str = "embedding") -> str:
+        # Partial per-regulation indexes (WHERE regulation = ...) sit beside the full one
+        if any(" WHERE " not in index["definition"] for index in self.indexes(column)):
+            print(f"A vector index on {column} already exists; drop it first to rebuild.")
+            return ""
+        opclass, names = COLUMNS[column]
+        name = names[kind]
+        if kind == "hnsw":
+            options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+        else:
+            lists = lists or ivfflat_lists(self.row_count())
+            options = f"lists = {int(lists)}"
+        self.conn.execute(f"set maintenance_work_mem = '{INDEX_BUILD_MEMORY}'")
+        self.conn.execute(f"set max_parallel_maintenance_workers = {INDEX_BUILD_WORKERS}")
+        print(f"Building {kind} index {name} ({options})...")
+        t0 = time.perf_counter()
+        self.conn.execute(
+            f"create index {name} on {self.table} using {kind} ({column} {opclass}) with ({options})"
+        )
+        self.conn.execute(f"analyze {self.table}")
+        print(f"Built {name} in {time.perf_counter() - t0:.1f}s")
+        return name
+
+    def restore(self, definitions: List[Dict]):
+        """Recreates indexes from `drop()`'s result, or the default HNSW index if there were none."""
+        if self.indexes():
+            return
+        if not definitions:
+            self.create()
+            return
+        self.conn.execute(f"set maintenance_work_mem = '{INDEX_BUILD_MEMORY}'")
+        self.conn.execute(f"set max_parallel_maintenance_workers = {INDEX_BUILD_WORKERS}")
+        for index in definitions:
+            print(f"Rebuilding {index['name']}...")
+            t0 = time.perf_counter()
+            self.conn.execute(index["definition"])
+            print(f"Built {index['name']} in {time.perf_counter() - t0:.1f}s")
+        self.conn.execute(f"analyze {self.table}")
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the vector index on document_chunks.")
+    parser.add_argument("command", choices=("status", "drop", "create"))
+    parser.add_argument("--dsn", default=SUPABASE_DB_URL, help="Postgres DSN (default: SUPABASE_DB_URL)")
+    parser.add_argument("--table", default=CHUNK_TABLE)
+    parser.add_argument("--kind", choices=("hnsw", "ivfflat"), default="hnsw")
+    parser.add_argument("--m", type=int, default=16, help="HNSW links per node (default: 16)")
+    parser.add_argument("--ef-construction", type=int, default=64, help="HNSW build candidate list (default: 64)")
+    parser.add_argument("--lists", type=int, help="ivfflat lists (default: sized to the row count)")
+    parser.add_argument("--column", choices=tuple(COLUMNS),
+                        help="Vector column (create: default embedding; drop: default every vector index)")
+    args = parser.parse_args()
+
+    if not args.dsn:
+        raise SystemExit("Set SUPABASE_DB_URL (or pass --dsn) to the direct Postgres connection string")
+
+    index = VectorIndex(args.dsn, args.table)
+    try:
+        if args.command == "status":
+            print(f"{args.table}: {index.row_count()} rows with embeddings")
+            columns = index.column_sizes()
+            for column, size in columns.items():
+                print(f"  {column}: {size['rows']} values, {size['avg_bytes']:.0f} bytes avg "
+                      f"({size['bytes'] / 2**20:.1f} MiB)")
+            indexes = index.indexes(args.column)
+            for entry in indexes:
+                print(f"  {entry['name']} ({entry['bytes'] / 2**20:.1f} MiB): {entry['definition']}")
+            if not indexes:
+                print("  no vector index (searches scan every row)")
+            elif not args.column:
+                total = sum(size["bytes"] for size in columns.values()) + sum(entry["bytes"] for entry in indexes)
+                full = sum(entry["bytes"] for entry in index.indexes("embedding"))
+                print(f"  vectors and indexes: {total / 2**20:.1f} MiB"
+                      + (f", {(total - full) / 2**20:.1f} MiB without the full-precision index" if full else ""))
+        elif args.command == "drop":
+            index.drop(args.column)
+        else:
+            index.create(args.kind, args.m, args.ef_construction, args.lists, args.column or "embedding")
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
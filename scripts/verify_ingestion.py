@@ -4,13 +4,26 @@ Ingestion Verification Script for FARchat
 
 This script checks if the document_chunks table has data and provides
 statistics about the ingested regulatory documents.
+
+With --deep it also walks every ditamap, hashes each topic's extracted
+text on a process pool and compares the hashes with the ones stored in
+chunk metadata, reporting per regulation the topics that are missing,
+stale (source changed, or fewer chunks than were produced) or orphaned
+(in the database but no longer in the map).
+
+It also reports the query result cache: fresh, stale and expired entries
+and the share of lookups served from it over the last --cache-days days.
 """
 
+import argparse
+import hashlib
+import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
-from supabase import create_client
 
 
 def load_config():
@@ -67,16 +80,83 @@ def check_source_content():
     return content_dirs
 
 
+STAT_COLUMNS = ('chunks', 'missing_embeddings', 'linked_duplicates', 'duplicate_content', 'avg_chars')
+SCAN_PAGE_SIZE = 1000
+
+
+def fetch_chunk_stats(supabase):
+    """Per-regulation statistics from the chunk_stats() SQL function, in one round trip."""
+    rows = supabase.rpc('chunk_stats', {}).execute().data or []
+    return {row['regulation']: {col: row.get(col) or 0 for col in STAT_COLUMNS} for row in rows}
+
+
+def scan_chunk_stats(supabase, page_size=SCAN_PAGE_SIZE):
+    """Fallback for databases without chunk_stats(): pages through the table by id.
+
+    Keyset pagination (id > last seen) keeps every page under PostgREST's
+    row limit, so nothing is silently dropped.
+    """
+    stats = {}
+    seen_content = {}
+    last_id = 0
+    while True:
+        page = (
+            supabase.table('document_chunks')
+            .select('id, content, metadata')
+            .gt('id', last_id)
+            .order('id')
+            .limit(page_size)
+            .execute()
+        ).data or []
+        for row in page:
+            meta = row.get('metadata') or {}
+            reg = meta.get('regulation') or 'Unknown'
+            entry = stats.setdefault(reg, {col: 0 for col in STAT_COLUMNS})
+            content = row.get('content') or ''
+            entry['chunks'] += 1
+            entry['avg_chars'] += len(content)
+            if 'duplicate_of' in meta:
+                entry['linked_duplicates'] += 1
+            digest = hashlib.md5(content.encode('utf-8')).digest()
+            hashes = seen_content.setdefault(reg, set())
+            if digest in hashes:
+                entry['duplicate_content'] += 1
+            hashes.add(digest)
+        print(f"    scanned {sum(e['chunks'] for e in stats.values())} rows...", end='\r')
+        if len(page) < page_size:
+            break
+        last_id = page[-1]['id']
+    print()
+
+    for reg, entry in stats.items():
+        entry['avg_chars'] = round(entry['avg_chars'] / entry['chunks'], 1) if entry['chunks'] else 0
+        # Counting with a filter is exact and avoids downloading the vectors
+        missing = (
+            supabase.table('document_chunks')
+            .select('id', count='exact')
+            .is_('embedding', 'null')
+            .eq('metadata->>regulation', reg)
+            .limit(1)
+            .execute()
+        ).count or 0
+        entry['missing_embeddings'] = max(0, missing - entry['linked_duplicates'])
+    return stats
+
+
 def check_database_chunks(supabase):
     """Check document_chunks table in database."""
     print("\n" + "=" * 60)
     print("DATABASE CHECK")
     print("=" * 60)
 
-    # Get total count
-    result = supabase.table('document_chunks').select('id, metadata', count='exact').execute()
-    total_count = result.count or 0
+    try:
+        regulation_stats = fetch_chunk_stats(supabase)
+    except Exception as e:
+        print(f"\n  chunk_stats() unavailable ({str(e)[:80]}); scanning the table instead.")
+        print("  Apply supabase/migrations/20261018030000_chunk_stats.sql for a one-query check.")
+        regulation_stats = scan_chunk_stats(supabase)
 
+    total_count = sum(entry['chunks'] for entry in regulation_stats.values())
     print(f"\n  Total chunks: {total_count}")
 
     if total_count == 0:
@@ -84,18 +164,16 @@ def check_database_chunks(supabase):
         print("     Run ingest_all.py to populate the database.")
         return {'total': 0, 'by_regulation': {}}
 
-    # Get count by regulation
-    result = supabase.table('document_chunks').select('metadata').execute()
-    regulation_counts = {}
-
-    for row in result.data:
-        meta = row.get('metadata', {})
-        reg = meta.get('regulation', 'Unknown')
-        regulation_counts[reg] = regulation_counts.get(reg, 0) + 1
-
     print("\n  Chunks by regulation:")
-    for reg, count in sorted(regulation_counts.items()):
-        print(f"    {reg}: {count} chunks")
+    print(f"    {'Regulation':<12} {'Chunks':>9} {'No embed':>9} {'Linked':>9} {'Dup text':>9} {'Avg chars':>10}")
+    for reg, entry in sorted(regulation_stats.items()):
+        print(
+            f"    {reg:<12} {entry['chunks']:>9} {entry['missing_embeddings']:>9} "
+            f"{entry['linked_duplicates']:>9} {entry['duplicate_content']:>9} {float(entry['avg_chars']):>10.1f}"
+        )
+    missing = sum(entry['missing_embeddings'] for entry in regulation_stats.values())
+    if missing:
+        print(f"\n  ⚠️  {missing} chunks have no embedding and are invisible to vector search.")
 
     # Get sample chunks
     result = supabase.table('document_chunks').select(
@@ -115,10 +193,126 @@ def check_database_chunks(supabase):
 
     return {
         'total': total_count,
-        'by_regulation': regulation_counts
+        'by_regulation': {reg: entry['chunks'] for reg, entry in regulation_stats.items()},
+        'stats': regulation_stats,
     }
 
 
+def hash_topic(html_path: Path) -> Tuple[Optional[str], str]:
+    """Worker: (text hash or None if ingestion would skip the topic, HTML file hash)."""
+    from html_extract import HtmlContentExtractor, blocks_text_hash
+    from ingest_common import MIN_TOPIC_CHARS
+    from ingest_manifest import hash_file
+
+    blocks = HtmlContentExtractor.extract_blocks(html_path)
+    text_hash = blocks_text_hash(blocks) if sum(len(b.text) for b in blocks) >= MIN_TOPIC_CHARS else None
+    return text_hash, hash_file(html_path)
+
+
+def fetch_topic_rows(supabase, regulation: str, page_size: int = SCAN_PAGE_SIZE) -> Dict[str, Dict]:
+    """href -> {rows, text_hashes, content_hashes, chunk_count} for one regulation, paging by id.
+
+    Only the few metadata fields needed are selected, so a page is a few
+    hundred bytes per row rather than the content and embedding.
+    """
+    topics: Dict[str, Dict] = {}
+    last_id = 0
+    while True:
+        page = (
+            supabase.table('document_chunks')
+            .select('id, href:metadata->>href, text_hash:metadata->>text_hash, '
+                    'content_hash:metadata->>content_hash, chunk_count:metadata->>chunk_count')
+            # The generated column is indexed; the JSON path would scan the table
+            .eq('regulation', regulation)
+            .gt('id', last_id)
+            .order('id')
+            .limit(page_size)
+            .execute()
+        ).data or []
+        for row in page:
+            entry = topics.setdefault(row.get('href') or '', {
+                'rows': 0, 'text_hashes': set(), 'content_hashes': set(), 'chunk_count': 0,
+            })
+            entry['rows'] += 1
+            if row.get('text_hash'):
+                entry['text_hashes'].add(row['text_hash'])
+            if row.get('content_hash'):
+                entry['content_hashes'].add(row['content_hash'])
+            entry['chunk_count'] = max(entry['chunk_count'], int(row.get('chunk_count') or 1))
+        if len(page) < page_size:
+            break
+        last_id = page[-1]['id']
+    return topics
+
+
+def diff_regulation(walked: List[Dict], hashes: List[Tuple[Optional[str], str]], stored: Dict[str, Dict]) -> Dict:
+    """Classifies every topic of one regulation against its rows in the database."""
+    report = {'topics': len(walked), 'ok': 0, 'empty': 0, 'missing': [], 'stale': [], 'orphan': []}
+    in_map = set()
+    for item, (text_hash, file_hash) in zip(walked, hashes):
+        href = item['metadata']['href']
+        in_map.add(href)
+        entry = stored.get(href)
+        if text_hash is None:
+            # Ingestion skips topics without enough text; rows for one mean it used to have text
+            if entry:
+                report['stale'].append({'href': href, 'reason': 'topic is now empty'})
+            else:
+                report['empty'] += 1
+            continue
+        if not entry:
+            report['missing'].append(href)
+        elif entry['text_hashes'] and entry['text_hashes'] != {text_hash}:
+            report['stale'].append({'href': href, 'reason': 'text changed'})
+        elif not entry['text_hashes'] and entry['content_hashes'] != {file_hash}:
+            # Rows written before text hashes were recorded carry the HTML file hash
+            report['stale'].append({'href': href, 'reason': 'html changed'})
+        elif entry['rows'] < entry['chunk_count']:
+            report['stale'].append({'href': href, 'reason': f"{entry['rows']} of {entry['chunk_count']} chunks"})
+        else:
+            report['ok'] += 1
+    report['orphan'] = sorted(href for href in stored if href not in in_map)
+    return report
+
+
+def check_deep(supabase, workers: int, only: Optional[List[str]] = None, show: int = 10) -> Dict[str, Dict]:
+    """Diffs every discovered ditamap against document_chunks."""
+    from ingest_common import SOURCE_ROOT, DitaMapParser, discover_regulations
+
+    print("\n" + "=" * 60)
+    print("DEEP INTEGRITY CHECK")
+    print("=" * 60)
+
+    reports = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for reg in discover_regulations():
+            map_path = SOURCE_ROOT / reg['map_dir'] / f"{reg['map_name']}.ditamap"
+            if not map_path.exists() or (only and reg['map_name'] not in only):
+                continue
+            parser = DitaMapParser(map_path, SOURCE_ROOT / reg['html_dir'])
+            walked = list(parser.walk())
+            hashes = list(pool.map(hash_topic, [item['html_path'] for item in walked], chunksize=64))
+            stored = fetch_topic_rows(supabase, parser.regulation_name)
+            report = diff_regulation(walked, hashes, stored)
+            reports[parser.regulation_name] = report
+
+            print(
+                f"\n  {parser.regulation_name}: {report['topics']} topics, {report['ok']} ok, "
+                f"{len(report['missing'])} missing, {len(report['stale'])} stale, "
+                f"{len(report['orphan'])} orphaned, {report['empty']} empty (not ingested)"
+            )
+            for label, entries in (('missing', report['missing']), ('stale', report['stale']),
+                                   ('orphan', report['orphan'])):
+                for entry in entries[:show]:
+                    if isinstance(entry, dict):
+                        print(f"    {label:<8} {entry['href']} ({entry['reason']})")
+                    else:
+                        print(f"    {label:<8} {entry}")
+                if len(entries) > show:
+                    print(f"    {label:<8} ... and {len(entries) - show} more")
+    return reports
+
+
 def check_vector_search_function(supabase):
     """Verify the match_documents function exists and works."""
     print("\n" + "=" * 60)
@@ -149,8 +343,53 @@ def check_vector_search_function(supabase):
         return False
 
 
-def main():
+def check_query_cache(supabase, days: int):
+    """Entries, staleness and hit rate of the hybrid_search result cache."""
+    print("\n" + "=" * 60)
+    print("QUERY CACHE CHECK")
+    print("=" * 60)
+
+    try:
+        rows = supabase.rpc('query_cache_report', {'days': days}).execute().data or []
+    except Exception as e:
+        print(f"\n  query_cache_report() unavailable ({str(e)[:80]}).")
+        print("  Apply supabase/migrations/20261018050000_query_cache.sql to cache repeated questions.")
+        return None
+    report = rows[0] if rows else {}
+    lookups, hits, refreshes = (int(report.get(k) or 0) for k in ('lookups', 'hits', 'refreshes'))
+    report['hit_rate'] = (hits + refreshes) / lookups if lookups else None
+
+    print(f"\n  Entries: {report.get('entries', 0)} ({report.get('warmed', 0)} from the warmer)")
+    print(f"    fresh    {report.get('fresh', 0)} (oldest refreshed {report.get('oldest_fresh') or 'n/a'})")
+    print(f"    stale    {report.get('stale', 0)} (written before re-ingestion at {report.get('invalidated_at')}, "
+          f"corpus version {report.get('corpus_version')}; re-searched on their next lookup)")
+    print(f"    expired  {report.get('expired', 0)} (past their TTL; warm_query_cache.py deletes them)")
+    if lookups:
+        print(f"\n  Last {days} days: {lookups} lookups, {hits} hits, {refreshes} refreshed, "
+              f"{lookups - hits - refreshes} misses ({100.0 * report['hit_rate']:.1f}% served from the cache)")
+    else:
+        print(f"\n  No lookups in the last {days} days.")
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Verify FARchat ingestion.")
+    parser.add_argument("--deep", action="store_true",
+                        help="Diff every ditamap topic against document_chunks (missing, stale, orphaned)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes hashing topics for --deep (default: CPU count)")
+    parser.add_argument("--regulation", action="append", metavar="MAP",
+                        help="Limit --deep to these maps, e.g. --regulation FAR (repeatable)")
+    parser.add_argument("--output", type=Path, metavar="PATH",
+                        help="Write the full --deep report (every href) as JSON")
+    parser.add_argument("--cache-days", type=int, default=7,
+                        help="Days of query cache lookups to report the hit rate over (default: 7)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
     """Main verification function."""
+    args = parse_args(argv)
     print("\n" + "=" * 60)
     print("FARchat Ingestion Verification")
     print("=" * 60)
@@ -161,12 +400,16 @@ def main():
     print(f"Supabase Key: {supabase_key[:20]}...")
 
     # Create Supabase client
+    from supabase import create_client
+
     supabase = create_client(supabase_url, supabase_key)
 
     # Run checks
     source_content = check_source_content()
     chunks = check_database_chunks(supabase)
     vector_func = check_vector_search_function(supabase)
+    query_cache = check_query_cache(supabase, args.cache_days)
+    deep = check_deep(supabase, max(1, args.workers), args.regulation) if args.deep else None
 
     # Summary
     print("\n" + "=" * 60)
@@ -176,6 +419,21 @@ def main():
     print(f"\n  Source content directories: {len(source_content)}")
     print(f"  Document chunks in DB: {chunks['total']}")
     print(f"  Vector search function: {'✓ Working' if vector_func else '✗ Failed'}")
+    if query_cache is not None:
+        rate = query_cache['hit_rate']
+        print(f"  Query cache: {query_cache.get('fresh', 0)} fresh, {query_cache.get('stale', 0)} stale entries; "
+              f"hit rate {f'{100.0 * rate:.1f}%' if rate is not None else 'n/a'}")
+
+    if deep is not None:
+        problems = sum(len(r['missing']) + len(r['stale']) + len(r['orphan']) for r in deep.values())
+        print(f"  Deep check: {problems} topics missing, stale or orphaned across {len(deep)} regulations")
+        if args.output:
+            args.output.write_text(json.dumps(deep, indent=2) + "\n")
+            print(f"  Deep report written to {args.output}")
+        if problems:
+            print("\n  Run 'python scripts/ingest_all.py' to re-ingest missing and stale topics")
+            print("  and delete orphaned ones.")
+            return 1
 
     if chunks['total'] == 0:
         print("\n  ⚠️  ACTION REQUIRED:")
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Pre-populates the query result cache (supabase/migrations/20261018050000_query_cache.sql).
+
+Questions come from:
+  --log PATH    a query log, one question per line or JSONL with a "query",
+                "question", "text" or "content" field and an optional "count"
+                (repeatable)
+  titles        every section title in the Regulation Explorer data
+                (app/public/data/regulations, or a combined regulations.json
+                via --structure), prefixed with its regulation, e.g.
+                "DFARS 252.204-7012 Safeguarding Covered Defense Information..."
+
+Questions are normalized the way the database keys them (query_key) and
+deduplicated, log questions first, most frequent first. Expired entries
+are deleted, and questions already cached for the current corpus version
+are skipped. The rest are embedded in batches through EmbeddingBatcher
+(so the local embedding cache applies) and sent to query_cache_warm(),
+which runs hybrid_search for each question and stores the results, one
+RPC per --rpc-batch questions and match count.
+
+    python warm_query_cache.py --log queries.jsonl
+    python warm_query_cache.py --no-titles --log queries.txt --match-count 5
+    python warm_query_cache.py --limit 2000 --dry-run
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from ingest_common import (
+    EMBEDDING_DIM, EMBEDDING_MODEL, OPENROUTER_API_KEY, SUPABASE_KEY, SUPABASE_URL, create_supabase_client,
+)
+
+STRUCTURE_DIR = Path(__file__).parent.parent / "app/public/data/regulations"
+# Same defaults as the chat route (5) and the search page (10)
+MATCH_COUNTS = "5,10"
+MATCH_THRESHOLD = 0.1
+LOG_FIELDS = ("query", "question", "text", "content")
+SECTION_TITLE = re.compile(r"^\d{1,3}\.\d")
+PAGE_SIZE = 1000
+
+
+def query_key(text: str) -> str:
+    """Same normalization as query_cache_key() in SQL."""
+    return re.sub(r"[\s?!.]+$", "", re.sub(r"\s+", " ", text).strip().lower())
+
+
+def read_log(path: Path) -> Counter:
+    """Question -> number of times it was asked."""
+    counts: Counter = Counter()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            count = 1
+            if line.startswith("{"):
+                entry = json.loads(line)
+                line = next((entry[field] for field in LOG_FIELDS if entry.get(field)), "")
+                count = int(entry.get("count", 1))
+            if line:
+                counts[line] += count
+    return counts
+
+
+def _walk_titles(node: Dict, regulation: str) -> Iterator[str]:
+    for child in node.get("children", []):
+        title = " ".join((child.get("title") or "").split())
+        if SECTION_TITLE.match(title):
+            yield f"{regulation} {title}"
+        yield from _walk_titles(child, regulation)
+
+
+def section_titles(structure: Path) -> List[str]:
+    """Section titles from the structure shards directory or a combined regulations.json."""
+    if structure.is_dir():
+        index = json.loads((structure / "index.json").read_text(encoding="utf-8"))
+        trees = [json.loads((structure / entry["shard"]).read_text(encoding="utf-8")) for entry in index]
+    else:
+        trees = json.loads(structure.read_text(encoding="utf-8"))
+    return [title for tree in trees for title in _walk_titles(tree, tree["id"])]
+
+
+def collect_questions(logs: List[Path], structure: Optional[Path]) -> Tuple[List[str], int]:
+    """Deduplicated questions (log by frequency, then titles) and how many came from the logs."""
+    counts: Counter = Counter()
+    for path in logs:
+        counts.update(read_log(path))
+    questions, seen = [], set()
+    for text, _ in counts.most_common():
+        key = query_key(text)
+        if key and key not in seen:
+            seen.add(key)
+            questions.append(text)
+    from_log = len(questions)
+    for text in section_titles(structure) if structure else []:
+        key = query_key(text)
+        if key and key not in seen:
+            seen.add(key)
+            questions.append(text)
+    return questions, from_log
+
+
+def prune_expired(supabase) -> int:
+    now = datetime.now(timezone.utc).isoformat()
+    deleted = supabase.table("query_cache").delete().lte("expires_at", now).execute().data or []
+    return len(deleted)
+
+
+def fresh_keys(supabase, model: str, match_count: int) -> Set[str]:
+    """query_keys already cached for the current corpus version, paging by key."""
+    version = supabase.table("query_cache_state").select("corpus_version").execute().data[0]["corpus_version"]
+    now = datetime.now(timezone.utc).isoformat()
+    keys: Set[str] = set()
+    last = ""
+    while True:
+        page = (
+            supabase.table("query_cache")
+            .select("query_key")
+            .eq("model", model)
+            .eq("top_k", match_count)
+            .eq("corpus_version", version)
+            .gt("expires_at", now)
+            .gt("query_key", last)
+            .order("query_key")
+            .limit(PAGE_SIZE)
+            .execute()
+        ).data or []
+        keys.update(row["query_key"] for row in page)
+        if len(page) < PAGE_SIZE:
+            return keys
+        last = page[-1]["query_key"]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", type=Path, action="append", default=[], metavar="PATH",
+                        help="Query log, plain text or JSONL (repeatable)")
+    parser.add_argument("--structure", type=Path, default=STRUCTURE_DIR,
+                        help="Structure shards directory or a combined regulations.json")
+    parser.add_argument("--no-titles", action="store_true", help="Only warm the questions from --log")
+    parser.add_argument("--match-count", default=MATCH_COUNTS,
+                        help=f"match_count values to warm (default: {MATCH_COUNTS})")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD,
+                        help=f"match_threshold (default: {MATCH_THRESHOLD}, as the app)")
+    parser.add_argument("--ttl-days", type=float, default=7, help="Lifetime of the warmed entries (default: 7)")
+    parser.add_argument("--limit", type=int, default=0, help="Warm at most this many questions (default: all)")
+    parser.add_argument("--rpc-batch", type=int, default=25, help="Questions per query_cache_warm call (default: 25)")
+    parser.add_argument("--dry-run", action="store_true", help="List what would be warmed; no embeddings or writes")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    structure = None if args.no_titles else args.structure
+    if structure and not structure.exists():
+        print(f"No structure data at {structure}; run generate_structure.py or pass --no-titles")
+        structure = None
+    questions, from_log = collect_questions(args.log, structure)
+    if args.limit:
+        questions = questions[:args.limit]
+    match_counts = sorted({int(c) for c in args.match_count.split(",") if c.strip()})
+    print(f"{len(questions)} questions ({min(from_log, len(questions))} from query logs, "
+          f"{max(0, len(questions) - from_log)} section titles), match_count {match_counts}")
+
+    if args.dry_run:
+        for text in questions[:20]:
+            print(f"  {text}")
+        if len(questions) > 20:
+            print(f"  ... and {len(questions) - 20} more")
+        return 0
+
+    if not SUPABASE_URL or not SUPABASE_KEY or not OPENROUTER_API_KEY:
+        print("Error: SUPABASE_URL, SUPABASE_KEY and OPENROUTER_API_KEY required in .env")
+        return 1
+
+    import async_clients
+    from embedding_batcher import EmbeddingBatcher, create_embedding_client
+    from embedding_cache import shared_cache
+
+    t0 = time.perf_counter()
+    supabase = create_supabase_client()
+    model = f"{EMBEDDING_MODEL}:{EMBEDDING_DIM}"
+    print(f"Deleted {prune_expired(supabase)} expired entries.")
+
+    pending = {}
+    for count in match_counts:
+        cached = fresh_keys(supabase, model, count)
+        pending[count] = [q for q in questions if query_key(q) not in cached]
+    needed = {q for todo in pending.values() for q in todo}
+    to_embed = [q for q in questions if q in needed]
+    print(f"{len(to_embed)} questions need warming "
+          f"({', '.join(f'{len(todo)} for match_count {count}' for count, todo in pending.items())}).")
+
+    batcher = EmbeddingBatcher(create_embedding_client(OPENROUTER_API_KEY), EMBEDDING_MODEL, EMBEDDING_DIM,
+                               cache=shared_cache())
+    embeddings = dict(zip(to_embed, batcher.embed_texts(to_embed))) if to_embed else {}
+    ttl = f"{args.ttl_days * 86400:.0f} seconds"
+
+    stored = calls = 0
+    try:
+        for count, todo in pending.items():
+            for start in range(0, len(todo), args.rpc_batch):
+                entries = [{"query": q, "embedding": embeddings[q]} for q in todo[start:start + args.rpc_batch]
+                           if embeddings.get(q)]
+                if not entries:
+                    continue
+                stored += supabase.rpc("query_cache_warm", {
+                    "entries": entries,
+                    "embedding_model": model,
+                    "match_threshold": args.threshold,
+                    "match_count": count,
+                    "ttl": ttl,
+                }).execute().data or 0
+                calls += 1
+                print(f"  match_count {count}: {min(start + args.rpc_batch, len(todo))}/{len(todo)}", end="\r")
+            if todo:
+                print()
+    finally:
+        async_clients.close_sessions()
+
+    attempted = sum(len(todo) for todo in pending.values())
+    print(f"Warmed {stored} entries in {calls} RPCs ({attempted - stored} questions without results are not "
+          f"cached); embedded {len(to_embed)} questions in {batcher.requests} requests, "
+          f"{time.perf_counter() - t0:.1f}s.")
+    cache = shared_cache()
+    if cache:
+        print(cache.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+-- HNSW vector index and filtered similarity search for document_chunks.
+--
+-- The original ivfflat index was created with lists = 100 on an empty
+-- table, so its centroids never reflected the loaded corpus. HNSW needs no
+-- training data and keeps its recall as rows are added. Requires pgvector
+-- 0.8.0 or later (for hnsw.iterative_scan).
+--
+-- Building the index on a loaded table can take several minutes; run this
+-- from a direct connection (psql or scripts/vector_index.py) rather than
+-- the SQL editor if it times out. To rebuild ivfflat with lists sized to
+-- the row count instead, run: python scripts/vector_index.py create --kind ivfflat
+
+-- ============================================
+-- FILTER COLUMNS
+-- Regulation and part as real columns so filtered searches can use an index
+-- ============================================
+alter table public.document_chunks
+  add column if not exists regulation text generated always as (metadata->>'regulation') stored;
+
+alter table public.document_chunks
+  add column if not exists part text generated always as (metadata->>'part') stored;
+
+create index if not exists idx_document_chunks_regulation_part
+  on public.document_chunks(regulation, part);
+
+-- ============================================
+-- VECTOR INDEX
+-- ============================================
+drop index if exists public.document_chunks_embedding_idx;
+
+set maintenance_work_mem = '512MB';
+
+create index if not exists document_chunks_embedding_hnsw_idx
+  on public.document_chunks using hnsw (embedding vector_cosine_ops)
+  with (m = 16, ef_construction = 64);
+
+reset maintenance_work_mem;
+
+-- ============================================
+-- SIMILARITY SEARCH FUNCTIONS
+-- ============================================
+
+-- Nearest match_count rows by index order, then the threshold. Rows above
+-- the threshold are always a prefix of that order, so the result is the
+-- same as before, but the distance is computed once per row and the
+-- planner can use the vector index for the ORDER BY ... LIMIT.
+create or replace function match_documents (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      document_chunks.id,
+      document_chunks.content,
+      document_chunks.metadata,
+      1 - (document_chunks.embedding <=> query_embedding) as similarity
+    from document_chunks
+    order by document_chunks.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  order by matches.similarity desc;
+end;
+$$;
+
+-- Same as match_documents, restricted to one regulation (metadata "regulation",
+-- e.g. 'DFARS') and/or part (e.g. '15'). Null filters match everything.
+create or replace function match_documents_filtered (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_regulation text default null,
+  filter_part text default null
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+  -- Keep scanning the HNSW graph until match_count rows pass the filter,
+  -- instead of filtering the first ef_search candidates and returning too few
+  set local hnsw.iterative_scan = relaxed_order;
+
+  return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      document_chunks.id,
+      document_chunks.content,
+      document_chunks.metadata,
+      1 - (document_chunks.embedding <=> query_embedding) as similarity
+    from document_chunks
+    where (filter_regulation is null or document_chunks.regulation = filter_regulation)
+      and (filter_part is null or document_chunks.part = filter_part)
+    order by document_chunks.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  -- relaxed_order can return rows slightly out of order; sort the final set
+  order by matches.similarity desc;
+end;
+$$;
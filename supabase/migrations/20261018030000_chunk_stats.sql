@@ -0,0 +1,36 @@
+-- Per-regulation ingestion statistics in one round trip.
+--
+-- scripts/verify_ingestion.py used to download every row's metadata and
+-- count in Python, which PostgREST's max-rows limit silently truncated.
+
+-- ============================================
+-- INGESTION STATISTICS FUNCTION
+-- ============================================
+-- missing_embeddings excludes near-duplicates, which are stored without
+-- an embedding on purpose and counted in linked_duplicates instead.
+-- duplicate_content counts rows whose exact content appears earlier in
+-- the same regulation.
+create or replace function chunk_stats()
+returns table (
+  regulation text,
+  chunks bigint,
+  missing_embeddings bigint,
+  linked_duplicates bigint,
+  duplicate_content bigint,
+  avg_chars numeric
+)
+language sql
+stable
+set search_path = public
+as $$
+  select
+    coalesce(document_chunks.regulation, 'Unknown') as regulation,
+    count(*) as chunks,
+    count(*) filter (where embedding is null and not coalesce(metadata ? 'duplicate_of', false)) as missing_embeddings,
+    count(*) filter (where metadata ? 'duplicate_of') as linked_duplicates,
+    count(*) - count(distinct md5(coalesce(content, ''))) as duplicate_content,
+    round(avg(length(content)), 1) as avg_chars
+  from document_chunks
+  group by 1
+  order by 1;
+$$;
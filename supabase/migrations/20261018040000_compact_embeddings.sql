@@ -0,0 +1,99 @@
+-- Compact half-precision embeddings and shortlist-then-rescore search.
+--
+-- embedding_compact is the first 512 dimensions of embedding as a halfvec
+-- (2 bytes per dimension). text-embedding-3-small is trained so that a
+-- prefix of its output is itself a usable embedding (it is what the API
+-- returns for dimensions = 512), and cosine distance ignores the missing
+-- normalization. The column is generated, so every ingestion path (REST,
+-- COPY, re-ingestion) fills it without changes, and duplicates stored
+-- without an embedding get none either.
+--
+-- match_documents_compact walks the HNSW index on the compact column for a
+-- shortlist of match_count * shortlist_factor rows, then reorders the
+-- shortlist by the full-precision distance. An HNSW element for a
+-- vector(1536) takes most of an 8 KB index page; a halfvec(512) element is
+-- about a sixth of that, so the compact index fits in far less memory.
+-- Once match_documents_compact is in use, the full-precision index can be
+-- dropped (python scripts/vector_index.py drop --column embedding); the
+-- full vectors stay in the table for rescoring and hybrid_search.
+--
+-- Requires pgvector 0.7.0 or later (halfvec, subvector). Adding a stored
+-- generated column rewrites the table and the index build reads every row;
+-- run this from a direct connection if the SQL editor times out.
+
+-- ============================================
+-- COMPACT EMBEDDING COLUMN
+-- ============================================
+alter table public.document_chunks
+  add column if not exists embedding_compact halfvec(512)
+  generated always as (subvector(embedding, 1, 512)::halfvec(512)) stored;
+
+set maintenance_work_mem = '512MB';
+
+create index if not exists document_chunks_embedding_compact_hnsw_idx
+  on public.document_chunks using hnsw (embedding_compact halfvec_cosine_ops)
+  with (m = 16, ef_construction = 64);
+
+reset maintenance_work_mem;
+
+-- ============================================
+-- SHORTLIST-THEN-RESCORE SEARCH
+-- ============================================
+
+-- Same results contract as match_documents (and match_documents_filtered's
+-- regulation filter). The shortlist is capped at 1000, the largest
+-- hnsw.ef_search pgvector accepts; ef_search is raised to the shortlist
+-- size so the index scan can return all of it.
+create or replace function match_documents_compact (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  shortlist_factor int default 8,
+  filter_regulation text default null
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+declare
+  shortlist int;
+  query_compact halfvec(512);
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+  set local hnsw.iterative_scan = relaxed_order;
+
+  shortlist := least(greatest(match_count * shortlist_factor, match_count), 1000);
+  query_compact := subvector(query_embedding, 1, 512)::halfvec(512);
+  perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+
+  return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      candidates.id,
+      candidates.content,
+      candidates.metadata,
+      1 - (candidates.embedding <=> query_embedding) as similarity
+    from (
+      select
+        document_chunks.id,
+        document_chunks.content,
+        document_chunks.metadata,
+        document_chunks.embedding
+      from document_chunks
+      where filter_regulation is null or document_chunks.regulation = filter_regulation
+      order by document_chunks.embedding_compact <=> query_compact
+      limit shortlist
+    ) candidates
+    order by candidates.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  order by matches.similarity desc;
+end;
+$$;
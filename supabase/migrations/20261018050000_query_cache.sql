@@ -0,0 +1,359 @@
+-- Query result cache for hybrid_search.
+--
+-- Much of the chat traffic repeats a handful of questions. query_cache
+-- stores, per normalized question, embedding model and match_count, the
+-- question's embedding and the ids, similarities, scores and match types
+-- of the chunks hybrid_search returned. A hit skips both the embeddings
+-- API call and the search.
+--
+--   query_cache_lookup(query_text, embedding_model, match_threshold, match_count)
+--     Rows for a cached question, in hybrid_search's shape, or no rows on
+--     a miss. An entry written before the last re-ingestion is re-run
+--     with its stored embedding (no embeddings call) and refreshed.
+--   query_cache_fill(query_text, query_embedding, embedding_model, match_threshold, match_count)
+--     Runs hybrid_search and caches the result; called after a miss.
+--   query_cache_warm(entries, embedding_model, match_threshold, match_count)
+--     query_cache_fill for a batch of {query, embedding}; used by the warmer.
+--   invalidate_query_cache()
+--     Bumps the corpus version. The ingestion scripts call it after a
+--     run that wrote or deleted chunks.
+--   query_cache_report(days)
+--     Entries, staleness and hit rate, for scripts/verify_ingestion.py.
+--
+-- Entries expire after a TTL (7 days by default) whether or not the
+-- corpus changed; scripts/warm_query_cache.py deletes expired entries and
+-- pre-populates the cache from a query log and the section titles.
+--
+-- match_count is part of the key because hybrid_search's candidate pools
+-- grow with it, so the top 5 is not always a prefix of the top 10.
+-- The table is only reachable through the security definer functions
+-- (and the service role); signed-in users can read and fill it but not
+-- overwrite an entry that is still fresh.
+
+-- ============================================
+-- CACHE TABLES
+-- ============================================
+create table if not exists public.query_cache (
+  query_key text not null,
+  model text not null,
+  top_k int not null,
+  query text not null,
+  embedding vector(1536) not null,
+  threshold float not null,
+  chunk_ids bigint[] not null,
+  similarities float[] not null,
+  scores float[] not null,
+  match_types text[] not null,
+  corpus_version bigint not null,
+  source text not null default 'chat',
+  hits bigint not null default 0,
+  created_at timestamptz not null default now(),
+  refreshed_at timestamptz not null default now(),
+  last_hit_at timestamptz,
+  expires_at timestamptz not null,
+  primary key (query_key, model, top_k)
+);
+
+create index if not exists idx_query_cache_expires_at
+  on public.query_cache(expires_at);
+
+-- One row: the version entries are checked against
+create table if not exists public.query_cache_state (
+  id boolean primary key default true check (id),
+  corpus_version bigint not null default 1,
+  invalidated_at timestamptz not null default now()
+);
+
+insert into public.query_cache_state default values on conflict do nothing;
+
+-- Lookups per day; misses are lookups - hits - refreshes
+create table if not exists public.query_cache_stats (
+  day date primary key,
+  lookups bigint not null default 0,
+  hits bigint not null default 0,
+  refreshes bigint not null default 0
+);
+
+alter table public.query_cache enable row level security;
+alter table public.query_cache_state enable row level security;
+alter table public.query_cache_stats enable row level security;
+
+-- ============================================
+-- CACHE FUNCTIONS
+-- ============================================
+
+-- Lowercase, collapse whitespace, drop trailing punctuation. Mirrored by
+-- query_key() in scripts/warm_query_cache.py.
+create or replace function query_cache_key(query_text text)
+returns text
+language sql
+immutable
+as $$
+  select regexp_replace(lower(btrim(regexp_replace(query_text, '\s+', ' ', 'g'))), '[\s?!.]+$', '');
+$$;
+
+-- Cached result arrays joined back to the chunks, in their original order
+create or replace function query_cache_rows (
+  chunk_ids bigint[],
+  similarities float[],
+  scores float[],
+  match_types text[]
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language sql
+stable
+set search_path = public
+as $$
+  select c.id, c.content, c.metadata, r.similarity, r.score, r.match_type
+  from unnest(chunk_ids, similarities, scores, match_types)
+    with ordinality as r(chunk_id, similarity, score, match_type, ord)
+  join document_chunks c on c.id = r.chunk_id
+  order by r.ord;
+$$;
+
+create or replace function query_cache_fill (
+  query_text text,
+  query_embedding vector(1536),
+  embedding_model text,
+  match_threshold float,
+  match_count int,
+  entry_source text default 'chat',
+  ttl interval default interval '7 days'
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+security definer
+as $$
+declare
+  current_version bigint;
+  result_ids bigint[];
+  result_similarities float[];
+  result_scores float[];
+  result_types text[];
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  select s.corpus_version into current_version from query_cache_state s;
+
+  select
+    array_agg(r.id order by r.ord),
+    array_agg(r.similarity order by r.ord),
+    array_agg(r.score order by r.ord),
+    array_agg(r.match_type order by r.ord)
+  into result_ids, result_similarities, result_scores, result_types
+  from hybrid_search(query_text, query_embedding, match_threshold, match_count)
+    with ordinality as r(id, content, metadata, similarity, score, match_type, ord);
+
+  if result_ids is null then
+    return;
+  end if;
+
+  insert into query_cache as q (
+    query_key, model, top_k, query, embedding, threshold, chunk_ids, similarities, scores,
+    match_types, corpus_version, source, expires_at
+  )
+  values (
+    query_cache_key(query_text), embedding_model, match_count, query_text, query_embedding, match_threshold,
+    result_ids, result_similarities, result_scores, result_types, current_version, entry_source, now() + ttl
+  )
+  on conflict (query_key, model, top_k) do update set
+    query = excluded.query,
+    embedding = excluded.embedding,
+    threshold = excluded.threshold,
+    chunk_ids = excluded.chunk_ids,
+    similarities = excluded.similarities,
+    scores = excluded.scores,
+    match_types = excluded.match_types,
+    corpus_version = excluded.corpus_version,
+    refreshed_at = now(),
+    expires_at = excluded.expires_at
+  -- A fresh entry is only replaced once it is stale, expired or for another threshold
+  where q.corpus_version <> excluded.corpus_version
+    or q.expires_at <= now()
+    or q.threshold <> excluded.threshold;
+
+  return query
+  select * from query_cache_rows(result_ids, result_similarities, result_scores, result_types);
+end;
+$$;
+
+create or replace function query_cache_lookup (
+  query_text text,
+  embedding_model text,
+  match_threshold float,
+  match_count int
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+security definer
+as $$
+declare
+  current_version bigint;
+  entry query_cache%rowtype;
+  outcome text := 'miss';
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  select s.corpus_version into current_version from query_cache_state s;
+
+  select * into entry
+  from query_cache q
+  where q.query_key = query_cache_key(query_text)
+    and q.model = embedding_model
+    and q.top_k = match_count
+    and q.expires_at > now();
+
+  if found then
+    update query_cache q set hits = q.hits + 1, last_hit_at = now()
+    where q.query_key = entry.query_key and q.model = entry.model and q.top_k = entry.top_k;
+
+    if entry.corpus_version = current_version and entry.threshold = match_threshold then
+      outcome := 'hit';
+      return query
+      select * from query_cache_rows(entry.chunk_ids, entry.similarities, entry.scores, entry.match_types);
+    else
+      -- Re-ingested since (or another threshold): search again with the stored embedding
+      outcome := 'refresh';
+      return query
+      select * from query_cache_fill(entry.query, entry.embedding, embedding_model, match_threshold, match_count,
+                                     entry.source);
+    end if;
+  end if;
+
+  insert into query_cache_stats as s (day, lookups, hits, refreshes)
+  values (current_date, 1, (outcome = 'hit')::int, (outcome = 'refresh')::int)
+  on conflict (day) do update set
+    lookups = s.lookups + 1,
+    hits = s.hits + excluded.hits,
+    refreshes = s.refreshes + excluded.refreshes;
+end;
+$$;
+
+-- Batch fill for scripts/warm_query_cache.py: entries is a JSON array of
+-- {"query": text, "embedding": [1536 floats]}. Returns how many were stored
+-- (questions without results are not cached).
+create or replace function query_cache_warm (
+  entries jsonb,
+  embedding_model text,
+  match_threshold float,
+  match_count int,
+  ttl interval default interval '7 days'
+)
+returns int
+language plpgsql
+security definer
+as $$
+declare
+  entry jsonb;
+  stored int := 0;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  for entry in select * from jsonb_array_elements(entries) loop
+    perform 1
+    from query_cache_fill(entry->>'query', (entry->>'embedding')::vector(1536), embedding_model,
+                          match_threshold, match_count, 'warmer', ttl);
+    if found then
+      stored := stored + 1;
+    end if;
+  end loop;
+  return stored;
+end;
+$$;
+
+create or replace function invalidate_query_cache()
+returns bigint
+language sql
+security definer
+set search_path = public
+as $$
+  update query_cache_state
+  set corpus_version = corpus_version + 1, invalidated_at = now()
+  returning corpus_version;
+$$;
+
+-- stale: entries written before the last invalidation (refreshed on their
+-- next lookup); expired: past their TTL (deleted by the warmer).
+create or replace function query_cache_report(days int default 7)
+returns table (
+  entries bigint,
+  fresh bigint,
+  stale bigint,
+  expired bigint,
+  warmed bigint,
+  oldest_fresh timestamptz,
+  corpus_version bigint,
+  invalidated_at timestamptz,
+  lookups bigint,
+  hits bigint,
+  refreshes bigint
+)
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  with state as (
+    select s.corpus_version, s.invalidated_at from query_cache_state s
+  ),
+  entries as (
+    select
+      count(*) as entries,
+      count(*) filter (where q.expires_at > now() and q.corpus_version = state.corpus_version) as fresh,
+      count(*) filter (where q.expires_at > now() and q.corpus_version <> state.corpus_version) as stale,
+      count(*) filter (where q.expires_at <= now()) as expired,
+      count(*) filter (where q.source = 'warmer') as warmed,
+      min(q.refreshed_at) filter (where q.expires_at > now() and q.corpus_version = state.corpus_version) as oldest_fresh
+    from query_cache q cross join state
+  ),
+  recent as (
+    select
+      coalesce(sum(st.lookups), 0)::bigint as lookups,
+      coalesce(sum(st.hits), 0)::bigint as hits,
+      coalesce(sum(st.refreshes), 0)::bigint as refreshes
+    from query_cache_stats st
+    where st.day > current_date - days
+  )
+  select
+    entries.entries, entries.fresh, entries.stale, entries.expired, entries.warmed, entries.oldest_fresh,
+    state.corpus_version, state.invalidated_at,
+    recent.lookups, recent.hits, recent.refreshes
+  from entries, state, recent;
+$$;
+
+-- Signed-in users read and fill the cache; only the service role
+-- (ingestion, the warmer) invalidates it
+revoke execute on function query_cache_lookup(text, text, float, int) from public, anon;
+revoke execute on function query_cache_fill(text, vector, text, float, int, text, interval) from public, anon;
+revoke execute on function invalidate_query_cache() from public, anon, authenticated;
+revoke execute on function query_cache_warm(jsonb, text, float, int, interval) from public, anon, authenticated;
+revoke execute on function query_cache_report(int) from public, anon, authenticated;
+grant execute on function query_cache_lookup(text, text, float, int) to authenticated, service_role;
+grant execute on function query_cache_fill(text, vector, text, float, int, text, interval) to authenticated, service_role;
+grant execute on function invalidate_query_cache() to service_role;
+grant execute on function query_cache_warm(jsonb, text, float, int, interval) to service_role;
+grant execute on function query_cache_report(int) to service_role;
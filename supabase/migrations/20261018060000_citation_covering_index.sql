@@ -0,0 +1,182 @@
+-- Answer hybrid_search's citation lookup from a covering index.
+--
+-- idx_document_chunks_citation_key on (citation_key, id) claimed to make
+-- the key lookup index-only, but the lookup also filtered on regulation
+-- and sorted on metadata->>'chunk_index', so every candidate row was read
+-- from the heap. It also returned content, metadata and the embedding
+-- distance, which no index can cover.
+--
+-- chunk_index becomes a stored column, and the lookup is split: the rows
+-- to return are chosen from (citation_key, chunk_index, id) include
+-- (regulation) by an index-only scan, and only those match_count rows are
+-- then fetched from the heap. The scan stays index-only while the
+-- visibility map is current (autovacuum, or VACUUM after a bulk load).
+
+-- ============================================
+-- LOOKUP COLUMN AND INDEX
+-- ============================================
+alter table public.document_chunks
+  add column if not exists chunk_index int generated always as ((metadata->>'chunk_index')::int) stored;
+
+create index if not exists idx_document_chunks_citation_covering
+  on public.document_chunks(citation_key, chunk_index, id) include (regulation);
+
+drop index if exists public.idx_document_chunks_citation_key;
+
+-- ============================================
+-- HYBRID SEARCH FUNCTION
+-- ============================================
+
+-- 1. Citations in query_text ("FAR 52.212-4", "DFARS Part 225", same
+--    patterns as scripts/citations.py) are looked up by citation_key.
+-- 2. Otherwise, bare section numbers ("52.212-4", "15.404-1") are looked
+--    up by section, FAR first.
+-- 3. Otherwise, or if no chunk has the cited key, full-text and vector
+--    rankings are fused with reciprocal rank fusion. ts_rank_cd with
+--    length normalization stands in for BM25. Vector matches must pass
+--    match_threshold; full-text matches are kept regardless.
+-- match_type is 'citation', 'section', 'hybrid', 'lexical' or 'semantic'.
+create or replace function hybrid_search (
+  query_text text,
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_regulation text default null,
+  full_text_weight float default 1,
+  semantic_weight float default 1,
+  rrf_k int default 50
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+as $$
+declare
+  cited_keys text[];
+  cited_sections text[];
+  ts_query tsquery;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+  set local hnsw.iterative_scan = relaxed_order;
+
+  select array_agg(k order by first_pos) into cited_keys
+  from (
+    select k, min(n) as first_pos
+    from (
+      select
+        case upper(regexp_replace(m[1], '\s+', ' ', 'g'))
+          when 'DFARSPGI' then 'PGI'
+          when 'DFARS PGI' then 'PGI'
+          when 'VA' then 'VAAR'
+          else upper(regexp_replace(m[1], '\s+', ' ', 'g'))
+        end || ' ' || m[2] as k,
+        n
+      from regexp_matches(
+        query_text,
+        '\m(DFARS\s+PGI|DFARSPGI|TRANSFAR|DAFFARS|SOFARS|NMCARS|DFARS|AFARS|DOLAR|DOSAR|EPAAR|HHSAR|HUDAR|LIFAR|NRCAR|AIDAR|GSAM|DARS|DLAD|EDAR|HSAR|IAAR|DEAR|DIAR|AGAR|VAAR|FAR|PGI|JAR|NFS|TAR|CAR)'
+        '\s*(?:(?:Part|Subpart|Section|§)\s*)?([0-9]{1,3}(?:\.[0-9]{1,4}(?:-[0-9]{1,4})?)?)(?![0-9]|[.-][0-9])',
+        'gi'
+      ) with ordinality as matches(m, n)
+    ) found
+    group by k
+  ) keys;
+
+  if cited_keys is not null then
+    -- Pick the rows from the covering index, then read content and
+    -- embeddings for those match_count rows only
+    return query
+    with hits as (
+      select c.id, c.citation_key, c.chunk_index
+      from document_chunks c
+      where c.citation_key = any(cited_keys)
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by array_position(cited_keys, c.citation_key), c.chunk_index, c.id
+      limit match_count
+    )
+    select
+      c.id, c.content, c.metadata,
+      1 - (c.embedding <=> query_embedding) as similarity,
+      1.0::float as score,
+      'citation'::text as match_type
+    from hits
+    join document_chunks c on c.id = hits.id
+    order by array_position(cited_keys, hits.citation_key), hits.chunk_index, hits.id;
+    if found then
+      return;
+    end if;
+  else
+    select array_agg(distinct m[1]) into cited_sections
+    from regexp_matches(
+      query_text, '(?:^|[^0-9.])([0-9]{1,3}\.[0-9]{3,4}(?:-[0-9]{1,4})?)(?![0-9]|[.-][0-9])', 'g'
+    ) as m;
+
+    if cited_sections is not null then
+      return query
+      select
+        c.id, c.content, c.metadata,
+        1 - (c.embedding <=> query_embedding) as similarity,
+        1.0::float as score,
+        'section'::text as match_type
+      from document_chunks c
+      where c.section = any(cited_sections)
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by array_position(cited_sections, c.section), c.regulation <> 'FAR', c.regulation,
+        (c.metadata->>'chunk_index')::int, c.id
+      limit match_count;
+      if found then
+        return;
+      end if;
+    end if;
+  end if;
+
+  ts_query := websearch_to_tsquery('english', query_text);
+
+  return query
+  with full_text as (
+    select
+      c.id,
+      row_number() over (order by ts_rank_cd(c.fts, ts_query, 1) desc) as rank_ix
+    from document_chunks c
+    where c.fts @@ ts_query
+      -- Near-duplicates (stored without an embedding) would crowd out distinct sections
+      and c.embedding is not null
+      and (filter_regulation is null or c.regulation = filter_regulation)
+    order by rank_ix
+    limit match_count * 4
+  ),
+  semantic as (
+    select
+      c.id,
+      row_number() over (order by c.embedding <=> query_embedding) as rank_ix
+    from document_chunks c
+    where query_embedding is not null
+      and (filter_regulation is null or c.regulation = filter_regulation)
+    order by c.embedding <=> query_embedding
+    limit match_count * 4
+  )
+  select
+    c.id, c.content, c.metadata,
+    1 - (c.embedding <=> query_embedding) as similarity,
+    (coalesce(1.0 / (rrf_k + full_text.rank_ix), 0.0) * full_text_weight +
+     coalesce(1.0 / (rrf_k + semantic.rank_ix), 0.0) * semantic_weight)::float as score,
+    case
+      when full_text.id is not null and semantic.id is not null then 'hybrid'
+      when full_text.id is not null then 'lexical'
+      else 'semantic'
+    end as match_type
+  from full_text
+  full outer join semantic on full_text.id = semantic.id
+  join document_chunks c on c.id = coalesce(full_text.id, semantic.id)
+  where full_text.id is not null
+    or 1 - (c.embedding <=> query_embedding) > match_threshold
+  -- By position: a bare "score" would be ambiguous with the output column
+  order by 5 desc
+  limit match_count;
+end;
+$$;
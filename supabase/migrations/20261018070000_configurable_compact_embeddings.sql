@@ -0,0 +1,313 @@
+-- Configurable compact prefix, and no search left on the full-precision index.
+--
+-- 20261018040000_compact_embeddings.sql fixed the prefix at 512 dimensions
+-- and only added storage: hybrid_search, which the app calls, still ranked
+-- on the full-precision HNSW index, so both indexes had to be kept.
+--
+-- - The prefix length comes from the farchat.compact_dims setting (default
+--   512), checked against the embedding column's dimensions (EMBEDDING_DIM):
+--       set farchat.compact_dims = '256';   -- then run this file
+--   Running it again with a different value rebuilds the column and index.
+-- - compact_dims() reads the length back from the column, so the search
+--   functions follow whatever the column holds.
+-- - hybrid_search's vector ranking now shortlists on embedding_compact and
+--   rescores with the full vectors, like match_documents_compact. Only
+--   match_documents and match_documents_filtered (used by the eval and
+--   verify scripts) still order on the full vectors, so the
+--   full-precision index is optional; drop it to get the saving:
+--       python scripts/vector_index.py drop --column embedding
+--
+-- Estimated storage per row (pgvector layout, m = 16; measure yours with
+-- vector_index.py status):
+--                                 vectors    HNSW indexes   total
+--   full index only (before)      6,152 B    8,192 B        14,344 B
+--   + 512-dim compact, both       7,184 B    9,557 B        16,741 B  (+17%)
+--   512-dim compact only          7,184 B    1,365 B         8,549 B  (-40%)
+--   256-dim compact only          6,672 B      819 B         7,491 B  (-48%)
+
+-- ============================================
+-- COMPACT EMBEDDING COLUMN
+-- ============================================
+do $$
+declare
+  dims int := coalesce(nullif(current_setting('farchat.compact_dims', true), ''), '512')::int;
+  full_dims int;
+  current_dims int;
+begin
+  select atttypmod into full_dims
+  from pg_attribute
+  where attrelid = 'public.document_chunks'::regclass and attname = 'embedding' and not attisdropped;
+  if dims < 1 or (full_dims > 0 and dims > full_dims) then
+    raise exception 'farchat.compact_dims must be between 1 and % (the embedding dimensions), got %', full_dims, dims;
+  end if;
+
+  select atttypmod into current_dims
+  from pg_attribute
+  where attrelid = 'public.document_chunks'::regclass and attname = 'embedding_compact' and not attisdropped;
+  if current_dims is distinct from dims then
+    drop index if exists public.document_chunks_embedding_compact_hnsw_idx;
+    alter table public.document_chunks drop column if exists embedding_compact;
+    execute format(
+      'alter table public.document_chunks add column embedding_compact halfvec(%s) '
+      'generated always as (subvector(embedding, 1, %s)::halfvec(%s)) stored',
+      dims, dims, dims
+    );
+  end if;
+end;
+$$;
+
+set maintenance_work_mem = '512MB';
+
+create index if not exists document_chunks_embedding_compact_hnsw_idx
+  on public.document_chunks using hnsw (embedding_compact halfvec_cosine_ops)
+  with (m = 16, ef_construction = 64);
+
+reset maintenance_work_mem;
+
+-- Dimensions of embedding_compact, from the column's type
+create or replace function compact_dims()
+returns int
+language sql
+stable
+set search_path = public
+as $$
+  select atttypmod
+  from pg_attribute
+  where attrelid = 'public.document_chunks'::regclass
+    and attname = 'embedding_compact'
+    and not attisdropped;
+$$;
+
+-- ============================================
+-- SHORTLIST-THEN-RESCORE SEARCH
+-- ============================================
+
+-- Same results contract as match_documents (and match_documents_filtered's
+-- regulation filter). The shortlist is capped at 1000, the largest
+-- hnsw.ef_search pgvector accepts; ef_search is raised to the shortlist
+-- size so the index scan can return all of it.
+create or replace function match_documents_compact (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  shortlist_factor int default 8,
+  filter_regulation text default null
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+declare
+  shortlist int;
+  query_compact halfvec;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+  set local hnsw.iterative_scan = relaxed_order;
+
+  shortlist := least(greatest(match_count * shortlist_factor, match_count), 1000);
+  query_compact := subvector(query_embedding, 1, compact_dims())::halfvec;
+  perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+
+  return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      candidates.id,
+      candidates.content,
+      candidates.metadata,
+      1 - (candidates.embedding <=> query_embedding) as similarity
+    from (
+      select
+        document_chunks.id,
+        document_chunks.content,
+        document_chunks.metadata,
+        document_chunks.embedding
+      from document_chunks
+      where filter_regulation is null or document_chunks.regulation = filter_regulation
+      order by document_chunks.embedding_compact <=> query_compact
+      limit shortlist
+    ) candidates
+    order by candidates.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  order by matches.similarity desc;
+end;
+$$;
+
+-- ============================================
+-- HYBRID SEARCH FUNCTION
+-- ============================================
+
+-- 1. Citations in query_text ("FAR 52.212-4", "DFARS Part 225", same
+--    patterns as scripts/citations.py) are looked up by citation_key.
+-- 2. Otherwise, bare section numbers ("52.212-4", "15.404-1") are looked
+--    up by section, FAR first.
+-- 3. Otherwise, or if no chunk has the cited key, full-text and vector
+--    rankings are fused with reciprocal rank fusion. ts_rank_cd with
+--    length normalization stands in for BM25. The vector ranking is
+--    shortlisted on embedding_compact and rescored at full precision.
+--    Vector matches must pass match_threshold; full-text matches are kept
+--    regardless.
+-- match_type is 'citation', 'section', 'hybrid', 'lexical' or 'semantic'.
+create or replace function hybrid_search (
+  query_text text,
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_regulation text default null,
+  full_text_weight float default 1,
+  semantic_weight float default 1,
+  rrf_k int default 50
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+as $$
+declare
+  cited_keys text[];
+  cited_sections text[];
+  ts_query tsquery;
+  query_compact halfvec;
+  shortlist int;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+  set local hnsw.iterative_scan = relaxed_order;
+
+  select array_agg(k order by first_pos) into cited_keys
+  from (
+    select k, min(n) as first_pos
+    from (
+      select
+        case upper(regexp_replace(m[1], '\s+', ' ', 'g'))
+          when 'DFARSPGI' then 'PGI'
+          when 'DFARS PGI' then 'PGI'
+          when 'VA' then 'VAAR'
+          else upper(regexp_replace(m[1], '\s+', ' ', 'g'))
+        end || ' ' || m[2] as k,
+        n
+      from regexp_matches(
+        query_text,
+        '\m(DFARS\s+PGI|DFARSPGI|TRANSFAR|DAFFARS|SOFARS|NMCARS|DFARS|AFARS|DOLAR|DOSAR|EPAAR|HHSAR|HUDAR|LIFAR|NRCAR|AIDAR|GSAM|DARS|DLAD|EDAR|HSAR|IAAR|DEAR|DIAR|AGAR|VAAR|FAR|PGI|JAR|NFS|TAR|CAR)'
+        '\s*(?:(?:Part|Subpart|Section|§)\s*)?([0-9]{1,3}(?:\.[0-9]{1,4}(?:-[0-9]{1,4})?)?)(?![0-9]|[.-][0-9])',
+        'gi'
+      ) with ordinality as matches(m, n)
+    ) found
+    group by k
+  ) keys;
+
+  if cited_keys is not null then
+    -- Pick the rows from the covering index, then read content and
+    -- embeddings for those match_count rows only
+    return query
+    with hits as (
+      select c.id, c.citation_key, c.chunk_index
+      from document_chunks c
+      where c.citation_key = any(cited_keys)
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by array_position(cited_keys, c.citation_key), c.chunk_index, c.id
+      limit match_count
+    )
+    select
+      c.id, c.content, c.metadata,
+      1 - (c.embedding <=> query_embedding) as similarity,
+      1.0::float as score,
+      'citation'::text as match_type
+    from hits
+    join document_chunks c on c.id = hits.id
+    order by array_position(cited_keys, hits.citation_key), hits.chunk_index, hits.id;
+    if found then
+      return;
+    end if;
+  else
+    select array_agg(distinct m[1]) into cited_sections
+    from regexp_matches(
+      query_text, '(?:^|[^0-9.])([0-9]{1,3}\.[0-9]{3,4}(?:-[0-9]{1,4})?)(?![0-9]|[.-][0-9])', 'g'
+    ) as m;
+
+    if cited_sections is not null then
+      return query
+      select
+        c.id, c.content, c.metadata,
+        1 - (c.embedding <=> query_embedding) as similarity,
+        1.0::float as score,
+        'section'::text as match_type
+      from document_chunks c
+      where c.section = any(cited_sections)
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by array_position(cited_sections, c.section), c.regulation <> 'FAR', c.regulation,
+        (c.metadata->>'chunk_index')::int, c.id
+      limit match_count;
+      if found then
+        return;
+      end if;
+    end if;
+  end if;
+
+  ts_query := websearch_to_tsquery('english', query_text);
+  -- Same shortlist-then-rescore as match_documents_compact, at its default factor of 8
+  shortlist := least(match_count * 4 * 8, 1000);
+  query_compact := subvector(query_embedding, 1, compact_dims())::halfvec;
+  perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+
+  return query
+  with full_text as (
+    select
+      c.id,
+      row_number() over (order by ts_rank_cd(c.fts, ts_query, 1) desc) as rank_ix
+    from document_chunks c
+    where c.fts @@ ts_query
+      -- Near-duplicates (stored without an embedding) would crowd out distinct sections
+      and c.embedding is not null
+      and (filter_regulation is null or c.regulation = filter_regulation)
+    order by rank_ix
+    limit match_count * 4
+  ),
+  semantic as (
+    select
+      candidates.id,
+      row_number() over (order by candidates.embedding <=> query_embedding) as rank_ix
+    from (
+      -- Shortlisted on the compact index, so no search needs the full-precision one
+      select c.id, c.embedding
+      from document_chunks c
+      where query_compact is not null
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by c.embedding_compact <=> query_compact
+      limit shortlist
+    ) candidates
+    order by candidates.embedding <=> query_embedding
+    limit match_count * 4
+  )
+  select
+    c.id, c.content, c.metadata,
+    1 - (c.embedding <=> query_embedding) as similarity,
+    (coalesce(1.0 / (rrf_k + full_text.rank_ix), 0.0) * full_text_weight +
+     coalesce(1.0 / (rrf_k + semantic.rank_ix), 0.0) * semantic_weight)::float as score,
+    case
+      when full_text.id is not null and semantic.id is not null then 'hybrid'
+      when full_text.id is not null then 'lexical'
+      else 'semantic'
+    end as match_type
+  from full_text
+  full outer join semantic on full_text.id = semantic.id
+  join document_chunks c on c.id = coalesce(full_text.id, semantic.id)
+  where full_text.id is not null
+    or 1 - (c.embedding <=> query_embedding) > match_threshold
+  -- By position: a bare "score" would be ambiguous with the output column
+  order by 5 desc
+  limit match_count;
+end;
+$$;
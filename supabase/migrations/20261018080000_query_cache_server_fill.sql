@@ -0,0 +1,105 @@
+-- Only the server fills the query cache, and the lookup counters are sharded.
+--
+-- query_cache_fill was granted to authenticated, so any signed-in user
+-- could call it through PostgREST with a vector of their choosing and
+-- store the results under a real question's key: every other user asking
+-- that question would then get them. Fill is now service_role only. The
+-- app fills on a miss from the server with the embedding it computed
+-- (app/src/lib/search.ts), and the warmer already ran as the service
+-- role. Signed-in users keep query_cache_lookup, which takes no vector; it
+-- only re-runs a stale entry with the embedding and threshold the server
+-- stored. An entry cached at a different threshold is now a miss rather
+-- than a refresh, which would have let any caller rewrite it.
+--
+-- query_cache_stats had one row per day, which every lookup updated, so
+-- concurrent lookups queued on that row lock. It now has 16 rows per day
+-- (shard = backend pid % 16); query_cache_report already sums by day. The
+-- per-entry hit counter is written at most once a minute for the same
+-- reason.
+
+-- ============================================
+-- SHARDED LOOKUP STATISTICS
+-- ============================================
+alter table public.query_cache_stats
+  add column if not exists shard smallint not null default 0;
+
+alter table public.query_cache_stats drop constraint if exists query_cache_stats_pkey;
+alter table public.query_cache_stats add primary key (day, shard);
+
+-- ============================================
+-- LOOKUP FUNCTION
+-- ============================================
+create or replace function query_cache_lookup (
+  query_text text,
+  embedding_model text,
+  match_threshold float,
+  match_count int
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+security definer
+as $$
+declare
+  current_version bigint;
+  entry query_cache%rowtype;
+  outcome text := 'miss';
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  select s.corpus_version into current_version from query_cache_state s;
+
+  select * into entry
+  from query_cache q
+  where q.query_key = query_cache_key(query_text)
+    and q.model = embedding_model
+    and q.top_k = match_count
+    and q.expires_at > now();
+
+  -- An entry cached at another threshold is a miss: signed-in users can't
+  -- fill, so a lookup must not rewrite a shared entry on their terms. The
+  -- server's fill after the miss replaces it.
+  if found and entry.threshold = match_threshold then
+    -- At most one write per entry per minute, so a popular question doesn't
+    -- serialize its lookups on the entry's row; hits counts those minutes
+    if entry.last_hit_at is null or entry.last_hit_at < now() - interval '1 minute' then
+      update query_cache q set hits = q.hits + 1, last_hit_at = now()
+      where q.query_key = entry.query_key and q.model = entry.model and q.top_k = entry.top_k
+        and (q.last_hit_at is null or q.last_hit_at < now() - interval '1 minute');
+    end if;
+
+    if entry.corpus_version = current_version then
+      outcome := 'hit';
+      return query
+      select * from query_cache_rows(entry.chunk_ids, entry.similarities, entry.scores, entry.match_types);
+    else
+      -- Re-ingested since: search again with the stored embedding and threshold
+      outcome := 'refresh';
+      return query
+      select * from query_cache_fill(entry.query, entry.embedding, embedding_model, match_threshold, match_count,
+                                     entry.source);
+    end if;
+  end if;
+
+  -- One of 16 rows per day, picked by backend, so concurrent lookups rarely wait on each other
+  insert into query_cache_stats as s (day, shard, lookups, hits, refreshes)
+  values (current_date, pg_backend_pid() % 16, 1, (outcome = 'hit')::int, (outcome = 'refresh')::int)
+  on conflict (day, shard) do update set
+    lookups = s.lookups + 1,
+    hits = s.hits + excluded.hits,
+    refreshes = s.refreshes + excluded.refreshes;
+end;
+$$;
+
+-- ============================================
+-- PERMISSIONS
+-- ============================================
+revoke execute on function query_cache_fill(text, vector, text, float, int, text, interval) from public, anon, authenticated;
+grant execute on function query_cache_fill(text, vector, text, float, int, text, interval) to service_role;
@@ -0,0 +1,457 @@
+-- Regulation-filtered vector search that narrows by regulation first.
+--
+-- match_documents_filtered, match_documents_compact and hybrid_search
+-- filtered with "filter_regulation is null or regulation = ...". Inside
+-- plpgsql that gets a generic plan, so the (regulation, part) btree was
+-- never used: a "DFARS only" search walked the global HNSW graph with
+-- hnsw.iterative_scan and discarded every FAR row it met, and for a small
+-- supplement it hit hnsw.max_scan_tuples and returned fewer than
+-- match_count rows.
+--
+-- A filtered search now goes through regulation_nearest():
+--
+--   regulation                      path
+--   FAR, DFARS (regulation only)    partial HNSW index on embedding_compact
+--                                   for that regulation, then rescore
+--   every other regulation, and     exact distances over the rows the
+--   any search with a part          (regulation, part) btree selects
+--
+-- FAR and DFARS hold most of the corpus, so an exact scan over either
+-- would compare too many vectors. A supplement or a single part is small
+-- enough to compare exactly, and then always returns match_count rows
+-- when it has them. To move another regulation to an index, create one
+-- named document_chunks_embedding_compact_<regulation, lowercased>_idx
+-- with the same definition; regulation_vector_index() finds it by name.
+-- vector_search_paths() lists each regulation's row count and path.
+--
+-- The partial indexes repeat the compact index entries of FAR and DFARS
+-- rows (about 1.4 KB per row at 512 dimensions). They are dropped with the
+-- column if 20261018070000_configurable_compact_embeddings.sql rebuilds
+-- it, so run this file again after changing farchat.compact_dims.
+-- Unfiltered searches are unchanged.
+
+-- ============================================
+-- PER-REGULATION VECTOR INDEXES
+-- ============================================
+set maintenance_work_mem = '512MB';
+
+create index if not exists document_chunks_embedding_compact_far_idx
+  on public.document_chunks using hnsw (embedding_compact halfvec_cosine_ops)
+  with (m = 16, ef_construction = 64)
+  where regulation = 'FAR';
+
+create index if not exists document_chunks_embedding_compact_dfars_idx
+  on public.document_chunks using hnsw (embedding_compact halfvec_cosine_ops)
+  with (m = 16, ef_construction = 64)
+  where regulation = 'DFARS';
+
+reset maintenance_work_mem;
+
+-- ============================================
+-- REGULATION-FIRST CANDIDATES
+-- ============================================
+-- Partial HNSW index serving one regulation's filtered searches, or null.
+-- Found by name, so adding one for another regulation needs no code change.
+create or replace function regulation_vector_index(regulation text)
+returns regclass
+language sql
+stable
+set search_path = public
+as $$
+  select to_regclass(
+    'public.document_chunks_embedding_compact_'
+      || regexp_replace(lower(regulation), '[^a-z0-9]+', '_', 'g') || '_idx'
+  );
+$$;
+
+-- The candidate_count rows of one regulation (and optionally one part)
+-- nearest to query_embedding, by full-precision distance. The search is
+-- narrowed to the regulation before any vector is compared:
+--   - regulation with a partial index, no part: shortlist on that index
+--     (planned with the regulation as a literal so the planner can match
+--     the index predicate), then rescore with the full vectors;
+--   - otherwise: exact distances over the rows the (regulation, part)
+--     btree selects.
+create or replace function regulation_nearest (
+  query_embedding vector(1536),
+  candidate_count int,
+  filter_regulation text,
+  filter_part text default null,
+  shortlist_factor int default 8
+)
+returns table (
+  id bigint,
+  distance float
+)
+language plpgsql
+as $$
+declare
+  shortlist int;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  if filter_regulation is null then
+    return;
+  end if;
+
+  if filter_part is null and regulation_vector_index(filter_regulation) is not null then
+    shortlist := least(greatest(candidate_count * shortlist_factor, candidate_count), 1000);
+    perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+    return query execute format(
+      'select shortlisted.id, (shortlisted.embedding <=> $1)::float '
+      'from ('
+      '  select c.id, c.embedding from document_chunks c '
+      '  where c.regulation = %L '
+      '  order by c.embedding_compact <=> $2 '
+      '  limit $3'
+      ') shortlisted '
+      'order by 2 '
+      'limit $4',
+      filter_regulation
+    ) using query_embedding, subvector(query_embedding, 1, compact_dims())::halfvec, shortlist, candidate_count;
+    return;
+  end if;
+
+  -- Materialized so the ORDER BY can't be served by the global HNSW index
+  return query
+  with scoped as materialized (
+    select c.id, c.embedding
+    from document_chunks c
+    where c.regulation = filter_regulation
+      and (filter_part is null or c.part = filter_part)
+      and c.embedding is not null
+  )
+  select scoped.id, (scoped.embedding <=> query_embedding)::float
+  from scoped
+  order by 2
+  limit candidate_count;
+end;
+$$;
+
+-- Which path filtered searches take for each regulation, with its row count
+create or replace function vector_search_paths()
+returns table (
+  regulation text,
+  chunks bigint,
+  path text
+)
+language sql
+stable
+set search_path = public
+as $$
+  select
+    d.regulation,
+    count(*) as chunks,
+    coalesce('partial index ' || regulation_vector_index(d.regulation)::text, 'exact scan') as path
+  from document_chunks d
+  where d.regulation is not null
+  group by d.regulation
+  order by 2 desc;
+$$;
+
+-- ============================================
+-- SIMILARITY SEARCH FUNCTIONS
+-- ============================================
+
+-- Same as match_documents, restricted to one regulation (metadata "regulation",
+-- e.g. 'DFARS') and/or part (e.g. '15'). Null filters match everything. A
+-- regulation filter narrows to that regulation's rows first (regulation_nearest).
+create or replace function match_documents_filtered (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_regulation text default null,
+  filter_part text default null
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  if filter_regulation is not null then
+    return query
+    select c.id, c.content, c.metadata, 1 - nearest.distance as similarity
+    from regulation_nearest(query_embedding, match_count, filter_regulation, filter_part) nearest
+    join document_chunks c on c.id = nearest.id
+    where 1 - nearest.distance > match_threshold
+    order by nearest.distance;
+    return;
+  end if;
+
+  -- A part alone spans every regulation: keep scanning the HNSW graph until
+  -- match_count rows pass the filter, instead of filtering the first
+  -- ef_search candidates and returning too few
+  set local hnsw.iterative_scan = relaxed_order;
+
+  return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      document_chunks.id,
+      document_chunks.content,
+      document_chunks.metadata,
+      1 - (document_chunks.embedding <=> query_embedding) as similarity
+    from document_chunks
+    where filter_part is null or document_chunks.part = filter_part
+    order by document_chunks.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  -- relaxed_order can return rows slightly out of order; sort the final set
+  order by matches.similarity desc;
+end;
+$$;
+
+-- Same results contract as match_documents (and match_documents_filtered's
+-- regulation filter). The shortlist is capped at 1000, the largest
+-- hnsw.ef_search pgvector accepts; ef_search is raised to the shortlist
+-- size so the index scan can return all of it. A regulation filter goes
+-- through regulation_nearest with the same shortlist factor.
+create or replace function match_documents_compact (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  shortlist_factor int default 8,
+  filter_regulation text default null
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+declare
+  shortlist int;
+  query_compact halfvec;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  if filter_regulation is not null then
+    return query
+    select c.id, c.content, c.metadata, 1 - nearest.distance as similarity
+    from regulation_nearest(query_embedding, match_count, filter_regulation, null, shortlist_factor) nearest
+    join document_chunks c on c.id = nearest.id
+    where 1 - nearest.distance > match_threshold
+    order by nearest.distance;
+    return;
+  end if;
+
+  shortlist := least(greatest(match_count * shortlist_factor, match_count), 1000);
+  query_compact := subvector(query_embedding, 1, compact_dims())::halfvec;
+  perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+
+  return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      candidates.id,
+      candidates.content,
+      candidates.metadata,
+      1 - (candidates.embedding <=> query_embedding) as similarity
+    from (
+      select
+        document_chunks.id,
+        document_chunks.content,
+        document_chunks.metadata,
+        document_chunks.embedding
+      from document_chunks
+      order by document_chunks.embedding_compact <=> query_compact
+      limit shortlist
+    ) candidates
+    order by candidates.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  order by matches.similarity desc;
+end;
+$$;
+
+-- ============================================
+-- HYBRID SEARCH FUNCTION
+-- ============================================
+
+-- 1. Citations in query_text ("FAR 52.212-4", "DFARS Part 225", same
+--    patterns as scripts/citations.py) are looked up by citation_key.
+-- 2. Otherwise, bare section numbers ("52.212-4", "15.404-1") are looked
+--    up by section, FAR first.
+-- 3. Otherwise, or if no chunk has the cited key, full-text and vector
+--    rankings are fused with reciprocal rank fusion. ts_rank_cd with
+--    length normalization stands in for BM25. The vector ranking is
+--    shortlisted on embedding_compact and rescored at full precision, or
+--    with filter_regulation taken from regulation_nearest.
+--    Vector matches must pass match_threshold; full-text matches are kept
+--    regardless.
+-- match_type is 'citation', 'section', 'hybrid', 'lexical' or 'semantic'.
+create or replace function hybrid_search (
+  query_text text,
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_regulation text default null,
+  full_text_weight float default 1,
+  semantic_weight float default 1,
+  rrf_k int default 50
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+as $$
+declare
+  cited_keys text[];
+  cited_sections text[];
+  ts_query tsquery;
+  query_compact halfvec;
+  shortlist int;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  select array_agg(k order by first_pos) into cited_keys
+  from (
+    select k, min(n) as first_pos
+    from (
+      select
+        case upper(regexp_replace(m[1], '\s+', ' ', 'g'))
+          when 'DFARSPGI' then 'PGI'
+          when 'DFARS PGI' then 'PGI'
+          when 'VA' then 'VAAR'
+          else upper(regexp_replace(m[1], '\s+', ' ', 'g'))
+        end || ' ' || m[2] as k,
+        n
+      from regexp_matches(
+        query_text,
+        '\m(DFARS\s+PGI|DFARSPGI|TRANSFAR|DAFFARS|SOFARS|NMCARS|DFARS|AFARS|DOLAR|DOSAR|EPAAR|HHSAR|HUDAR|LIFAR|NRCAR|AIDAR|GSAM|DARS|DLAD|EDAR|HSAR|IAAR|DEAR|DIAR|AGAR|VAAR|FAR|PGI|JAR|NFS|TAR|CAR)'
+        '\s*(?:(?:Part|Subpart|Section|§)\s*)?([0-9]{1,3}(?:\.[0-9]{1,4}(?:-[0-9]{1,4})?)?)(?![0-9]|[.-][0-9])',
+        'gi'
+      ) with ordinality as matches(m, n)
+    ) found
+    group by k
+  ) keys;
+
+  if cited_keys is not null then
+    -- Pick the rows from the covering index, then read content and
+    -- embeddings for those match_count rows only
+    return query
+    with hits as (
+      select c.id, c.citation_key, c.chunk_index
+      from document_chunks c
+      where c.citation_key = any(cited_keys)
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by array_position(cited_keys, c.citation_key), c.chunk_index, c.id
+      limit match_count
+    )
+    select
+      c.id, c.content, c.metadata,
+      1 - (c.embedding <=> query_embedding) as similarity,
+      1.0::float as score,
+      'citation'::text as match_type
+    from hits
+    join document_chunks c on c.id = hits.id
+    order by array_position(cited_keys, hits.citation_key), hits.chunk_index, hits.id;
+    if found then
+      return;
+    end if;
+  else
+    select array_agg(distinct m[1]) into cited_sections
+    from regexp_matches(
+      query_text, '(?:^|[^0-9.])([0-9]{1,3}\.[0-9]{3,4}(?:-[0-9]{1,4})?)(?![0-9]|[.-][0-9])', 'g'
+    ) as m;
+
+    if cited_sections is not null then
+      return query
+      select
+        c.id, c.content, c.metadata,
+        1 - (c.embedding <=> query_embedding) as similarity,
+        1.0::float as score,
+        'section'::text as match_type
+      from document_chunks c
+      where c.section = any(cited_sections)
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by array_position(cited_sections, c.section), c.regulation <> 'FAR', c.regulation,
+        (c.metadata->>'chunk_index')::int, c.id
+      limit match_count;
+      if found then
+        return;
+      end if;
+    end if;
+  end if;
+
+  ts_query := websearch_to_tsquery('english', query_text);
+  -- Same shortlist-then-rescore as match_documents_compact, at its default factor of 8
+  shortlist := least(match_count * 4 * 8, 1000);
+  query_compact := subvector(query_embedding, 1, compact_dims())::halfvec;
+  perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+
+  return query
+  with full_text as (
+    select
+      c.id,
+      row_number() over (order by ts_rank_cd(c.fts, ts_query, 1) desc) as rank_ix
+    from document_chunks c
+    where c.fts @@ ts_query
+      -- Near-duplicates (stored without an embedding) would crowd out distinct sections
+      and c.embedding is not null
+      and (filter_regulation is null or c.regulation = filter_regulation)
+    order by rank_ix
+    limit match_count * 4
+  ),
+  semantic as (
+    select
+      candidates.id,
+      row_number() over (order by candidates.distance) as rank_ix
+    from (
+      -- Shortlisted on the compact index, so no search needs the full-precision one
+      select shortlisted.id, shortlisted.embedding <=> query_embedding as distance
+      from (
+        select c.id, c.embedding
+        from document_chunks c
+        where query_compact is not null and filter_regulation is null
+        order by c.embedding_compact <=> query_compact
+        limit shortlist
+      ) shortlisted
+      union all
+      -- One regulation: narrowed to its rows first
+      select nearest.id, nearest.distance
+      from regulation_nearest(query_embedding, match_count * 4, filter_regulation) nearest
+      where filter_regulation is not null
+    ) candidates
+    order by candidates.distance
+    limit match_count * 4
+  )
+  select
+    c.id, c.content, c.metadata,
+    1 - (c.embedding <=> query_embedding) as similarity,
+    (coalesce(1.0 / (rrf_k + full_text.rank_ix), 0.0) * full_text_weight +
+     coalesce(1.0 / (rrf_k + semantic.rank_ix), 0.0) * semantic_weight)::float as score,
+    case
+      when full_text.id is not null and semantic.id is not null then 'hybrid'
+      when full_text.id is not null then 'lexical'
+      else 'semantic'
+    end as match_type
+  from full_text
+  full outer join semantic on full_text.id = semantic.id
+  join document_chunks c on c.id = coalesce(full_text.id, semantic.id)
+  where full_text.id is not null
+    or 1 - (c.embedding <=> query_embedding) > match_threshold
+  -- By position: a bare "score" would be ambiguous with the output column
+  order by 5 desc
+  limit match_count;
+end;
+$$;
@@ -80,12 +80,67 @@ create table public.document_chunks (
   content text,
   metadata jsonb,
   embedding vector(1536), -- Match OpenAI text-embedding-3-small dimension
-  created_at timestamptz default now()
+  created_at timestamptz default now(),
+  -- Filter columns for match_documents_filtered
+  regulation text generated always as (metadata->>'regulation') stored,
+  part text generated always as (metadata->>'part') stored,
+  -- Exact-citation and full-text lookups for hybrid_search
+  citation_key text generated always as (metadata->>'citation_key') stored,
+  section text generated always as (metadata->>'section') stored,
+  chunk_index int generated always as ((metadata->>'chunk_index')::int) stored,
+  fts tsvector generated always as (
+    setweight(to_tsvector('english', coalesce(metadata->>'section_title', metadata->>'title', '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(content, '')), 'B')
+  ) stored,
+  -- First 512 dimensions at half precision, for the shortlist searches;
+  -- migrations/20261018070000_configurable_compact_embeddings.sql can change the length
+  embedding_compact halfvec(512) generated always as (subvector(embedding, 1, 512)::halfvec(512)) stored
 );
 
--- Create index for faster vector similarity search
-create index on document_chunks using ivfflat (embedding vector_cosine_ops)
-  with (lists = 100);
+-- HNSW index on the compact prefix (pgvector 0.8.0+). hybrid_search and
+-- match_documents_compact shortlist on it and rescore with the full
+-- vectors. Unlike ivfflat it needs no training data, so it can be created
+-- on the empty table. For a large initial load, ingest_all.py
+-- --defer-index drops it and rebuilds it once the rows are in.
+create index document_chunks_embedding_compact_hnsw_idx
+  on document_chunks using hnsw (embedding_compact halfvec_cosine_ops)
+  with (m = 16, ef_construction = 64);
+
+-- Filtered searches on the largest regulations shortlist on their own
+-- graph instead of discarding other regulations' rows from the global
+-- one; the rest are scanned exactly (see regulation_nearest). Another
+-- regulation is switched over by creating an index with the same naming.
+create index document_chunks_embedding_compact_far_idx
+  on document_chunks using hnsw (embedding_compact halfvec_cosine_ops)
+  with (m = 16, ef_construction = 64)
+  where regulation = 'FAR';
+
+create index document_chunks_embedding_compact_dfars_idx
+  on document_chunks using hnsw (embedding_compact halfvec_cosine_ops)
+  with (m = 16, ef_construction = 64)
+  where regulation = 'DFARS';
+
+-- Optional: only match_documents and match_documents_filtered order on the
+-- full vectors, and this index is about six times the size of the compact
+-- one. Create it if those functions serve traffic:
+--   python scripts/vector_index.py create --column embedding
+-- create index document_chunks_embedding_hnsw_idx
+--   on document_chunks using hnsw (embedding vector_cosine_ops)
+--   with (m = 16, ef_construction = 64);
+
+create index idx_document_chunks_regulation_part
+  on document_chunks(regulation, part);
+
+-- Covers hybrid_search's citation lookup (key, regulation filter and
+-- chunk order), so the rows to return are picked by an index-only scan
+create index idx_document_chunks_citation_covering
+  on document_chunks(citation_key, chunk_index, id) include (regulation);
+
+create index idx_document_chunks_section
+  on document_chunks(section);
+
+create index idx_document_chunks_fts
+  on document_chunks using gin (fts);
 
 -- Enable RLS on chunks
 alter table public.document_chunks enable row level security;
@@ -107,9 +162,13 @@ create policy "Only service role can delete chunks"
   using (auth.role() = 'service_role');
 
 -- ============================================
--- SIMILARITY SEARCH FUNCTION
+-- SIMILARITY SEARCH FUNCTIONS
 -- Used for RAG vector search
 -- ============================================
+-- Nearest match_count rows by index order, then the threshold. Rows above
+-- the threshold are always a prefix of that order, so the distance is
+-- computed once per row and the planner can use the vector index for the
+-- ORDER BY ... LIMIT.
 create or replace function match_documents (
   query_embedding vector(1536),
   match_threshold float,
@@ -128,18 +187,805 @@ begin
   set local search_path = public;
 
   return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      document_chunks.id,
+      document_chunks.content,
+      document_chunks.metadata,
+      1 - (document_chunks.embedding <=> query_embedding) as similarity
+    from document_chunks
+    order by document_chunks.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  order by matches.similarity desc;
+end;
+$$;
+
+-- Same as match_documents, restricted to one regulation (metadata "regulation",
+-- e.g. 'DFARS') and/or part (e.g. '15'). Null filters match everything. A
+-- regulation filter narrows to that regulation's rows first (regulation_nearest).
+create or replace function match_documents_filtered (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_regulation text default null,
+  filter_part text default null
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  if filter_regulation is not null then
+    return query
+    select c.id, c.content, c.metadata, 1 - nearest.distance as similarity
+    from regulation_nearest(query_embedding, match_count, filter_regulation, filter_part) nearest
+    join document_chunks c on c.id = nearest.id
+    where 1 - nearest.distance > match_threshold
+    order by nearest.distance;
+    return;
+  end if;
+
+  -- A part alone spans every regulation: keep scanning the HNSW graph until
+  -- match_count rows pass the filter, instead of filtering the first
+  -- ef_search candidates and returning too few
+  set local hnsw.iterative_scan = relaxed_order;
+
+  return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      document_chunks.id,
+      document_chunks.content,
+      document_chunks.metadata,
+      1 - (document_chunks.embedding <=> query_embedding) as similarity
+    from document_chunks
+    where filter_part is null or document_chunks.part = filter_part
+    order by document_chunks.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  -- relaxed_order can return rows slightly out of order; sort the final set
+  order by matches.similarity desc;
+end;
+$$;
+
+-- Dimensions of embedding_compact, from the column's type
+create or replace function compact_dims()
+returns int
+language sql
+stable
+set search_path = public
+as $$
+  select atttypmod
+  from pg_attribute
+  where attrelid = 'public.document_chunks'::regclass
+    and attname = 'embedding_compact'
+    and not attisdropped;
+$$;
+
+-- Partial HNSW index serving one regulation's filtered searches, or null.
+-- Found by name, so adding one for another regulation needs no code change.
+create or replace function regulation_vector_index(regulation text)
+returns regclass
+language sql
+stable
+set search_path = public
+as $$
+  select to_regclass(
+    'public.document_chunks_embedding_compact_'
+      || regexp_replace(lower(regulation), '[^a-z0-9]+', '_', 'g') || '_idx'
+  );
+$$;
+
+-- The candidate_count rows of one regulation (and optionally one part)
+-- nearest to query_embedding, by full-precision distance. The search is
+-- narrowed to the regulation before any vector is compared:
+--   - regulation with a partial index, no part: shortlist on that index
+--     (planned with the regulation as a literal so the planner can match
+--     the index predicate), then rescore with the full vectors;
+--   - otherwise: exact distances over the rows the (regulation, part)
+--     btree selects.
+create or replace function regulation_nearest (
+  query_embedding vector(1536),
+  candidate_count int,
+  filter_regulation text,
+  filter_part text default null,
+  shortlist_factor int default 8
+)
+returns table (
+  id bigint,
+  distance float
+)
+language plpgsql
+as $$
+declare
+  shortlist int;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  if filter_regulation is null then
+    return;
+  end if;
+
+  if filter_part is null and regulation_vector_index(filter_regulation) is not null then
+    shortlist := least(greatest(candidate_count * shortlist_factor, candidate_count), 1000);
+    perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+    return query execute format(
+      'select shortlisted.id, (shortlisted.embedding <=> $1)::float '
+      'from ('
+      '  select c.id, c.embedding from document_chunks c '
+      '  where c.regulation = %L '
+      '  order by c.embedding_compact <=> $2 '
+      '  limit $3'
+      ') shortlisted '
+      'order by 2 '
+      'limit $4',
+      filter_regulation
+    ) using query_embedding, subvector(query_embedding, 1, compact_dims())::halfvec, shortlist, candidate_count;
+    return;
+  end if;
+
+  -- Materialized so the ORDER BY can't be served by the global HNSW index
+  return query
+  with scoped as materialized (
+    select c.id, c.embedding
+    from document_chunks c
+    where c.regulation = filter_regulation
+      and (filter_part is null or c.part = filter_part)
+      and c.embedding is not null
+  )
+  select scoped.id, (scoped.embedding <=> query_embedding)::float
+  from scoped
+  order by 2
+  limit candidate_count;
+end;
+$$;
+
+-- Which path filtered searches take for each regulation, with its row count
+create or replace function vector_search_paths()
+returns table (
+  regulation text,
+  chunks bigint,
+  path text
+)
+language sql
+stable
+set search_path = public
+as $$
   select
-    document_chunks.id,
-    document_chunks.content,
-    document_chunks.metadata,
-    1 - (document_chunks.embedding <=> query_embedding) as similarity
-  from document_chunks
-  where 1 - (document_chunks.embedding <=> query_embedding) > match_threshold
-  order by document_chunks.embedding <=> query_embedding
+    d.regulation,
+    count(*) as chunks,
+    coalesce('partial index ' || regulation_vector_index(d.regulation)::text, 'exact scan') as path
+  from document_chunks d
+  where d.regulation is not null
+  group by d.regulation
+  order by 2 desc;
+$$;
+
+-- Same results contract as match_documents (and match_documents_filtered's
+-- regulation filter). The shortlist is capped at 1000, the largest
+-- hnsw.ef_search pgvector accepts; ef_search is raised to the shortlist
+-- size so the index scan can return all of it. A regulation filter goes
+-- through regulation_nearest with the same shortlist factor.
+create or replace function match_documents_compact (
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  shortlist_factor int default 8,
+  filter_regulation text default null
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+declare
+  shortlist int;
+  query_compact halfvec;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  if filter_regulation is not null then
+    return query
+    select c.id, c.content, c.metadata, 1 - nearest.distance as similarity
+    from regulation_nearest(query_embedding, match_count, filter_regulation, null, shortlist_factor) nearest
+    join document_chunks c on c.id = nearest.id
+    where 1 - nearest.distance > match_threshold
+    order by nearest.distance;
+    return;
+  end if;
+
+  shortlist := least(greatest(match_count * shortlist_factor, match_count), 1000);
+  query_compact := subvector(query_embedding, 1, compact_dims())::halfvec;
+  perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+
+  return query
+  select matches.id, matches.content, matches.metadata, matches.similarity
+  from (
+    select
+      candidates.id,
+      candidates.content,
+      candidates.metadata,
+      1 - (candidates.embedding <=> query_embedding) as similarity
+    from (
+      select
+        document_chunks.id,
+        document_chunks.content,
+        document_chunks.metadata,
+        document_chunks.embedding
+      from document_chunks
+      order by document_chunks.embedding_compact <=> query_compact
+      limit shortlist
+    ) candidates
+    order by candidates.embedding <=> query_embedding
+    limit match_count
+  ) matches
+  where matches.similarity > match_threshold
+  order by matches.similarity desc;
+end;
+$$;
+
+-- 1. Citations in query_text ("FAR 52.212-4", "DFARS Part 225", same
+--    patterns as scripts/citations.py) are looked up by citation_key.
+-- 2. Otherwise, bare section numbers ("52.212-4", "15.404-1") are looked
+--    up by section, FAR first.
+-- 3. Otherwise, or if no chunk has the cited key, full-text and vector
+--    rankings are fused with reciprocal rank fusion. ts_rank_cd with
+--    length normalization stands in for BM25. The vector ranking is
+--    shortlisted on embedding_compact and rescored at full precision, or
+--    with filter_regulation taken from regulation_nearest.
+--    Vector matches must pass match_threshold; full-text matches are kept
+--    regardless.
+-- match_type is 'citation', 'section', 'hybrid', 'lexical' or 'semantic'.
+create or replace function hybrid_search (
+  query_text text,
+  query_embedding vector(1536),
+  match_threshold float,
+  match_count int,
+  filter_regulation text default null,
+  full_text_weight float default 1,
+  semantic_weight float default 1,
+  rrf_k int default 50
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+as $$
+declare
+  cited_keys text[];
+  cited_sections text[];
+  ts_query tsquery;
+  query_compact halfvec;
+  shortlist int;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  select array_agg(k order by first_pos) into cited_keys
+  from (
+    select k, min(n) as first_pos
+    from (
+      select
+        case upper(regexp_replace(m[1], '\s+', ' ', 'g'))
+          when 'DFARSPGI' then 'PGI'
+          when 'DFARS PGI' then 'PGI'
+          when 'VA' then 'VAAR'
+          else upper(regexp_replace(m[1], '\s+', ' ', 'g'))
+        end || ' ' || m[2] as k,
+        n
+      from regexp_matches(
+        query_text,
+        '\m(DFARS\s+PGI|DFARSPGI|TRANSFAR|DAFFARS|SOFARS|NMCARS|DFARS|AFARS|DOLAR|DOSAR|EPAAR|HHSAR|HUDAR|LIFAR|NRCAR|AIDAR|GSAM|DARS|DLAD|EDAR|HSAR|IAAR|DEAR|DIAR|AGAR|VAAR|FAR|PGI|JAR|NFS|TAR|CAR)'
+        '\s*(?:(?:Part|Subpart|Section|§)\s*)?([0-9]{1,3}(?:\.[0-9]{1,4}(?:-[0-9]{1,4})?)?)(?![0-9]|[.-][0-9])',
+        'gi'
+      ) with ordinality as matches(m, n)
+    ) found
+    group by k
+  ) keys;
+
+  if cited_keys is not null then
+    -- Pick the rows from the covering index, then read content and
+    -- embeddings for those match_count rows only
+    return query
+    with hits as (
+      select c.id, c.citation_key, c.chunk_index
+      from document_chunks c
+      where c.citation_key = any(cited_keys)
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by array_position(cited_keys, c.citation_key), c.chunk_index, c.id
+      limit match_count
+    )
+    select
+      c.id, c.content, c.metadata,
+      1 - (c.embedding <=> query_embedding) as similarity,
+      1.0::float as score,
+      'citation'::text as match_type
+    from hits
+    join document_chunks c on c.id = hits.id
+    order by array_position(cited_keys, hits.citation_key), hits.chunk_index, hits.id;
+    if found then
+      return;
+    end if;
+  else
+    select array_agg(distinct m[1]) into cited_sections
+    from regexp_matches(
+      query_text, '(?:^|[^0-9.])([0-9]{1,3}\.[0-9]{3,4}(?:-[0-9]{1,4})?)(?![0-9]|[.-][0-9])', 'g'
+    ) as m;
+
+    if cited_sections is not null then
+      return query
+      select
+        c.id, c.content, c.metadata,
+        1 - (c.embedding <=> query_embedding) as similarity,
+        1.0::float as score,
+        'section'::text as match_type
+      from document_chunks c
+      where c.section = any(cited_sections)
+        and (filter_regulation is null or c.regulation = filter_regulation)
+      order by array_position(cited_sections, c.section), c.regulation <> 'FAR', c.regulation,
+        (c.metadata->>'chunk_index')::int, c.id
+      limit match_count;
+      if found then
+        return;
+      end if;
+    end if;
+  end if;
+
+  ts_query := websearch_to_tsquery('english', query_text);
+  -- Same shortlist-then-rescore as match_documents_compact, at its default factor of 8
+  shortlist := least(match_count * 4 * 8, 1000);
+  query_compact := subvector(query_embedding, 1, compact_dims())::halfvec;
+  perform set_config('hnsw.ef_search', greatest(shortlist, 40)::text, true);
+
+  return query
+  with full_text as (
+    select
+      c.id,
+      row_number() over (order by ts_rank_cd(c.fts, ts_query, 1) desc) as rank_ix
+    from document_chunks c
+    where c.fts @@ ts_query
+      -- Near-duplicates (stored without an embedding) would crowd out distinct sections
+      and c.embedding is not null
+      and (filter_regulation is null or c.regulation = filter_regulation)
+    order by rank_ix
+    limit match_count * 4
+  ),
+  semantic as (
+    select
+      candidates.id,
+      row_number() over (order by candidates.distance) as rank_ix
+    from (
+      -- Shortlisted on the compact index, so no search needs the full-precision one
+      select shortlisted.id, shortlisted.embedding <=> query_embedding as distance
+      from (
+        select c.id, c.embedding
+        from document_chunks c
+        where query_compact is not null and filter_regulation is null
+        order by c.embedding_compact <=> query_compact
+        limit shortlist
+      ) shortlisted
+      union all
+      -- One regulation: narrowed to its rows first
+      select nearest.id, nearest.distance
+      from regulation_nearest(query_embedding, match_count * 4, filter_regulation) nearest
+      where filter_regulation is not null
+    ) candidates
+    order by candidates.distance
+    limit match_count * 4
+  )
+  select
+    c.id, c.content, c.metadata,
+    1 - (c.embedding <=> query_embedding) as similarity,
+    (coalesce(1.0 / (rrf_k + full_text.rank_ix), 0.0) * full_text_weight +
+     coalesce(1.0 / (rrf_k + semantic.rank_ix), 0.0) * semantic_weight)::float as score,
+    case
+      when full_text.id is not null and semantic.id is not null then 'hybrid'
+      when full_text.id is not null then 'lexical'
+      else 'semantic'
+    end as match_type
+  from full_text
+  full outer join semantic on full_text.id = semantic.id
+  join document_chunks c on c.id = coalesce(full_text.id, semantic.id)
+  where full_text.id is not null
+    or 1 - (c.embedding <=> query_embedding) > match_threshold
+  -- By position: a bare "score" would be ambiguous with the output column
+  order by 5 desc
   limit match_count;
 end;
 $$;
 
+-- ============================================
+-- INGESTION STATISTICS FUNCTION
+-- ============================================
+-- missing_embeddings excludes near-duplicates, which are stored without
+-- an embedding on purpose and counted in linked_duplicates instead.
+-- duplicate_content counts rows whose exact content appears earlier in
+-- the same regulation.
+create or replace function chunk_stats()
+returns table (
+  regulation text,
+  chunks bigint,
+  missing_embeddings bigint,
+  linked_duplicates bigint,
+  duplicate_content bigint,
+  avg_chars numeric
+)
+language sql
+stable
+set search_path = public
+as $$
+  select
+    coalesce(document_chunks.regulation, 'Unknown') as regulation,
+    count(*) as chunks,
+    count(*) filter (where embedding is null and not coalesce(metadata ? 'duplicate_of', false)) as missing_embeddings,
+    count(*) filter (where metadata ? 'duplicate_of') as linked_duplicates,
+    count(*) - count(distinct md5(coalesce(content, ''))) as duplicate_content,
+    round(avg(length(content)), 1) as avg_chars
+  from document_chunks
+  group by 1
+  order by 1;
+$$;
+
+-- ============================================
+-- QUERY RESULT CACHE
+-- hybrid_search results per normalized question, embedding model and
+-- match_count (see migrations/20261018050000_query_cache.sql)
+-- ============================================
+create table public.query_cache (
+  query_key text not null,
+  model text not null,
+  top_k int not null,
+  query text not null,
+  embedding vector(1536) not null,
+  threshold float not null,
+  chunk_ids bigint[] not null,
+  similarities float[] not null,
+  scores float[] not null,
+  match_types text[] not null,
+  corpus_version bigint not null,
+  source text not null default 'chat',
+  hits bigint not null default 0,
+  created_at timestamptz not null default now(),
+  refreshed_at timestamptz not null default now(),
+  last_hit_at timestamptz,
+  expires_at timestamptz not null,
+  primary key (query_key, model, top_k)
+);
+
+create index idx_query_cache_expires_at
+  on public.query_cache(expires_at);
+
+-- One row: the version entries are checked against
+create table public.query_cache_state (
+  id boolean primary key default true check (id),
+  corpus_version bigint not null default 1,
+  invalidated_at timestamptz not null default now()
+);
+
+insert into public.query_cache_state default values on conflict do nothing;
+
+-- Lookups per day, over 16 shards so concurrent lookups don't queue on
+-- one row; misses are lookups - hits - refreshes
+create table public.query_cache_stats (
+  day date not null,
+  shard smallint not null default 0,
+  lookups bigint not null default 0,
+  hits bigint not null default 0,
+  refreshes bigint not null default 0,
+  primary key (day, shard)
+);
+
+alter table public.query_cache enable row level security;
+alter table public.query_cache_state enable row level security;
+alter table public.query_cache_stats enable row level security;
+
+-- Lowercase, collapse whitespace, drop trailing punctuation. Mirrored by
+-- query_key() in scripts/warm_query_cache.py.
+create or replace function query_cache_key(query_text text)
+returns text
+language sql
+immutable
+as $$
+  select regexp_replace(lower(btrim(regexp_replace(query_text, '\s+', ' ', 'g'))), '[\s?!.]+$', '');
+$$;
+
+-- Cached result arrays joined back to the chunks, in their original order
+create or replace function query_cache_rows (
+  chunk_ids bigint[],
+  similarities float[],
+  scores float[],
+  match_types text[]
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language sql
+stable
+set search_path = public
+as $$
+  select c.id, c.content, c.metadata, r.similarity, r.score, r.match_type
+  from unnest(chunk_ids, similarities, scores, match_types)
+    with ordinality as r(chunk_id, similarity, score, match_type, ord)
+  join document_chunks c on c.id = r.chunk_id
+  order by r.ord;
+$$;
+
+create or replace function query_cache_fill (
+  query_text text,
+  query_embedding vector(1536),
+  embedding_model text,
+  match_threshold float,
+  match_count int,
+  entry_source text default 'chat',
+  ttl interval default interval '7 days'
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+security definer
+as $$
+declare
+  current_version bigint;
+  result_ids bigint[];
+  result_similarities float[];
+  result_scores float[];
+  result_types text[];
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  select s.corpus_version into current_version from query_cache_state s;
+
+  select
+    array_agg(r.id order by r.ord),
+    array_agg(r.similarity order by r.ord),
+    array_agg(r.score order by r.ord),
+    array_agg(r.match_type order by r.ord)
+  into result_ids, result_similarities, result_scores, result_types
+  from hybrid_search(query_text, query_embedding, match_threshold, match_count)
+    with ordinality as r(id, content, metadata, similarity, score, match_type, ord);
+
+  if result_ids is null then
+    return;
+  end if;
+
+  insert into query_cache as q (
+    query_key, model, top_k, query, embedding, threshold, chunk_ids, similarities, scores,
+    match_types, corpus_version, source, expires_at
+  )
+  values (
+    query_cache_key(query_text), embedding_model, match_count, query_text, query_embedding, match_threshold,
+    result_ids, result_similarities, result_scores, result_types, current_version, entry_source, now() + ttl
+  )
+  on conflict (query_key, model, top_k) do update set
+    query = excluded.query,
+    embedding = excluded.embedding,
+    threshold = excluded.threshold,
+    chunk_ids = excluded.chunk_ids,
+    similarities = excluded.similarities,
+    scores = excluded.scores,
+    match_types = excluded.match_types,
+    corpus_version = excluded.corpus_version,
+    refreshed_at = now(),
+    expires_at = excluded.expires_at
+  -- A fresh entry is only replaced once it is stale, expired or for another threshold
+  where q.corpus_version <> excluded.corpus_version
+    or q.expires_at <= now()
+    or q.threshold <> excluded.threshold;
+
+  return query
+  select * from query_cache_rows(result_ids, result_similarities, result_scores, result_types);
+end;
+$$;
+
+create or replace function query_cache_lookup (
+  query_text text,
+  embedding_model text,
+  match_threshold float,
+  match_count int
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  score float,
+  match_type text
+)
+language plpgsql
+security definer
+as $$
+declare
+  current_version bigint;
+  entry query_cache%rowtype;
+  outcome text := 'miss';
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  select s.corpus_version into current_version from query_cache_state s;
+
+  select * into entry
+  from query_cache q
+  where q.query_key = query_cache_key(query_text)
+    and q.model = embedding_model
+    and q.top_k = match_count
+    and q.expires_at > now();
+
+  -- An entry cached at another threshold is a miss: signed-in users can't
+  -- fill, so a lookup must not rewrite a shared entry on their terms. The
+  -- server's fill after the miss replaces it.
+  if found and entry.threshold = match_threshold then
+    -- At most one write per entry per minute, so a popular question doesn't
+    -- serialize its lookups on the entry's row; hits counts those minutes
+    if entry.last_hit_at is null or entry.last_hit_at < now() - interval '1 minute' then
+      update query_cache q set hits = q.hits + 1, last_hit_at = now()
+      where q.query_key = entry.query_key and q.model = entry.model and q.top_k = entry.top_k
+        and (q.last_hit_at is null or q.last_hit_at < now() - interval '1 minute');
+    end if;
+
+    if entry.corpus_version = current_version then
+      outcome := 'hit';
+      return query
+      select * from query_cache_rows(entry.chunk_ids, entry.similarities, entry.scores, entry.match_types);
+    else
+      -- Re-ingested since: search again with the stored embedding and threshold
+      outcome := 'refresh';
+      return query
+      select * from query_cache_fill(entry.query, entry.embedding, embedding_model, match_threshold, match_count,
+                                     entry.source);
+    end if;
+  end if;
+
+  -- One of 16 rows per day, picked by backend, so concurrent lookups rarely wait on each other
+  insert into query_cache_stats as s (day, shard, lookups, hits, refreshes)
+  values (current_date, pg_backend_pid() % 16, 1, (outcome = 'hit')::int, (outcome = 'refresh')::int)
+  on conflict (day, shard) do update set
+    lookups = s.lookups + 1,
+    hits = s.hits + excluded.hits,
+    refreshes = s.refreshes + excluded.refreshes;
+end;
+$$;
+
+-- Batch fill for scripts/warm_query_cache.py: entries is a JSON array of
+-- {"query": text, "embedding": [1536 floats]}. Returns how many were stored
+-- (questions without results are not cached).
+create or replace function query_cache_warm (
+  entries jsonb,
+  embedding_model text,
+  match_threshold float,
+  match_count int,
+  ttl interval default interval '7 days'
+)
+returns int
+language plpgsql
+security definer
+as $$
+declare
+  entry jsonb;
+  stored int := 0;
+begin
+  -- Set search_path to public to avoid path manipulation attacks
+  set local search_path = public;
+
+  for entry in select * from jsonb_array_elements(entries) loop
+    perform 1
+    from query_cache_fill(entry->>'query', (entry->>'embedding')::vector(1536), embedding_model,
+                          match_threshold, match_count, 'warmer', ttl);
+    if found then
+      stored := stored + 1;
+    end if;
+  end loop;
+  return stored;
+end;
+$$;
+
+create or replace function invalidate_query_cache()
+returns bigint
+language sql
+security definer
+set search_path = public
+as $$
+  update query_cache_state
+  set corpus_version = corpus_version + 1, invalidated_at = now()
+  returning corpus_version;
+$$;
+
+-- stale: entries written before the last invalidation (refreshed on their
+-- next lookup); expired: past their TTL (deleted by the warmer).
+create or replace function query_cache_report(days int default 7)
+returns table (
+  entries bigint,
+  fresh bigint,
+  stale bigint,
+  expired bigint,
+  warmed bigint,
+  oldest_fresh timestamptz,
+  corpus_version bigint,
+  invalidated_at timestamptz,
+  lookups bigint,
+  hits bigint,
+  refreshes bigint
+)
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  with state as (
+    select s.corpus_version, s.invalidated_at from query_cache_state s
+  ),
+  entries as (
+    select
+      count(*) as entries,
+      count(*) filter (where q.expires_at > now() and q.corpus_version = state.corpus_version) as fresh,
+      count(*) filter (where q.expires_at > now() and q.corpus_version <> state.corpus_version) as stale,
+      count(*) filter (where q.expires_at <= now()) as expired,
+      count(*) filter (where q.source = 'warmer') as warmed,
+      min(q.refreshed_at) filter (where q.expires_at > now() and q.corpus_version = state.corpus_version) as oldest_fresh
+    from query_cache q cross join state
+  ),
+  recent as (
+    select
+      coalesce(sum(st.lookups), 0)::bigint as lookups,
+      coalesce(sum(st.hits), 0)::bigint as hits,
+      coalesce(sum(st.refreshes), 0)::bigint as refreshes
+    from query_cache_stats st
+    where st.day > current_date - days
+  )
+  select
+    entries.entries, entries.fresh, entries.stale, entries.expired, entries.warmed, entries.oldest_fresh,
+    state.corpus_version, state.invalidated_at,
+    recent.lookups, recent.hits, recent.refreshes
+  from entries, state, recent;
+$$;
+
+-- Signed-in users only look the cache up; fills take a query vector, so
+-- only the service role (the app server, ingestion, the warmer) fills,
+-- warms or invalidates it
+revoke execute on function query_cache_lookup(text, text, float, int) from public, anon;
+revoke execute on function query_cache_fill(text, vector, text, float, int, text, interval) from public, anon, authenticated;
+revoke execute on function invalidate_query_cache() from public, anon, authenticated;
+revoke execute on function query_cache_warm(jsonb, text, float, int, interval) from public, anon, authenticated;
+revoke execute on function query_cache_report(int) from public, anon, authenticated;
+grant execute on function query_cache_lookup(text, text, float, int) to authenticated, service_role;
+grant execute on function query_cache_fill(text, vector, text, float, int, text, interval) to service_role;
+grant execute on function invalidate_query_cache() to service_role;
+grant execute on function query_cache_warm(jsonb, text, float, int, interval) to service_role;
+grant execute on function query_cache_report(int) to service_role;
+
 -- ============================================
 -- CHAT PERSISTENCE TABLES
 -- Stores chat conversations and messages